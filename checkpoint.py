@@ -0,0 +1,240 @@
+import asyncio
+import marshal
+import mmap
+import os
+import struct
+import time
+import zlib
+from typing import Dict, Optional
+
+CHECKPOINT_MAGIC = b'HFCK'
+CHECKPOINT_FORMAT = 2
+DEFAULT_SLOT_SIZE = 4 * 1024 * 1024
+FULL_EVERY = 24  # 每個基底之後最多接幾筆增量，之後改寫完整快照（限制還原時間）
+
+# 檔頭：magic、格式版本、marshal 版本、每個 slot 的大小
+FILE_HEADER = struct.Struct('<4sHHI')
+# 記錄檔頭（基底與增量共用）：序號、資料長度、crc32、寫入時間
+SLOT_HEADER = struct.Struct('<QIId')
+
+
+class CheckpointFile:
+    # 雙緩衝的 mmap 檔案。每個 slot 是一份完整快照（基底）接著幾筆增量，
+    # 增量只含變動過的玩家 / 怪物記錄與其餘的小型狀態。新基底永遠寫進另一個 slot，
+    # 每筆記錄都是資料寫完才寫檔頭，寫到一半當機時 crc 或序號對不上，
+    # 還原只會讀到前一筆為止
+
+    def __init__(self, path, slot_size=DEFAULT_SLOT_SIZE, keyed_sections=()):
+        self.path = path
+        self.slot_size = slot_size
+        # image 中以記錄第一個欄位為 key 的清單，只有這些做增量
+        self.keyed_sections = tuple(keyed_sections)
+        self.mm: Optional[mmap.mmap] = None
+        self.seq = 0
+        self.busy = False
+        self.last_duration = 0.0
+        self.last_size = 0
+
+        # 目前的基底所在 slot、下一筆增量的位置、已接的增量數
+        self.active: Optional[int] = None
+        self.tail = 0
+        self.deltas = 0
+        # 已寫入（基底加增量）的記錄：(section, key) -> marshal bytes
+        self.records: Dict[tuple, bytes] = {}
+
+    def _slot_offset(self, slot):
+        return FILE_HEADER.size + slot * self.slot_size
+
+    def _read_file_slot_size(self):
+        if not os.path.exists(self.path):
+            return None
+        with open(self.path, 'rb') as f:
+            header = f.read(FILE_HEADER.size)
+        if len(header) != FILE_HEADER.size:
+            return None
+        magic, fmt, marshal_version, slot_size = FILE_HEADER.unpack(header)
+        if (magic != CHECKPOINT_MAGIC or fmt != CHECKPOINT_FORMAT
+                or marshal_version != marshal.version):
+            return None
+        return slot_size
+
+    def _open(self):
+        # 沿用現有檔案；檔案不存在或格式不符時重建
+        self.close()
+        slot_size = self._read_file_slot_size()
+        fresh = slot_size is None
+        if not fresh:
+            self.slot_size = slot_size
+
+        total = FILE_HEADER.size + 2 * self.slot_size
+        with open(self.path, 'a+b') as f:
+            if fresh:
+                f.truncate(0)
+            f.truncate(total)
+        with open(self.path, 'r+b') as f:
+            self.mm = mmap.mmap(f.fileno(), total)
+        if fresh:
+            self.mm[:FILE_HEADER.size] = FILE_HEADER.pack(
+                CHECKPOINT_MAGIC, CHECKPOINT_FORMAT, marshal.version,
+                self.slot_size)
+            self.active = None
+
+    def _read_entry(self, offset, end, after_seq):
+        # 回傳 (序號, 寫入時間, 資料, 下一筆位置)；序號沒有遞增或 crc 不符時回傳 None
+        if offset + SLOT_HEADER.size > end:
+            return None
+        seq, length, crc, saved_at = SLOT_HEADER.unpack_from(self.mm, offset)
+        start = offset + SLOT_HEADER.size
+        if seq <= after_seq or start + length > end:
+            return None
+        payload = self.mm[start:start + length]
+        if zlib.crc32(payload) != crc:
+            return None
+        return seq, saved_at, payload, start + length
+
+    def _read_slot(self, slot):
+        # 基底加上後面連續有效的增量
+        offset = self._slot_offset(slot)
+        end = offset + self.slot_size
+        base = self._read_entry(offset, end, 0)
+        if base is None:
+            return None
+        entries = [base]
+        while True:
+            entry = self._read_entry(entries[-1][3], end, entries[-1][0])
+            if entry is None:
+                return entries
+            entries.append(entry)
+
+    def _apply(self, records, payload):
+        rest, changed, removed = marshal.loads(zlib.decompress(payload))
+        for key in removed:
+            records.pop(key, None)
+        for section, key, record in changed:
+            records[(section, key)] = record
+        return rest
+
+    def load_latest(self):
+        if not os.path.exists(self.path):
+            return None
+        self._open()
+        best = None
+        for slot in (0, 1):
+            entries = self._read_slot(slot)
+            if entries and (best is None or entries[0][0] > best[1][0][0]):
+                best = (slot, entries)
+        if best is None:
+            return None
+        slot, entries = best
+        records: Dict[tuple, bytes] = {}
+        try:
+            for _, _, payload, _ in entries:
+                rest = self._apply(records, payload)
+            image = dict(rest)
+            for section in self.keyed_sections:
+                image[section] = []
+            for (section, _), record in records.items():
+                image[section].append(marshal.loads(record))
+        except (ValueError, EOFError, TypeError, KeyError, zlib.error):
+            return None
+
+        self.seq = entries[-1][0]
+        self.active = slot
+        self.tail = entries[-1][3]
+        self.deltas = len(entries) - 1
+        self.records = records
+        return image
+
+    def _split(self, image):
+        # 把 keyed 清單拆成 (section, key) -> marshal bytes，其餘欄位原樣保留
+        rest = {k: v for k, v in image.items() if k not in self.keyed_sections}
+        records = {}
+        for section in self.keyed_sections:
+            for record in image.get(section, ()):
+                records[(section, record[0])] = marshal.dumps(record)
+        return rest, records
+
+    def _encode(self, rest, records, previous):
+        changed = [(section, key, record)
+                   for (section, key), record in records.items()
+                   if previous.get((section, key)) != record]
+        removed = [key for key in previous if key not in records]
+        return zlib.compress(marshal.dumps((rest, changed, removed)), 1)
+
+    def _put(self, offset, payload):
+        start = offset + SLOT_HEADER.size
+        self.mm[start:start + len(payload)] = payload
+        self.mm.flush()
+        self.seq += 1
+        SLOT_HEADER.pack_into(self.mm, offset, self.seq, len(payload),
+                              zlib.crc32(payload), time.time())
+        self.mm.flush()
+        return start + len(payload)
+
+    def _grow(self, slot_size):
+        # 在暫存檔建好較大的檔案，把目前的基底與增量原樣搬過去再換掉原檔；
+        # 換檔之前原檔完全不動，換檔之後上一份快照仍然可以還原
+        tmp = self.path + '.tmp'
+        with open(tmp, 'wb') as f:
+            f.truncate(FILE_HEADER.size + 2 * slot_size)
+            f.write(
+                FILE_HEADER.pack(CHECKPOINT_MAGIC, CHECKPOINT_FORMAT,
+                                 marshal.version, slot_size))
+            if self.active is not None:
+                start = self._slot_offset(self.active)
+                f.seek(FILE_HEADER.size + self.active * slot_size)
+                f.write(self.mm[start:self.tail])
+            f.flush()
+            os.fsync(f.fileno())
+        if self.active is not None:
+            self.tail += self.active * (slot_size - self.slot_size)
+        self.close()
+        os.replace(tmp, self.path)
+        self._open()
+
+    def write(self, image):
+        started = time.perf_counter()
+        if self.mm is None:
+            self._open()
+        rest, records = self._split(image)
+
+        payload = None
+        if self.active is not None and self.deltas < FULL_EVERY:
+            payload = self._encode(rest, records, self.records)
+            slot_end = self._slot_offset(self.active) + self.slot_size
+            if self.tail + SLOT_HEADER.size + len(payload) > slot_end:
+                payload = None
+
+        if payload is not None:
+            self.tail = self._put(self.tail, payload)
+            self.deltas += 1
+        else:
+            payload = self._encode(rest, records, {})
+            if len(payload) > self.slot_size - SLOT_HEADER.size:
+                new_size = self.slot_size
+                while len(payload) > new_size - SLOT_HEADER.size:
+                    new_size *= 2
+                self._grow(new_size)
+            slot = 0 if self.active is None else 1 - self.active
+            self.tail = self._put(self._slot_offset(slot), payload)
+            self.active = slot
+            self.deltas = 0
+        self.records = records
+
+        self.last_size = len(payload)
+        self.last_duration = time.perf_counter() - started
+
+    async def save(self, image):
+        # 編碼、壓縮與寫檔都在執行緒內，不佔用遊戲迴圈
+        self.busy = True
+        try:
+            await asyncio.to_thread(self.write, image)
+        except Exception as e:
+            print(f"Checkpoint failed: {e}")
+        finally:
+            self.busy = False
+
+    def close(self):
+        if self.mm is not None:
+            self.mm.close()
+            self.mm = None
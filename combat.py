@@ -0,0 +1,113 @@
+from typing import Dict, List, Optional, Tuple
+
+# 戰鬥事件代碼（與 index.html 的 EV 對應）
+EV_HIT = 1
+EV_KILL = 2
+EV_DROP = 3
+EV_LEVEL_UP = 4
+EV_RESPAWN = 5
+EV_SKILL_CAST = 6
+
+EVENT_RADIUS = 1000  # 與自己無關的事件只送給這個距離內的玩家
+
+
+class EventBuffer:
+    # 每個廣播週期的事件緩衝，格式 [code, x, y, src, dst, value]
+
+    def __init__(self):
+        self.events: List[list] = []
+
+    def emit(self, code, x, y, src=None, dst=None, value=None):
+        self.events.append([code, round(x), round(y), src, dst, value])
+
+    def drain(self):
+        events = self.events
+        self.events = []
+        return events
+
+
+def events_for(events, player_id, x, y, radius=EVENT_RADIUS):
+    # player_id 為 None 時（觀戰鏡頭）只依距離篩選
+    r2 = radius * radius
+    out = []
+    for ev in events:
+        if player_id is not None and (ev[3] == player_id
+                                      or ev[4] == player_id):
+            out.append(ev)
+            continue
+        dx = ev[1] - x
+        dy = ev[2] - y
+        if dx * dx + dy * dy <= r2:
+            out.append(ev)
+    return out
+
+
+class DamageLedger:
+    # 單隻怪物的傷害貢獻，每次命中就更新最高貢獻者，擊殺時不必再掃描
+
+    def __init__(self):
+        self.totals: Dict[str, float] = {}
+        self.top_id: Optional[str] = None
+        self.top_damage = 0.0
+        self.dirty = False
+
+    def add(self, attacker_id, dmg):
+        total = self.totals.get(attacker_id, 0) + dmg
+        self.totals[attacker_id] = total
+        if total > self.top_damage:
+            self.top_damage = total
+            self.top_id = attacker_id
+        self.dirty = True
+        return total
+
+    def ranking(self, limit=None) -> List[Tuple[str, float]]:
+        return sorted(self.totals.items(), key=lambda kv: kv[1],
+                      reverse=True)[:limit]
+
+    def clear(self):
+        self.totals = {}
+        self.top_id = None
+        self.top_damage = 0.0
+        self.dirty = False
+
+
+class CombatPipeline:
+    # 所有命中都從這裡走：扣血、記錄貢獻、把本 tick 死亡的目標排入佇列
+
+    def __init__(self):
+        self.monster_deaths: List = []
+        self.player_deaths: List[Tuple] = []  # (玩家, 擊殺者 id)
+        self.events = EventBuffer()
+
+    def hit_monster(self, monster, attacker_id, dmg):
+        before = monster.hp
+        monster.hp -= dmg
+        monster.ledger.add(attacker_id, dmg)
+        monster.target_player = attacker_id
+        monster.state = 'chase'
+        self.events.emit(EV_HIT, monster.x, monster.y, attacker_id,
+                         monster.spawn_id, round(dmg))
+        if before > 0 >= monster.hp:
+            self.monster_deaths.append(monster)
+
+    def hit_player(self, target, attacker_id, dmg):
+        target.hp -= dmg
+        self.events.emit(EV_HIT, target.x, target.y, attacker_id, target.id,
+                         round(dmg))
+        if target.hp <= 0 and target.alive:
+            target.hp = 0
+            target.alive = False
+            target.respawn_timer = 3
+            self.events.emit(EV_KILL, target.x, target.y, attacker_id,
+                             target.id)
+            self.player_deaths.append((target, attacker_id))
+
+    def drain_monster_deaths(self):
+        deaths = self.monster_deaths
+        self.monster_deaths = []
+        return deaths
+
+    def drain_player_deaths(self):
+        deaths = self.player_deaths
+        self.player_deaths = []
+        return deaths
@@ -0,0 +1,185 @@
+import math
+from array import array
+from collections import deque
+from typing import Dict, Iterable, List, Optional, Tuple
+
+FIELD_CELL = 100  # 流場格子大小（px）
+CLUSTER_SIZE = 600  # 玩家依此大小分群，同一群共用一張流場
+MAX_REBUILDS_PER_TICK = 1  # 每 tick 最多重建幾張流場，其餘沿用上一版
+DIRECT_STEER_DIST = FIELD_CELL * 1.5  # 距離目標很近時直接朝目標走
+
+UNREACHABLE = 0xFFFF
+
+_NEIGHBORS = ((-1, -1), (0, -1), (1, -1), (-1, 0), (1, 0), (-1, 1), (0, 1),
+              (1, 1))
+
+
+class Grid:
+
+    def __init__(self, width, height, cell=FIELD_CELL, obstacles=()):
+        self.cell = cell
+        self.cols = math.ceil(width / cell)
+        self.rows = math.ceil(height / cell)
+        self.blocked = bytearray(self.cols * self.rows)
+        self.has_obstacles = False
+        for x, y, w, h in obstacles:
+            self.block_rect(x, y, w, h)
+        # 每格可走的相鄰格，地形變動時重算；open_links 忽略障礙，用來判斷是否需要繞路
+        self.links = self._build_links(self.blocked)
+        self.open_links = self._build_links(bytes(len(self.blocked)))
+
+    def block_rect(self, x, y, w, h):
+        c0 = max(0, int(x // self.cell))
+        r0 = max(0, int(y // self.cell))
+        c1 = min(self.cols - 1, int((x + w - 1) // self.cell))
+        r1 = min(self.rows - 1, int((y + h - 1) // self.cell))
+        for r in range(r0, r1 + 1):
+            for c in range(c0, c1 + 1):
+                self.blocked[r * self.cols + c] = 1
+                self.has_obstacles = True
+
+    def _build_links(self, blocked):
+        cols, rows = self.cols, self.rows
+        links = []
+        for idx in range(cols * rows):
+            r, c = divmod(idx, cols)
+            cell = []
+            if not blocked[idx]:
+                for dc, dr in _NEIGHBORS:
+                    nc = c + dc
+                    nr = r + dr
+                    if not (0 <= nc < cols and 0 <= nr < rows):
+                        continue
+                    if blocked[nr * cols + nc]:
+                        continue
+                    # 斜向不能穿過兩個障礙的夾角
+                    if dc and dr and (blocked[r * cols + nc]
+                                      or blocked[nr * cols + c]):
+                        continue
+                    cell.append(nr * cols + nc)
+            links.append(tuple(cell))
+        return links
+
+    def index(self, x, y):
+        c = min(self.cols - 1, max(0, int(x // self.cell)))
+        r = min(self.rows - 1, max(0, int(y // self.cell)))
+        return r * self.cols + c
+
+    def is_blocked(self, x, y):
+        return self.blocked[self.index(x, y)] == 1
+
+
+def _bfs(links, goals, blocked):
+    dist = array('H', [UNREACHABLE]) * len(links)
+    queue = deque()
+    for idx in goals:
+        if not blocked[idx]:
+            dist[idx] = 0
+            queue.append(idx)
+
+    while queue:
+        idx = queue.popleft()
+        d = dist[idx] + 1
+        for nidx in links[idx]:
+            if dist[nidx] > d:
+                dist[nidx] = d
+                queue.append(nidx)
+    return dist
+
+
+class FlowField:
+    # 以多個目標格為起點做 BFS 得到距離場，再預先算好每格的移動方向。
+    # 最短路徑不需繞路的格子標記為 clear，怪物在這些格子直接朝目標走，
+    # 直走被擋住時才改用 detour 的方向
+
+    def __init__(self, grid: Grid, goals: frozenset):
+        self.grid = grid
+        self.goals = goals
+        n = grid.cols * grid.rows
+        self.dir_x = array('f', bytes(4 * n))
+        self.dir_y = array('f', bytes(4 * n))
+        self.dist = _bfs(grid.links, goals, grid.blocked)
+        free = _bfs(grid.open_links, goals, bytes(n))
+        self.clear = bytes(map(int.__eq__, self.dist, free))
+        self._build()
+
+    def _build(self):
+        cols = self.grid.cols
+        dist = self.dist
+        for idx, links in enumerate(self.grid.links):
+            d0 = dist[idx]
+            if d0 == 0 or d0 == UNREACHABLE:
+                continue
+            best = min(links, key=dist.__getitem__)
+            r, c = divmod(idx, cols)
+            br, bc = divmod(best, cols)
+            bx = bc - c
+            by = br - r
+            length = math.hypot(bx, by)
+            self.dir_x[idx] = bx / length
+            self.dir_y[idx] = by / length
+
+    def direction(self, x, y, detour=False) -> Optional[Tuple[float, float]]:
+        idx = self.grid.index(x, y)
+        if self.clear[idx] and not detour:
+            return None
+        dx = self.dir_x[idx]
+        dy = self.dir_y[idx]
+        if dx == 0 and dy == 0:
+            return None
+        return dx, dy
+
+
+class FlowFields:
+    # 整個房間共用：每 tick 依玩家分群更新流場，怪物移動時只查表
+
+    def __init__(self, grid: Grid):
+        self.grid = grid
+        self.fields: Dict[Tuple[int, int], FlowField] = {}
+        self.rebuilds = 0
+
+    @staticmethod
+    def cluster_key(x, y):
+        return int(x // CLUSTER_SIZE), int(y // CLUSTER_SIZE)
+
+    def update(self, players: Iterable):
+        # 沒有障礙物時所有格子都能直線到達，不需要流場
+        if not self.grid.has_obstacles:
+            return
+        goals: Dict[Tuple[int, int], set] = {}
+        for player in players:
+            if player.alive:
+                key = self.cluster_key(player.x, player.y)
+                goals.setdefault(key, set()).add(
+                    self.grid.index(player.x, player.y))
+
+        for key in list(self.fields):
+            if key not in goals:
+                del self.fields[key]
+
+        stale: List[Tuple[int, int]] = []
+        for key, cells in goals.items():
+            field = self.fields.get(key)
+            if field is None or field.goals != cells:
+                stale.append(key)
+        # 新群優先，已有流場的群晚幾個 tick 更新也沒關係
+        stale.sort(key=lambda k: k in self.fields)
+        for key in stale[:MAX_REBUILDS_PER_TICK]:
+            self.fields[key] = FlowField(self.grid, frozenset(goals[key]))
+            self.rebuilds += 1
+
+    def steer(self, x, y, target_x, target_y, dist):
+        # 回傳朝目標前進的單位向量
+        if dist > DIRECT_STEER_DIST and self.fields:
+            field = self.fields.get(self.cluster_key(target_x, target_y))
+            if field is not None:
+                direction = field.direction(x, y)
+                if direction is not None:
+                    return direction
+        return (target_x - x) / dist, (target_y - y) / dist
+
+    def detour(self, x, y, target_x, target_y):
+        field = self.fields.get(self.cluster_key(target_x, target_y))
+        if field is None:
+            return None
+        return field.direction(x, y, detour=True)
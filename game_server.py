@@ -1,14 +1,66 @@
 import asyncio
-import json
+import os
 import random
 import math
+import secrets
 import time
+from collections import deque
 from typing import Dict, List, Optional
 from aiohttp import web
 
+from checkpoint import CheckpointFile
+from combat import (CombatPipeline, DamageLedger, EV_DROP, EV_KILL,
+                    EV_LEVEL_UP, EV_RESPAWN, EV_SKILL_CAST, events_for)
+from flowfield import FlowFields, Grid
+from governor import TickGovernor
+from inventory import Inventory
+from io_tier import IOTier
+from leaderboard import CACHE_TTL, MAX_TOP, SCORES, Leaderboards
+from lagcomp import PositionHistory
+from net_guard import (MAX_MESSAGE_SIZE, SPECTATOR_RATE_LIMITS,
+                       SPECTATOR_SCHEMAS, ConnectionGuard)
+from net_guard import stats as guard_stats
+from replication import Snapshot, ViewScheduler, encode
+from spawner import SPAWN_INTERVAL, Spawner
+from spectate import MAX_SPECTATORS, SpectatorHub
+from static_assets import (BUNDLE_CACHE_CONTROL, STATIC_DIR, StaticAssets,
+                           etag_matches)
+from telemetry import FLUSH_INTERVAL as TELEMETRY_FLUSH_INTERVAL, Telemetry
+from ws_compress import SharedFrame, TunedWebSocketResponse
+from ws_compress import stats_dict as compression_stats
+
 MAP_W = 3000
 MAP_H = 2000
 
+# 地形障礙 (x, y, w, h)：怪物不能走進去，追擊時依流場繞路。
+# 目前地圖還沒有地形，這裡是預留的接點；加入地形前玩家移動、生成位置與客戶端
+# 預測也要跟著處理碰撞
+OBSTACLES = []
+
+TICK_RATE = 30
+
+PORT = 8888
+# IO_WORKERS > 0 時由多個 worker 行程接受玩家連線，本行程只跑模擬；
+# 狀態頁、排行榜與觀戰改由本機的 ADMIN_PORT 提供，worker 收到的請求轉過來
+IO_WORKERS = int(os.environ.get('IO_WORKERS', '0'))
+ADMIN_PORT = 8889
+
+RESUME_GRACE = 30.0  # 斷線後保留角色等待重連的秒數
+EVENT_HISTORY_TICKS = 150  # 保留最近幾次廣播的事件，重連時補送
+MAX_MISSED_EVENTS = 200
+
+CHECKPOINT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                               'world.ckpt')
+CHECKPOINT_INTERVAL = 5.0  # 世界快照寫檔間隔（秒）
+
+# 遊戲事件記錄的輸出目錄；設為空字串停用
+TELEMETRY_DIR = os.environ.get(
+    'TELEMETRY_DIR',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'telemetry'))
+
+BOSS_BOARD_INTERVAL = 1.0  # Boss 傷害排行推送間隔（秒）
+BOSS_BOARD_SIZE = 5
+
 MONSTER_TYPES = {
     'BASIC': {
         'id': 'basic',
@@ -70,46 +122,69 @@ BOSS_TYPE = {
     'isBoss': True
 }
 
-MONSTER_SPAWNS = [{
-    'x': 500,
-    'y': 500,
-    'type': 'BASIC'
-}, {
-    'x': 2500,
-    'y': 400,
-    'type': 'FAST'
-}, {
-    'x': 700,
-    'y': 1600,
-    'type': 'TANK'
+# 一般怪物的生成區域：區域內依附近玩家數量維持怪物，types 為種類權重
+SPAWN_REGIONS = [{
+    'x': 200,
+    'y': 200,
+    'w': 800,
+    'h': 600,
+    'weight': 1.0,
+    'types': {
+        'BASIC': 3,
+        'FAST': 1
+    }
 }, {
-    'x': 2600,
-    'y': 1500,
-    'type': 'BASIC'
+    'x': 2000,
+    'y': 150,
+    'w': 850,
+    'h': 600,
+    'weight': 1.0,
+    'types': {
+        'BASIC': 2,
+        'FAST': 2
+    }
 }, {
-    'x': 1500,
-    'y': 100,
-    'type': 'BASIC'
+    'x': 1000,
+    'y': 700,
+    'w': 1000,
+    'h': 500,
+    'weight': 0.8,
+    'types': {
+        'BASIC': 2,
+        'FAST': 1,
+        'TANK': 1
+    }
 }, {
     'x': 100,
-    'y': 1000,
-    'type': 'FAST'
-}, {
-    'x': 2900,
-    'y': 1000,
-    'type': 'BASIC'
-}, {
-    'x': 1500,
-    'y': 1900,
-    'type': 'TANK'
+    'y': 900,
+    'w': 700,
+    'h': 900,
+    'weight': 1.0,
+    'types': {
+        'BASIC': 1,
+        'FAST': 2,
+        'TANK': 1
+    }
 }, {
-    'x': 400,
-    'y': 1200,
-    'type': 'FAST'
+    'x': 2200,
+    'y': 900,
+    'w': 700,
+    'h': 900,
+    'weight': 1.0,
+    'types': {
+        'BASIC': 3,
+        'TANK': 1
+    }
 }, {
-    'x': 2000,
-    'y': 1700,
-    'type': 'BASIC'
+    'x': 900,
+    'y': 1300,
+    'w': 1200,
+    'h': 600,
+    'weight': 1.2,
+    'types': {
+        'BASIC': 2,
+        'TANK': 2
+    }
 }]
 
 BOSS_SPAWN = {'x': 1500, 'y': 300, 'type': 'BOSS'}
@@ -196,11 +271,20 @@ WEAPON_DEFINITIONS = {
     }
 }
 
+# 玩家可能的最大移動速度（一般移動或位移武器），延遲補償粗篩用
+PLAYER_MAX_SPEED = max([300] + [
+    w['dashDistance'] / w['dashDuration']
+    for w in WEAPON_DEFINITIONS.values() if w.get('isDash')
+])
+
 
 class Monster:
 
-    def __init__(self, spawn_id, x, y, monster_type, is_boss=False):
+    def __init__(self, spawn_id, x, y, monster_type, is_boss=False,
+                 region=None):
         self.spawn_id = spawn_id
+        self.monster_type = monster_type
+        self.region = region  # 生成區域索引，Boss 為 None
         self.x = x
         self.y = y
         self.spawn_x = x
@@ -234,7 +318,45 @@ class Monster:
         self.skill_executed = False
         self.skill_target_x = 0.0
         self.skill_target_y = 0.0
-        self.damage_contributors: Dict[str, float] = {}
+        self.ledger = DamageLedger()
+
+    def to_image(self):
+        return (self.spawn_id, self.monster_type, self.is_boss, self.x, self.y,
+                self.spawn_x, self.spawn_y, self.hp, self.alive,
+                self.respawn_timer, self.target_player, self.state,
+                self.wander_dir, self.wander_timer, self.attack_cooldown,
+                self.skill_cooldown, self.skill_prepare_time, self.skill_type,
+                self.skill_executed, self.skill_target_x, self.skill_target_y,
+                tuple(self.ledger.totals.items()), self.region)
+
+    @classmethod
+    def from_image(cls, image):
+        (spawn_id, monster_type, is_boss, x, y, spawn_x, spawn_y, hp, alive,
+         respawn_timer, target_player, state, wander_dir, wander_timer,
+         attack_cooldown, skill_cooldown, skill_prepare_time, skill_type,
+         skill_executed, skill_target_x, skill_target_y, totals,
+         region) = image
+        monster = cls(spawn_id, spawn_x, spawn_y, monster_type, is_boss,
+                      region)
+        monster.x = x
+        monster.y = y
+        monster.hp = hp
+        monster.alive = alive
+        monster.respawn_timer = respawn_timer
+        monster.target_player = target_player
+        monster.state = state
+        monster.wander_dir = wander_dir
+        monster.wander_timer = wander_timer
+        monster.attack_cooldown = attack_cooldown
+        monster.skill_cooldown = skill_cooldown
+        monster.skill_prepare_time = skill_prepare_time
+        monster.skill_type = skill_type
+        monster.skill_executed = skill_executed
+        monster.skill_target_x = skill_target_x
+        monster.skill_target_y = skill_target_y
+        for attacker_id, dmg in totals:
+            monster.ledger.add(attacker_id, dmg)
+        return monster
 
     def to_dict(self):
         data = {
@@ -247,8 +369,7 @@ class Monster:
             'color': self.color,
             'level': self.level,
             'alive': self.alive,
-            'isBoss': self.is_boss,
-            'state': self.state
+            'isBoss': self.is_boss
         }
         if self.is_boss and self.skill_prepare_time > 0:
             warning = {
@@ -284,18 +405,25 @@ class Player:
         self.dirY = 0.0
         self.faceX = 1.0
         self.faceY = 0.0
-        self.inventory: List[dict] = []
-        self.equipment: Dict[str, dict | None] = {
-            'E': None,
-            'R': None,
-            'W': None
-        }  # E = Skill 2, R = Skill 3, W = passive
+        self.inventory = Inventory()
+        self.sent_inventory_version = -1  # 已送給客戶端的背包版本
+        self.view = ViewScheduler()  # 其他實體的送出排程
         self.skill_cooldowns = {1: 0.0, 2: 0.0, 3: 0.0}
         self.attack_cooldown = 0.0
         self.respawn_timer = 0.0
         self.alive = True
         self.orb_hit_times: Dict[str, float] = {}
+        self.pvp_kills = 0
+        self.boss_kills = 0
         self.ws: Optional[web.WebSocketResponse] = None
+        self.resume_token = secrets.token_urlsafe(16)
+        self.detached_at: Optional[float] = None
+
+        # 客戶端預測校正用：最後處理的移動輸入序號，以及套用後經過的模擬時間
+        self.input_seq = 0
+        self.input_time = 0.0
+        # 客戶端畫面落後伺服器的秒數，投射物命中依此倒帶
+        self.view_lag = 0.0
 
         # 新增：位移狀態
         self.is_dashing = False
@@ -306,7 +434,7 @@ class Player:
         self.dash_damage = 0.0
         self.dash_hit_entities = set()
 
-        self.inventory.append({
+        self.inventory.add({
             'id': 'healing_potion',
             'name': '治療藥水',
             'icon': 'HP',
@@ -315,8 +443,8 @@ class Player:
             'isWeapon': False
         })
 
-    def to_dict(self):
-        return {
+    def to_dict(self, with_inventory=True):
+        data = {
             'id': self.id,
             'name': self.name,
             'x': self.x,
@@ -330,18 +458,101 @@ class Player:
             'baseAttack': self.baseAttack,
             'gold': self.gold,
             'color': self.color,
+            'speed': self.speed,
             'faceX': self.faceX,
             'faceY': self.faceY,
             'alive': self.alive,
-            'inventory': self.inventory,
-            'equipment': self.equipment,
+            'invVersion': self.inventory.version,
+            'dashSpec': self.dash_spec(),
             # 新增位移狀態同步
             'is_dashing': self.is_dashing,
             'dash_dir_x': self.dash_dir_x if self.is_dashing else 0,
             'dash_dir_y': self.dash_dir_y if self.is_dashing else 0
         }
+        if with_inventory:
+            inventory = self.inventory.to_dict()
+            data['inventory'] = inventory['items']
+            data['equipment'] = inventory['equipment']
+        return data
+
+    def to_image(self):
+        return (self.id, self.name, self.x, self.y, self.hp, self.maxHp,
+                self.level, self.exp, self.expToNextLevel, self.baseAttack,
+                self.gold, self.color, self.faceX, self.faceY, self.alive,
+                self.respawn_timer, self.resume_token,
+                tuple(self.skill_cooldowns.values()), self.attack_cooldown,
+                self.inventory.to_image(), self.pvp_kills, self.boss_kills)
+
+    @classmethod
+    def from_image(cls, image):
+        (player_id, name, x, y, hp, max_hp, level, exp, exp_to_next,
+         base_attack, gold, color, face_x, face_y, alive, respawn_timer,
+         resume_token, skill_cooldowns, attack_cooldown, inventory,
+         pvp_kills, boss_kills) = image
+        player = cls(player_id, name)
+        player.x = x
+        player.y = y
+        player.hp = hp
+        player.maxHp = max_hp
+        player.level = level
+        player.exp = exp
+        player.expToNextLevel = exp_to_next
+        player.baseAttack = base_attack
+        player.gold = gold
+        player.color = color
+        player.faceX = face_x
+        player.faceY = face_y
+        player.alive = alive
+        player.respawn_timer = respawn_timer
+        player.resume_token = resume_token
+        player.skill_cooldowns = dict(zip((1, 2, 3), skill_cooldowns))
+        player.attack_cooldown = attack_cooldown
+        player.inventory.load_image(inventory)
+        player.pvp_kills = pvp_kills
+        player.boss_kills = boss_kills
+        return player
+
+    def resync(self):
+        # 客戶端的畫面已不可信：背包與其他實體下次全部重送
+        self.sent_inventory_version = -1
+        self.view.reset()
+
+    def dash_spec(self):
+        equipped = self.inventory.equipped('E')
+        weapon_def = WEAPON_DEFINITIONS.get(
+            equipped.id) if equipped else None
+        if weapon_def and weapon_def.get('isDash'):
+            return [weapon_def['dashDistance'], weapon_def['dashDuration']]
+        return None
+
+    def to_public_dict(self):
+        # 給其他玩家看的精簡版本，不含背包、經驗、金幣等私人欄位
+        weapon = self.inventory.equipped('W')
+        return {
+            'id': self.id,
+            'name': self.name,
+            'x': self.x,
+            'y': self.y,
+            'r': self.r,
+            'hp': self.hp,
+            'maxHp': self.maxHp,
+            'level': self.level,
+            'color': self.color,
+            'faceX': self.faceX,
+            'faceY': self.faceY,
+            'alive': self.alive,
+            'equipment': {
+                'W': {
+                    'level': weapon.level
+                } if weapon else None
+            },
+            'is_dashing': self.is_dashing,
+            'dash_dir_x': self.dash_dir_x if self.is_dashing else 0,
+            'dash_dir_y': self.dash_dir_y if self.is_dashing else 0
+        }
 
     def add_exp(self, amount):
+        levels = 0
         self.exp += amount
         while self.exp >= self.expToNextLevel:
             self.exp -= self.expToNextLevel
@@ -350,21 +561,14 @@ class Player:
             self.maxHp += 10
             self.hp = self.maxHp
             self.baseAttack += 2
+            levels += 1
+        return levels
 
     def add_gold(self, amount):
         self.gold += amount
 
     def add_to_inventory(self, item):
-        if len(self.inventory) < 12:
-            for existing in self.inventory:
-                if existing.get('id') == item.get(
-                        'id') and not item.get('isWeapon'):
-                    existing['count'] = existing.get('count', 1) + item.get(
-                        'count', 1)
-                    return True
-            self.inventory.append(item)
-            return True
-        return False
+        return self.inventory.add(item)
 
 
 class GameState:
@@ -375,13 +579,23 @@ class GameState:
         self.projectiles: List[dict] = []
         self.lasers: List[dict] = []
         self.meteors: List[dict] = []
+        self.combat = CombatPipeline()
+        self.grid = Grid(MAP_W, MAP_H, obstacles=OBSTACLES)
+        self.flow = FlowFields(self.grid)
+        self.clock = time.time  # 模擬時間來源；離線模擬（simulate.py）換成自己的時鐘
         self.last_update = time.time()
-
-        for i, spawn in enumerate(MONSTER_SPAWNS):
-            monster = Monster(f'monster_{i}', spawn['x'], spawn['y'],
-                              spawn['type'])
-            self.monsters.append(monster)
-
+        self.last_boss_board = 0.0
+        self.tick = 0
+        self.sessions: Dict[str, str] = {}  # resume token -> player id
+        self.event_history = deque(maxlen=EVENT_HISTORY_TICKS)
+        self.player_seq = 0
+        self.last_checkpoint = time.time()
+        self.spawner = Spawner(SPAWN_REGIONS, TICK_RATE)
+        self.governor = TickGovernor(TICK_RATE)
+        self.history = PositionHistory(TICK_RATE)
+        self.leaderboards = Leaderboards()
+
+        # 一般怪物由 spawner 依玩家分布生成，只有 Boss 是固定的
         boss = Monster('boss_0',
                        BOSS_SPAWN['x'],
                        BOSS_SPAWN['y'],
@@ -389,28 +603,133 @@ class GameState:
                        is_boss=True)
         self.monsters.append(boss)
 
-    def get_state_for_player(self, player_id):
+    def new_player_id(self):
+        self.player_seq += 1
+        return f"player_{self.player_seq}"
+
+    def run_spawner(self, now):
+        # 死亡的一般怪物倒數結束後移除，由 spawner 決定要不要補
+        self.monsters = [
+            m for m in self.monsters
+            if m.is_boss or m.alive or m.respawn_timer > 0
+        ]
+        regular = [m for m in self.monsters if not m.is_boss]
+        others = (len(self.players) + len(self.projectiles) +
+                  len(self.monsters) - len(regular))
+        spawns, despawns = self.spawner.plan(now, self.players.values(),
+                                             regular, others)
+        if despawns:
+            removed = {id(m) for m in despawns}
+            self.monsters = [m for m in self.monsters if id(m) not in removed]
+        for region, monster_type, x, y in spawns:
+            self.monsters.append(
+                Monster(self.spawner.new_id(), x, y, monster_type,
+                        region=region))
+
+    def to_image(self):
+        # 在遊戲迴圈上擷取：只複製成 tuple 與淺拷貝，編碼寫檔交給背景執行緒
+        return {
+            'tick': self.tick,
+            'player_seq': self.player_seq,
+            'spawn_seq': self.spawner.seq,
+            'players': [p.to_image() for p in self.players.values()],
+            'monsters': [m.to_image() for m in self.monsters],
+            'projectiles': [dict(p) for p in self.projectiles],
+            'lasers': [dict(l) for l in self.lasers],
+            'meteors': [dict(m) for m in self.meteors]
+        }
+
+    def load_image(self, image):
+        now = time.time()
+        self.tick = image['tick']
+        self.player_seq = image['player_seq']
+        self.spawner.seq = image['spawn_seq']
+        self.monsters = [Monster.from_image(m) for m in image['monsters']]
+        self.projectiles = image['projectiles']
+        self.lasers = image['lasers']
+        self.meteors = image['meteors']
+        self.players = {}
+        self.sessions = {}
+        for data in image['players']:
+            # 還原的玩家一律視為斷線中，等待客戶端用 resume token 接回
+            player = Player.from_image(data)
+            player.detached_at = now
+            self.add_player(player)
+
+    def add_player(self, player):
+        self.players[player.id] = player
+        self.sessions[player.resume_token] = player.id
+        self.leaderboards.add(player)
+
+    def remove_player(self, player_id):
+        player = self.players.pop(player_id, None)
+        if player:
+            self.sessions.pop(player.resume_token, None)
+            self.leaderboards.remove(player_id)
+
+    def detach_player(self, player):
+        # 斷線先保留角色，讓玩家在寬限期內可以接回
+        player.ws = None
+        player.detached_at = time.time()
+        player.dirX = 0.0
+        player.dirY = 0.0
+
+    def prune_detached(self, now):
+        for player_id, player in list(self.players.items()):
+            if player.detached_at and now - player.detached_at > RESUME_GRACE:
+                self.remove_player(player_id)
+                telemetry.emit('session', player_id, 'expire')
+
+    def missed_events(self, player_id, since_tick):
+        missed = []
+        for tick, events in self.event_history:
+            if tick > since_tick:
+                missed.extend(ev for ev in events
+                              if ev[3] == player_id or ev[4] == player_id)
+        return missed[-MAX_MISSED_EVENTS:]
+
+    def get_state_for_player(self, player_id, snapshot: Snapshot,
+                             events=()):
+        # 其他玩家與怪物依優先度挑選後直接拼接已編碼的片段，回傳 JSON 字串
         player = self.players.get(player_id)
         if not player:
             return None
 
-        return {
-            'type':
-            'state',
-            'you':
-            player.to_dict(),
-            'players': [
-                p.to_dict() for pid, p in self.players.items()
-                if pid != player_id
-            ],
-            'monsters': [m.to_dict() for m in self.monsters],
-            'projectiles':
-            self.projectiles,
-            'lasers':
-            self.lasers,
-            'meteors':
-            self.meteors
+        # 背包只在版本變動時才送
+        inventory_changed = (player.inventory.version !=
+                             player.sent_inventory_version)
+        player.sent_inventory_version = player.inventory.version
+
+        view_radius = self.governor.settings['view_radius']
+        resync = player.view.resync
+        player.view.resync = False
+        players, monsters, gone = player.view.select(player, snapshot,
+                                                     view_radius)
+        projectiles = self.projectiles
+        if view_radius is not None:
+            r2 = view_radius * view_radius
+            projectiles = [
+                p for p in projectiles
+                if (p['x'] - player.x)**2 + (p['y'] - player.y)**2 <= r2
+            ]
+        state = {
+            'type': 'state',
+            'tick': self.tick,
+            'st': round(self.last_update, 3),
+            'ack': player.input_seq,
+            'ackT': round(player.input_time, 4),
+            'you': player.to_dict(with_inventory=inventory_changed),
+            'projectiles': projectiles,
+            'lasers': self.lasers,
+            'meteors': self.meteors,
+            'gone': gone,
+            'ev': events_for(events, player_id, player.x, player.y)
         }
+        if resync:
+            state['resync'] = True
+        state = encode(state)
+        return (f'{state[:-1]},"players":[{",".join(players)}],'
+                f'"monsters":[{",".join(monsters)}]}}')
 
 
 game = GameState()
@@ -420,6 +739,13 @@ def hyp(dx, dy):
     return math.sqrt(dx * dx + dy * dy)
 
 
+def change_gold(player, amount, reason):
+    # 所有金幣進出都經過這裡，順便更新排行與記錄
+    player.add_gold(amount)
+    game.leaderboards.update(player, 'gold')
+    telemetry.emit('gold', player.id, amount, reason, player.gold)
+
+
 def generate_weapon_drop(is_boss=False):
     rand = random.random()
 
@@ -466,18 +792,90 @@ def generate_weapon_drop(is_boss=False):
     }
 
 
+def spawn_projectile(proj):
+    # 降級時限制每位玩家同時存在的投射物數量
+    cap = game.governor.settings['max_projectiles']
+    if cap is not None:
+        owned = sum(1 for p in game.projectiles if p['owner'] == proj['owner'])
+        if owned >= cap:
+            return False
+    game.projectiles.append(proj)
+    return True
+
+
+def hit_orb_ring(player, num_orbs, orb_damage, orbit_distance, orbit_speed,
+                 current_time):
+    # 降級時的合併判定：把所有光球視為一個環，每個目標只算一次距離。
+    # 命中間隔與每次傷害依光球數與接觸時間換算，維持和逐顆判定相近的每秒傷害
+    interval = (2 * math.pi / orbit_speed) / num_orbs
+    targets = [m for m in game.monsters if m.alive]
+    targets.extend(p for p in game.players.values()
+                   if p.alive and p.id != player.id)
+    for target in targets:
+        reach = target.r + 10
+        dist = hyp(target.x - player.x, target.y - player.y)
+        if abs(dist - orbit_distance) >= reach:
+            continue
+        target_id = target.spawn_id if isinstance(target,
+                                                  Monster) else target.id
+        hit_key = f"{player.id}_{target_id}_ring"
+        if current_time - player.orb_hit_times.get(hit_key, 0) > interval:
+            # 一顆光球掃過目標的時間內，逐顆判定每 0.5 秒可命中一次
+            contact = 4 * math.asin(min(1.0, reach /
+                                        (2 * orbit_distance))) / orbit_speed
+            dmg = orb_damage * (1 + int(contact / 0.5))
+            if isinstance(target, Monster):
+                game.combat.hit_monster(target, player.id, dmg)
+            else:
+                game.combat.hit_player(target, player.id, dmg)
+            player.orb_hit_times[hit_key] = current_time
+
+
+def move_monster(monster, dir_x, dir_y, step):
+    x = monster.x + dir_x * step
+    y = monster.y + dir_y * step
+    if game.grid.is_blocked(x, y):
+        return False
+    monster.x = x
+    monster.y = y
+    return True
+
+
+def lag_hit(x, y, reach, target, key, view_time, now, max_speed):
+    # 延遲補償命中：先用目前位置加上倒帶期間的最大位移粗篩，可能命中才查歷史位置
+    dist = hyp(x - target.x, y - target.y)
+    if view_time is None:
+        return dist < reach
+    if dist >= reach + max_speed * (now - view_time):
+        return False
+    px, py = game.history.position(key, view_time, target.x, target.y, now)
+    return hyp(x - px, y - py) < reach
+
+
+def rewind_to(player, client_time):
+    # 攻擊/技能訊息帶著客戶端畫面時間 vt；回傳倒帶的目標時間
+    now = game.last_update
+    view_time = game.history.view_time(now, client_time)
+    player.view_lag = now - view_time if view_time is not None else 0.0
+    return view_time
+
+
 async def update_game(dt):
-    current_time = time.time()
+    current_time = game.clock()
+    game.flow.update(game.players.values())
 
     for monster in game.monsters:
         if not monster.alive:
             monster.respawn_timer -= dt
-            if monster.respawn_timer <= 0:
+            # 一般怪物不原地重生，倒數結束後由 spawner 移除
+            if monster.is_boss and monster.respawn_timer <= 0:
                 monster.alive = True
                 monster.hp = monster.maxHp
                 monster.x = monster.spawn_x
                 monster.y = monster.spawn_y
-                monster.damage_contributors = {}
+                monster.ledger.clear()
+                game.combat.events.emit(EV_RESPAWN, monster.x, monster.y,
+                                        dst=monster.spawn_id)
             continue
 
         if monster.attack_cooldown > 0:
@@ -487,7 +885,12 @@ async def update_game(dt):
         if monster.skill_prepare_time > 0:
             monster.skill_prepare_time -= dt
 
-        if monster.target_player and monster.target_player in game.players:
+        if monster.target_player and monster.target_player not in game.players:
+            # 目標已離線被移除：回到閒晃，spawner 才能收掉
+            monster.target_player = None
+            monster.state = 'wander'
+
+        if monster.target_player:
             target = game.players[monster.target_player]
             if not target.alive:
                 monster.target_player = None
@@ -575,19 +978,24 @@ async def update_game(dt):
                     # 继续追踪（除非在施放激光）
                     if not (monster.is_boss and monster.skill_type == 'laser'
                             and 1.5 >= monster.skill_cooldown > 0.5):
-                        monster.x += (dx / dist) * monster.speed * dt
-                        monster.y += (dy / dist) * monster.speed * dt
+                        # 遠距離查共用流場，近距離直接朝目標走
+                        dir_x, dir_y = game.flow.steer(monster.x, monster.y,
+                                                       target.x, target.y,
+                                                       dist)
+                        if not move_monster(monster, dir_x, dir_y,
+                                            monster.speed * dt):
+                            detour = game.flow.detour(monster.x, monster.y,
+                                                      target.x, target.y)
+                            if detour:
+                                move_monster(monster, detour[0], detour[1],
+                                             monster.speed * dt)
                 elif monster.attack_cooldown <= 0:
                     # 接近到可以攻击的距离
                     if not monster.is_boss or monster.skill_cooldown > 1.5 or monster.skill_prepare_time > 0:
                         # 非Boss或者技能冷却中或准备中：普通近距离攻击
-                        target.hp -= monster.atk
+                        game.combat.hit_player(target, monster.spawn_id,
+                                               monster.atk)
                     monster.attack_cooldown = 1.2
-
-                    if target.hp <= 0:
-                        target.hp = 0
-                        target.alive = False
-                        target.respawn_timer = 3
         else:
             monster.wander_timer -= dt
             if monster.wander_timer <= 0:
@@ -595,8 +1003,9 @@ async def update_game(dt):
                 monster.wander_timer = 1 + random.random() * 2
 
             speed = monster.speed * 0.3
-            monster.x += math.cos(monster.wander_dir) * speed * dt
-            monster.y += math.sin(monster.wander_dir) * speed * dt
+            if not move_monster(monster, math.cos(monster.wander_dir),
+                                math.sin(monster.wander_dir), speed * dt):
+                monster.wander_timer = 0
 
         monster.x = max(monster.r, min(MAP_W - monster.r, monster.x))
         monster.y = max(monster.r, min(MAP_H - monster.r, monster.y))
@@ -620,11 +1029,8 @@ async def update_game(dt):
                 dist = hyp(meteor['targetX'] - player.x,
                            meteor['targetY'] - player.y)
                 if dist < 100:
-                    player.hp -= meteor['dmg']
-                    if player.hp <= 0:
-                        player.hp = 0
-                        player.alive = False
-                        player.respawn_timer = 3
+                    game.combat.hit_player(player, meteor['owner'],
+                                           meteor['dmg'])
             game.meteors.remove(meteor)
             continue
 
@@ -638,6 +1044,8 @@ async def update_game(dt):
                 player.hp = player.maxHp
                 player.x = MAP_W / 2 + random.randint(-100, 100)
                 player.y = MAP_H / 2 + random.randint(-100, 100)
+                game.combat.events.emit(EV_RESPAWN, player.x, player.y,
+                                        dst=player.id)
             continue
         if player.is_dashing:
             player.dash_timer -= dt
@@ -657,10 +1065,8 @@ async def update_game(dt):
                         continue
                     dist = hyp(monster.x - player.x, monster.y - player.y)
                     if dist < monster.r + player.r:
-                        monster.hp -= player.dash_damage
-                        monster.damage_contributors[player.id] = monster.damage_contributors.get(player.id, 0) + player.dash_damage
-                        monster.target_player = player.id
-                        monster.state = 'chase'
+                        game.combat.hit_monster(monster, player.id,
+                                                player.dash_damage)
                         player.dash_hit_entities.add(id(monster))
 
                 # 路徑傷害判定 - 其他玩家
@@ -669,12 +1075,9 @@ async def update_game(dt):
                         continue
                     dist = hyp(other_player.x - player.x, other_player.y - player.y)
                     if dist < other_player.r + player.r:
-                        other_player.hp -= player.dash_damage
+                        game.combat.hit_player(other_player, player.id,
+                                               player.dash_damage)
                         player.dash_hit_entities.add(id(other_player))
-                        if other_player.hp <= 0:
-                            other_player.hp = 0
-                            other_player.alive = False
-                            other_player.respawn_timer = 3
             else:
                 # 位移結束
                 player.is_dashing = False
@@ -691,6 +1094,7 @@ async def update_game(dt):
             if player.skill_cooldowns[skill_id] > 0:
                 player.skill_cooldowns[skill_id] -= dt
 
+        player.input_time += dt
         if player.dirX != 0 or player.dirY != 0:
             player.x += player.dirX * player.speed * dt
             player.y += player.dirY * player.speed * dt
@@ -702,16 +1106,21 @@ async def update_game(dt):
                 player.faceX = player.dirX / dist
                 player.faceY = player.dirY / dist
 
-        weapon = player.equipment.get('W')
+        weapon = player.inventory.equipped('W')
         if weapon is not None:
-            weapon_def = WEAPON_DEFINITIONS.get(weapon['id'])
+            weapon_def = WEAPON_DEFINITIONS.get(weapon.id)
             if weapon_def:
-                num_orbs = weapon.get('level', 1)
+                num_orbs = weapon.level
                 orb_damage = weapon_def['baseDmg'] + (
-                    weapon.get('level', 1) - 1) * weapon_def['dmgPerLevel']
+                    weapon.level - 1) * weapon_def['dmgPerLevel']
                 orbit_distance = 80
                 orbit_speed = 2
 
+                if game.governor.settings['merge_orbs']:
+                    hit_orb_ring(player, num_orbs, orb_damage,
+                                 orbit_distance, orbit_speed, current_time)
+                    num_orbs = 0
+
                 for i in range(num_orbs):
                     angle = (current_time * orbit_speed +
                              (i / num_orbs) * math.pi * 2) % (math.pi * 2)
@@ -726,13 +1135,8 @@ async def update_game(dt):
                             hit_key = f"{player.id}_{monster.spawn_id}_{i}"
                             last_hit = player.orb_hit_times.get(hit_key, 0)
                             if current_time - last_hit > 0.5:
-                                monster.hp -= orb_damage
-                                monster.damage_contributors[
-                                    player.
-                                    id] = monster.damage_contributors.get(
-                                        player.id, 0) + orb_damage
-                                monster.target_player = player.id
-                                monster.state = 'chase'
+                                game.combat.hit_monster(
+                                    monster, player.id, orb_damage)
                                 player.orb_hit_times[hit_key] = current_time
 
                     for other_player in game.players.values():
@@ -744,12 +1148,9 @@ async def update_game(dt):
                             hit_key = f"{player.id}_{other_player.id}_{i}"
                             last_hit = player.orb_hit_times.get(hit_key, 0)
                             if current_time - last_hit > 0.5:
-                                other_player.hp -= orb_damage
+                                game.combat.hit_player(
+                                    other_player, player.id, orb_damage)
                                 player.orb_hit_times[hit_key] = current_time
-                                if other_player.hp <= 0:
-                                    other_player.hp = 0
-                                    other_player.alive = False
-                                    other_player.respawn_timer = 3
 
     new_projectiles = []
     for proj in game.projectiles:
@@ -761,19 +1162,20 @@ async def update_game(dt):
             continue
 
         hit = False
+        # 玩家發射的投射物以發射者看到的畫面判定命中
+        owner = game.players.get(proj['owner'])
+        view_time = (current_time - owner.view_lag
+                     if owner and owner.view_lag else None)
 
         if proj.get('targetType') in ['monster', 'all']:
             for monster in game.monsters:
                 if not monster.alive:
                     continue
-                dist = hyp(proj['x'] - monster.x, proj['y'] - monster.y)
-                if dist < monster.r + proj['r']:
-                    monster.hp -= proj['dmg']
-                    monster.damage_contributors[
-                        proj['owner']] = monster.damage_contributors.get(
-                            proj['owner'], 0) + proj['dmg']
-                    monster.target_player = proj['owner']
-                    monster.state = 'chase'
+                if lag_hit(proj['x'], proj['y'], monster.r + proj['r'],
+                           monster, monster.spawn_id, view_time, current_time,
+                           monster.speed):
+                    game.combat.hit_monster(monster, proj['owner'],
+                                            proj['dmg'])
                     hit = True
                     break
 
@@ -781,14 +1183,11 @@ async def update_game(dt):
             for other_player in game.players.values():
                 if other_player.id == proj['owner'] or not other_player.alive:
                     continue
-                dist = hyp(proj['x'] - other_player.x,
-                           proj['y'] - other_player.y)
-                if dist < other_player.r + proj['r']:
-                    other_player.hp -= proj['dmg']
-                    if other_player.hp <= 0:
-                        other_player.hp = 0
-                        other_player.alive = False
-                        other_player.respawn_timer = 3
+                if lag_hit(proj['x'], proj['y'], other_player.r + proj['r'],
+                           other_player, other_player.id, view_time,
+                           current_time, PLAYER_MAX_SPEED):
+                    game.combat.hit_player(other_player, proj['owner'],
+                                           proj['dmg'])
                     hit = True
                     break
 
@@ -797,28 +1196,51 @@ async def update_game(dt):
 
     game.projectiles = new_projectiles
 
-    for monster in game.monsters:
-        if monster.alive and monster.hp <= 0:
+    resolve_monster_deaths()
+    resolve_player_deaths()
+
+
+def resolve_player_deaths():
+    # 玩家擊殺玩家才算 PvP
+    for victim, killer_id in game.combat.drain_player_deaths():
+        killer = game.players.get(killer_id)
+        if killer is not None and killer is not victim:
+            killer.pvp_kills += 1
+            game.leaderboards.update(killer, 'pvp')
+            telemetry.emit('pvp_kill', killer.id, victim.id)
+
+
+def resolve_monster_deaths():
+    # 只處理本 tick 真正死亡的怪物（包含技能訊息處理期間排入的）
+    events = game.combat.events
+    for monster in game.combat.drain_monster_deaths():
+        if monster.alive:
             monster.alive = False
             monster.respawn_timer = monster.respawnTime
 
-            top_contributor = None
-            top_damage = 0
-            for pid, dmg in monster.damage_contributors.items():
-                if dmg > top_damage:
-                    top_damage = dmg
-                    top_contributor = pid
-
-            if top_contributor and top_contributor in game.players:
-                killer = game.players[top_contributor]
-                killer.add_exp(monster.expDrop)
+            top_contributor = monster.ledger.top_id
+            events.emit(EV_KILL, monster.x, monster.y, top_contributor,
+                        monster.spawn_id)
+            killer = game.players.get(top_contributor)
+            telemetry.emit('kill', monster.type_id, monster.is_boss,
+                           top_contributor, monster.expDrop if killer else 0)
+            if killer is not None:
+                if killer.add_exp(monster.expDrop):
+                    events.emit(EV_LEVEL_UP, killer.x, killer.y, dst=killer.id,
+                                value=killer.level)
+                game.leaderboards.update(killer, 'level')
                 gold_drop = random.randint(monster.goldMin,
                                            monster.goldMax) * 10
-                killer.add_gold(gold_drop)
+                change_gold(killer, gold_drop, 'kill')
 
                 weapon = generate_weapon_drop(monster.is_boss)
                 if weapon:
                     killer.add_to_inventory(weapon)
+                    telemetry.emit('drop', killer.id, weapon['id'],
+                                   WEAPON_DEFINITIONS[weapon['id']]['rarity'],
+                                   monster.type_id)
+                    events.emit(EV_DROP, monster.x, monster.y, dst=killer.id,
+                                value=weapon['name'])
 
                 if monster.is_boss:
                     boss_item = {
@@ -830,28 +1252,167 @@ async def update_game(dt):
                         'isWeapon': False
                     }
                     killer.add_to_inventory(boss_item)
+                    telemetry.emit('drop', killer.id, boss_item['id'], None,
+                                   monster.type_id)
+                    events.emit(EV_DROP, monster.x, monster.y, dst=killer.id,
+                                value=boss_item['name'])
+                    killer.boss_kills += 1
+                    game.leaderboards.update(killer, 'boss')
+
+            monster.ledger.clear()
+
 
-            monster.damage_contributors = {}
+async def broadcast_boss_boards():
+    # 低頻推送 Boss 傷害排行，只發給有造成傷害的玩家
+    for monster in game.monsters:
+        if not monster.is_boss or not monster.alive or not monster.ledger.dirty:
+            continue
+        monster.ledger.dirty = False
+
+        ranking = monster.ledger.ranking()
+        top = []
+        for pid, dmg in ranking[:BOSS_BOARD_SIZE]:
+            contributor = game.players.get(pid)
+            top.append([contributor.name if contributor else pid, round(dmg)])
+
+        for rank, (pid, dmg) in enumerate(ranking, 1):
+            participant = game.players.get(pid)
+            if not participant or not participant.ws or participant.ws.closed:
+                continue
+            try:
+                await participant.ws.send_json({
+                    'type': 'boss_damage',
+                    'boss': monster.spawn_id,
+                    'hp': monster.hp,
+                    'maxHp': monster.maxHp,
+                    'top': top,
+                    'rank': rank,
+                    'dmg': round(dmg)
+                })
+            except Exception:
+                pass
+
+
+async def push_rank_changes():
+    # 只推給名次真的改變的玩家
+    for player_id, ranks in game.leaderboards.rank_changes().items():
+        player = game.players.get(player_id)
+        if not player or not player.ws or player.ws.closed:
+            continue
+        try:
+            await player.ws.send_json({'type': 'rank', 'ranks': ranks})
+        except Exception:
+            pass
+
+
+async def broadcast_state():
+    events = game.combat.events.drain()
+    if events:
+        game.event_history.append((game.tick, events))
+    snapshot = Snapshot(game.players.values(), game.monsters)
+    for player_id, player in list(game.players.items()):
+        if player.ws and not player.ws.closed:
+            try:
+                state = game.get_state_for_player(player_id, snapshot, events)
+                if state:
+                    await player.ws.send_str(state)
+            except Exception:
+                # 沒送到：背包版本與已送出的實體都不能算數，下一則整個重送
+                player.resync()
+    if spectators.cameras:
+        spectators.broadcast(game.tick, round(game.last_update, 3),
+                             game.players, game.monsters, snapshot,
+                             game.projectiles, game.lasers, game.meteors,
+                             events)
+
+
+def load_info():
+    # 目前降載等級與廣播間隔，客戶端據此調整插值延遲
+    return {
+        'level': game.governor.level,
+        'interval': game.governor.settings['broadcast_every'] / TICK_RATE
+    }
+
+
+async def broadcast_load_level(old_level, new_level):
+    telemetry.emit('load_level', old_level, new_level,
+                   game.governor.to_dict()['p90Ms'])
+    frame = SharedFrame(
+        encode({
+            'type': 'load_level',
+            'previous': old_level,
+            **load_info()
+        }).encode())
+    for player in list(game.players.values()):
+        if player.ws and not player.ws.closed:
+            try:
+                await player.ws.send_shared(frame)
+            except Exception:
+                pass
+
+
+def resync_dropped(sockets):
+    # 有訊息沒送到的連線：背包與實體清單下一則狀態整個重送
+    for ws in sockets:
+        player = game.players.get(ws.player_id)
+        if player is not None and player.ws is ws:
+            player.resync()
 
 
 async def game_loop():
+    next_tick = time.time()
     while True:
         current_time = time.time()
         dt = current_time - game.last_update
         game.last_update = current_time
 
+        started = time.perf_counter()
         await update_game(min(dt, 0.1))
-
-        for player_id, player in list(game.players.items()):
-            if player.ws and not player.ws.closed:
-                try:
-                    state = game.get_state_for_player(player_id)
-                    if state:
-                        await player.ws.send_json(state)
-                except Exception:
-                    pass
-
-        await asyncio.sleep(1 / 30)
+        game.history.record(current_time, game.players.values(),
+                            game.monsters)
+        game.spawner.record_tick(
+            time.perf_counter() - started,
+            len(game.monsters) + len(game.players) + len(game.projectiles))
+        game.tick += 1
+        settings = game.governor.settings
+
+        if current_time >= game.spawner.next_pass:
+            game.spawner.next_pass = current_time + SPAWN_INTERVAL
+            game.run_spawner(current_time)
+
+        if game.tick % settings['broadcast_every'] == 0:
+            await broadcast_state()
+
+        if current_time - game.last_boss_board >= BOSS_BOARD_INTERVAL:
+            game.last_boss_board = current_time
+            await broadcast_boss_boards()
+            await push_rank_changes()
+            spectators.broadcast_roster(game.players, game.monsters)
+            game.prune_detached(current_time)
+
+        if (current_time - game.last_checkpoint >= CHECKPOINT_INTERVAL
+                and not checkpoints.busy):
+            game.last_checkpoint = current_time
+            asyncio.create_task(checkpoints.save(game.to_image()))
+
+        if telemetry.due(current_time):
+            telemetry.next_flush = current_time + TELEMETRY_FLUSH_INTERVAL
+            asyncio.create_task(telemetry.flush())
+
+        level_change = game.governor.record(time.perf_counter() - started)
+        if level_change:
+            await broadcast_load_level(*level_change)
+
+        if io_tier:
+            resync_dropped(io_tier.flush())
+
+        # 固定節拍：扣掉本 tick 已花的時間，落後時不追趕
+        next_tick += 1 / TICK_RATE
+        delay = next_tick - time.time()
+        if delay < 0:
+            next_tick = time.time()
+            delay = 0
+        await asyncio.sleep(delay)
 
 
 async def handle_message(player_id, data):
@@ -865,16 +1426,21 @@ async def handle_message(player_id, data):
         if msg_type == 'move':
             player.dirX = float(data.get('dirX', 0))
             player.dirY = float(data.get('dirY', 0))
+            seq = data.get('seq')
+            if isinstance(seq, int) and seq > player.input_seq:
+                player.input_seq = seq
+                player.input_time = 0.0
 
         elif msg_type == 'attack':
             if player.attack_cooldown > 0 or not player.alive:
                 return
 
             player.attack_cooldown = 0.3
+            rewind_to(player, data.get('vt'))
             dirX = float(data.get('dirX', player.faceX))
             dirY = float(data.get('dirY', player.faceY))
 
-            game.projectiles.append({
+            spawn_projectile({
                 'x': player.x + dirX * player.r,
                 'y': player.y + dirY * player.r,
                 'vx': dirX * 700,
@@ -897,11 +1463,15 @@ async def handle_message(player_id, data):
                 return
 
             player.skill_cooldowns[skill_id] = cooldowns[skill_id]
+            view_time = rewind_to(player, data.get('vt'))
             dirX = float(data.get('dirX', player.faceX))
             dirY = float(data.get('dirY', player.faceY))
+            game.combat.events.emit(EV_SKILL_CAST, player.x, player.y,
+                                    src=player_id, value=skill_id)
+            telemetry.emit('skill', player_id, skill_id)
 
             if skill_id == 1:
-                game.projectiles.append({
+                spawn_projectile({
                     'x': player.x + dirX * player.r,
                     'y': player.y + dirY * player.r,
                     'vx': dirX * 600,
@@ -915,13 +1485,12 @@ async def handle_message(player_id, data):
                 })
 
             elif skill_id == 2:
-                equipped = player.equipment.get('E')
+                equipped = player.inventory.equipped('E')
                 if equipped:
-                    weapon_def = WEAPON_DEFINITIONS.get(equipped['id'])
+                    weapon_def = WEAPON_DEFINITIONS.get(equipped.id)
                     if weapon_def:
                         dmg = player.baseAttack + weapon_def['baseDmg'] + (
-                            equipped.get('level', 1) -
-                            1) * weapon_def['dmgPerLevel']
+                            equipped.level - 1) * weapon_def['dmgPerLevel']
 
                         # 檢查是否為位移武器
                         if weapon_def.get('isDash'):
@@ -936,7 +1505,7 @@ async def handle_message(player_id, data):
                             player.dash_hit_entities = set()
                         else:
                             # 原有的能量光束邏輯
-                            game.projectiles.append({
+                            spawn_projectile({
                                 'x':
                                 player.x + dirX * player.r,
                                 'y':
@@ -963,166 +1532,368 @@ async def handle_message(player_id, data):
                     player.hp = min(player.maxHp, player.hp + 35)
 
             elif skill_id == 3:
-                equipped = player.equipment.get('R')
+                equipped = player.inventory.equipped('R')
                 weapon_def = WEAPON_DEFINITIONS.get(
-                    equipped['id']) if equipped else None
+                    equipped.id) if equipped else None
                 R = 180 if equipped else 140
                 dmg = (player.baseAttack * 0.5 + weapon_def['baseDmg'] +
-                       (equipped.get('level', 1) - 1) *
+                       (equipped.level - 1) *
                        weapon_def['dmgPerLevel']) if (weapon_def and equipped) else (
                            40 + player.baseAttack * 1.5)
 
+                # 範圍以施放者目前位置為中心，目標倒帶到施放者畫面上的位置
+                now = game.last_update
                 for monster in game.monsters:
                     if not monster.alive:
                         continue
-                    dist = hyp(monster.x - player.x, monster.y - player.y)
-                    if dist < R:
-                        monster.hp -= dmg
-                        monster.damage_contributors[
-                            player_id] = monster.damage_contributors.get(
-                                player_id, 0) + dmg
-                        monster.target_player = player_id
+                    if lag_hit(player.x, player.y, R, monster,
+                               monster.spawn_id, view_time, now,
+                               monster.speed):
+                        game.combat.hit_monster(monster, player_id, dmg)
 
                 for other_player in game.players.values():
                     if other_player.id == player_id or not other_player.alive:
                         continue
-                    dist = hyp(other_player.x - player.x,
-                               other_player.y - player.y)
-                    if dist < R:
-                        other_player.hp -= dmg
-                        if other_player.hp <= 0:
-                            other_player.hp = 0
-                            other_player.alive = False
-                            other_player.respawn_timer = 3
+                    if lag_hit(player.x, player.y, R, other_player,
+                               other_player.id, view_time, now,
+                               PLAYER_MAX_SPEED):
+                        game.combat.hit_player(other_player, player_id, dmg)
 
         elif msg_type == 'equip':
-            index = data.get('index')
-            if 0 <= index < len(player.inventory):
-                item = player.inventory[index]
-                if item.get('isWeapon'):
-                    weapon_type = item.get('type')
-                    # 创建一个新的装备副本，确保引用正确
-                    player.equipment[weapon_type] = dict(item)
+            item = player.inventory.get(data.get('index'), data.get('uid'))
+            if item:
+                player.inventory.equip(item)
 
         elif msg_type == 'unequip':
-            weapon_type = data.get('weaponType')
-            if weapon_type in player.equipment:
-                player.equipment[weapon_type] = None
+            player.inventory.unequip(data.get('weaponType'))
 
         elif msg_type == 'use_item':
-            index = data.get('index')
-            if 0 <= index < len(player.inventory):
-                item = player.inventory[index]
-                if item.get('id') == 'healing_potion':
-                    player.hp = min(player.maxHp, player.hp + 35)
-                    item['count'] -= 1
-                    if item['count'] <= 0:
-                        player.inventory.pop(index)
+            item = player.inventory.get(data.get('index'), data.get('uid'))
+            if item and item.id == 'healing_potion':
+                player.hp = min(player.maxHp, player.hp + 35)
+                item.count -= 1
+                if item.count <= 0:
+                    player.inventory.remove(item)
+                else:
+                    player.inventory.touch()
 
         elif msg_type == 'upgrade':
-            index = data.get('index')
-            if 0 <= index < len(player.inventory):
-                item = player.inventory[index]
-                if item.get('isWeapon'):
-                    upgrade_cost = item.get('level', 1) * 100
-                    if player.gold >= upgrade_cost:
-                        player.gold -= upgrade_cost
-                        item['level'] = item.get('level', 1) + 1
+            item = player.inventory.get(data.get('index'), data.get('uid'))
+            if item and item.is_weapon:
+                upgrade_cost = item.level * 100
+                if player.gold >= upgrade_cost:
+                    change_gold(player, -upgrade_cost, 'upgrade')
+                    item.level += 1
+                    player.inventory.touch()
+                    telemetry.emit('upgrade', player_id, item.id, item.level,
+                                   upgrade_cost)
 
         elif msg_type == 'disassemble':
-            index = data.get('index')
-            if 0 <= index < len(player.inventory):
-                item = player.inventory[index]
-                if item.get('id') == 'boss_item':
-                    player.gold += 1000 * item.get('count', 1)
-                    player.inventory.pop(index)
-                elif item.get('isWeapon'):
-                    weapon_type = item.get('type')
-                    if player.equipment.get(weapon_type) == item:
-                        player.equipment[weapon_type] = None
-                    player.gold += 50 * item.get('level', 1)
-                    player.inventory.pop(index)
+            item = player.inventory.get(data.get('index'), data.get('uid'))
+            if item and item.id == 'boss_item':
+                gold = 1000 * item.count
+            elif item and item.is_weapon:
+                gold = 50 * item.level
+            else:
+                return
+            player.inventory.remove(item)
+            change_gold(player, gold, 'disassemble')
+            telemetry.emit('disassemble', player_id, item.id, item.count,
+                           item.level, gold)
 
     except Exception as e:
-        print(f"Error handling message: {e}")
+        # 用戶端可以反覆觸發，不印出，只記一筆（受每秒上限限制）
+        telemetry.emit('error', 'message', repr(e))
+
+
+async def join_player(ws, resume_token, since_tick):
+    # 有效的 resume token 接回原角色，否則建立新角色；回傳 (玩家, 歡迎訊息)
+    player = game.players.get(game.sessions.get(resume_token, ''))
+    if player is not None:
+        old_ws = player.ws
+        player.ws = ws
+        player.detached_at = None
+        # 新連線的輸入序號從頭算
+        player.input_seq = 0
+        player.input_time = 0.0
+        player.resync()
+        if old_ws and not old_ws.closed:
+            await old_ws.close()
+        telemetry.emit('session', player.id, 'resume')
+        return player, {
+            'type': 'resumed',
+            'playerId': player.id,
+            'playerName': player.name,
+            'resumeToken': player.resume_token,
+            'tick': game.tick,
+            'missed': game.missed_events(player.id, since_tick),
+            'ranks': game.leaderboards.ranks(player.id),
+            'load': load_info()
+        }
+
+    player = Player(game.new_player_id(), f"玩家{len(game.players) + 1}")
+    player.ws = ws
+    game.add_player(player)
+    telemetry.emit('session', player.id, 'connect')
+    return player, {
+        'type': 'connected',
+        'playerId': player.id,
+        'playerName': player.name,
+        'resumeToken': player.resume_token,
+        'ranks': game.leaderboards.ranks(player.id),
+        'load': load_info()
+    }
 
 
 async def websocket_handler(request):
-    ws = web.WebSocketResponse()
+    # 協定層上限放寬一些，超過 MAX_MESSAGE_SIZE 的由 guard 計數後丟棄
+    ws = TunedWebSocketResponse('player', max_msg_size=MAX_MESSAGE_SIZE * 4)
     await ws.prepare(request)
+    guard = ConnectionGuard()
 
-    player_id = f"player_{id(ws)}"
-    player_name = f"玩家{len(game.players) + 1}"
-
-    player = Player(player_id, player_name)
-    player.ws = ws
-    game.players[player_id] = player
-
-    print(f"Player connected: {player_name} ({player_id})")
+    try:
+        since_tick = int(request.query.get('tick', 0))
+    except ValueError:
+        since_tick = 0
+    player, hello = await join_player(ws, request.query.get('resume', ''),
+                                      since_tick)
+    player_id = player.id
 
     try:
-        await ws.send_json({
-            'type': 'connected',
-            'playerId': player_id,
-            'playerName': player_name
-        })
+        await ws.send_json(hello)
 
         async for msg in ws:
             if msg.type == web.WSMsgType.TEXT:
+                # 單一訊息出錯只丟掉該訊息，不影響連線
                 try:
-                    data = json.loads(msg.data)
+                    data = guard.check(msg.data)
+                    if data is None:
+                        if guard.abusive:
+                            telemetry.emit('session', player_id, 'abusive')
+                            guard_stats.disconnected += 1
+                            game.remove_player(player_id)
+                            break
+                        continue
                     await handle_message(player_id, data)
-                except json.JSONDecodeError:
-                    pass
                 except Exception as e:
-                    print(f"Error processing message: {e}")
+                    telemetry.emit('error', 'websocket', repr(e))
             elif msg.type == web.WSMsgType.ERROR:
-                print(f'WebSocket error: {ws.exception()}')
+                telemetry.emit('error', 'websocket', repr(ws.exception()))
             elif msg.type == web.WSMsgType.CLOSE:
-                print('WebSocket closed')
                 break
 
     except asyncio.CancelledError:
         pass
     except Exception as e:
-        print(f"WebSocket handler error: {e}")
+        telemetry.emit('error', 'websocket', repr(e))
     finally:
-        if player_id in game.players:
-            del game.players[player_id]
+        if player.ws is ws:
+            game.detach_player(player)
         if not ws.closed:
             await ws.close()
-        print(f"Player disconnected: {player_name}")
+        telemetry.emit('session', player_id, 'leave')
 
     return ws
 
 
+# worker 轉來的連線事件：ws 是 io_tier.RemoteSocket，輸入已在 worker 驗證過
+async def remote_join(ws, resume_token, since_tick):
+    player, hello = await join_player(ws, resume_token, since_tick)
+    ws.player_id = player.id
+    return hello
+
+
+async def remote_message(ws, data):
+    await handle_message(ws.player_id, data)
+
+
+def remote_leave(ws, abusive):
+    player = game.players.get(ws.player_id)
+    if player is None:
+        return
+    if abusive:
+        telemetry.emit('session', player.id, 'abusive')
+        game.remove_player(player.id)
+    elif player.ws is ws:
+        game.detach_player(player)
+    telemetry.emit('session', player.id, 'leave')
+
+
+def remote_error(e):
+    telemetry.emit('error', 'io_tier', repr(e))
+
+
+assets = StaticAssets(os.path.dirname(os.path.abspath(__file__)))
+bundles = StaticAssets(os.path.join(assets.root, STATIC_DIR))
+checkpoints = CheckpointFile(CHECKPOINT_PATH,
+                             keyed_sections=('players', 'monsters'))
+telemetry = Telemetry(TELEMETRY_DIR or None)
+spectators = SpectatorHub()
+io_tier: Optional[IOTier] = None
+
+
+def subscribe_spectator(ws, mode, target=None, x=MAP_W / 2, y=MAP_H / 2):
+    # 只能跟隨在線上的玩家；目標不存在、模式不對或鏡頭數已滿時改看 Boss
+    if mode == 'player' and target not in game.players:
+        mode = 'boss'
+    if spectators.subscribe(ws, mode, target, x, y) is None:
+        spectators.subscribe(ws, 'boss')
+
+
+async def spectate_handler(request):
+    # 觀戰連線：不建立 Player，只訂閱鏡頭（自由、跟隨玩家或 Boss）
+    if len(spectators) >= MAX_SPECTATORS:
+        raise web.HTTPServiceUnavailable()
+    ws = TunedWebSocketResponse('spectator',
+                                max_msg_size=MAX_MESSAGE_SIZE * 4)
+    await ws.prepare(request)
+    guard = ConnectionGuard(SPECTATOR_SCHEMAS, SPECTATOR_RATE_LIMITS)
+
+    # 所有送出（包含第一份名單）都經過該觀眾自己的佇列與送出 task
+    spectators.connect(ws, request.transport)
+    subscribe_spectator(ws, request.query.get('cam', 'boss'),
+                        request.query.get('target'))
+    try:
+        spectators.fan_out([ws],
+                           spectators.encode_roster(game.players,
+                                                    game.monsters))
+        async for msg in ws:
+            if msg.type == web.WSMsgType.TEXT:
+                try:
+                    data = guard.check(msg.data)
+                    if data is None:
+                        if guard.abusive:
+                            guard_stats.disconnected += 1
+                            break
+                        continue
+                    x = max(0.0, min(MAP_W, data.get('x', MAP_W / 2)))
+                    y = max(0.0, min(MAP_H, data.get('y', MAP_H / 2)))
+                    subscribe_spectator(ws, data['mode'], data.get('target'),
+                                        x, y)
+                except Exception as e:
+                    telemetry.emit('error', 'spectate', repr(e))
+            elif msg.type == web.WSMsgType.ERROR:
+                break
+    finally:
+        spectators.disconnect(ws)
+    return ws
+
+
 async def index_handler(request):
-    with open('index.html', 'r', encoding='utf-8') as f:
-        return web.Response(text=f.read(),
-                            content_type='text/html',
-                            charset='utf-8')
+    return await assets.serve(request, 'index.html')
+
+
+async def static_handler(request):
+    # 拆分出來的 JS/CSS 等資源放在 static/ 底下，只從該目錄解析
+    return await bundles.serve(request, request.match_info['path'],
+                               BUNDLE_CACHE_CONTROL)
+
+
+async def leaderboard_handler(request):
+    # /leaderboard?board=level&limit=10&player=<id>：前幾名與該玩家的名次
+    board = request.query.get('board', 'level')
+    if board not in SCORES:
+        raise web.HTTPNotFound()
+    try:
+        limit = max(1, min(MAX_TOP, int(request.query.get('limit', 10))))
+    except ValueError:
+        raise web.HTTPBadRequest()
+    body, etag = game.leaderboards.query(board, limit,
+                                         request.query.get('player'),
+                                         time.time())
+    # 回應含查詢者的名次，只能讓瀏覽器自己快取
+    headers = {
+        'ETag': etag,
+        'Cache-Control': f'private, max-age={int(CACHE_TTL)}'
+    }
+    if etag_matches(request.headers.get('If-None-Match', ''), etag):
+        return web.Response(status=304, headers=headers)
+    return web.Response(body=body,
+                        content_type='application/json',
+                        headers=headers)
+
+
+async def stats_handler(request):
+    return web.json_response({
+        'players': len(game.players),
+        'tick': game.tick,
+        'monsters': len(game.monsters),
+        'spawner': game.spawner.to_dict(),
+        'governor': game.governor.to_dict(),
+        'spectators': spectators.to_dict(),
+        'compression': compression_stats(),
+        'lagComp': game.history.to_dict(),
+        'leaderboards': game.leaderboards.to_dict(),
+        'telemetry': telemetry.to_dict(),
+        'flowFields': len(game.flow.fields),
+        'flowRebuilds': game.flow.rebuilds,
+        'io': io_tier.to_dict() if io_tier else None,
+        'guard': guard_stats.to_dict()
+    })
 
 
 async def start_background_loop():
     await game_loop()
 
 
+def restore_checkpoint():
+    # 還原到新的 GameState，整份成功才換上；中途出錯時世界保持原樣
+    global game
+    started = time.perf_counter()
+    image = checkpoints.load_latest()
+    if image is None:
+        return
+    restored = GameState()
+    try:
+        restored.load_image(image)
+    except (KeyError, TypeError, ValueError) as e:
+        print(f"Checkpoint ignored: {e}")
+        return
+    game = restored
+    print(f"Restored world from checkpoint: {len(game.players)} players, "
+          f"{len(game.monsters)} monsters "
+          f"({(time.perf_counter() - started) * 1000:.1f} ms)")
+
+
 async def main():
+    restore_checkpoint()
+
     app = web.Application()
-    app.router.add_get('/', index_handler)
-    app.router.add_get('/index.html', index_handler)
-    app.router.add_get('/ws', websocket_handler)
+    app.router.add_get('/spectate', spectate_handler)
+    app.router.add_get('/stats', stats_handler)
+    app.router.add_get('/leaderboard', leaderboard_handler)
+    if io_tier:
+        # 公開的 port 由 worker 接，本行程只在本機提供狀態頁與觀戰
+        io_tier.attach()
+        asyncio.create_task(io_tier.serve())
+        host, port = '127.0.0.1', ADMIN_PORT
+    else:
+        app.router.add_get('/', index_handler)
+        app.router.add_get('/index.html', index_handler)
+        app.router.add_get('/static/{path:.+}', static_handler)
+        app.router.add_get('/ws', websocket_handler)
+        assets.preload('index.html')
+        host, port = '0.0.0.0', PORT
 
     asyncio.create_task(game_loop())
 
     runner = web.AppRunner(app)
     await runner.setup()
-    site = web.TCPSite(runner, '0.0.0.0', 8888)
+    site = web.TCPSite(runner, host, port)
     await site.start()
 
-    print("Server started on port8888")
+    print(f"Server started on port{port}")
     await asyncio.Event().wait()
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    if IO_WORKERS > 0:
+        # worker 用 fork 建立，必須在事件迴圈啟動前
+        io_tier = IOTier(IO_WORKERS, PORT, remote_join, remote_message,
+                         remote_leave, ADMIN_PORT, remote_error)
+        io_tier.start()
+    try:
+        asyncio.run(main())
+    finally:
+        if io_tier:
+            io_tier.shutdown()
@@ -0,0 +1,69 @@
+from collections import deque
+from typing import Optional, Tuple
+
+WINDOW_TICKS = 90  # 觀察最近幾個 tick 的耗時
+DEGRADE_AT = 0.85  # 第 90 百分位超過 tick 時間的這個比例就降一級
+RECOVER_AT = 0.45  # 低於這個比例才回升一級
+
+# 第 0 級為正常狀態，越後面越省。None 表示不限制
+DEGRADATION_LEVELS = [
+    {'broadcast_every': 2, 'view_radius': None, 'max_projectiles': None,
+     'merge_orbs': False},
+    {'broadcast_every': 3, 'view_radius': None, 'max_projectiles': None,
+     'merge_orbs': False},
+    {'broadcast_every': 3, 'view_radius': 1400, 'max_projectiles': 12,
+     'merge_orbs': False},
+    {'broadcast_every': 4, 'view_radius': 1100, 'max_projectiles': 8,
+     'merge_orbs': True},
+    {'broadcast_every': 6, 'view_radius': 800, 'max_projectiles': 5,
+     'merge_orbs': True},
+]
+
+
+class TickGovernor:
+    # 依最近一段時間的 tick 耗時在各降級等級間切換。每次換級後清空觀察窗，
+    # 新等級至少要跑滿一個觀察窗才會再換，避免來回震盪
+
+    def __init__(self, tick_rate, levels=DEGRADATION_LEVELS):
+        self.tick_budget = 1 / tick_rate
+        self.levels = levels
+        self.level = 0
+        self.window = deque(maxlen=WINDOW_TICKS)
+        self.changes = 0
+
+    @property
+    def settings(self):
+        return self.levels[self.level]
+
+    def percentile(self, q=0.9):
+        if not self.window:
+            return 0.0
+        ordered = sorted(self.window)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * q))]
+
+    def record(self, elapsed) -> Optional[Tuple[int, int]]:
+        # 回傳 (舊等級, 新等級)，沒有換級時回傳 None
+        self.window.append(elapsed)
+        if len(self.window) < WINDOW_TICKS:
+            return None
+
+        load = self.percentile() / self.tick_budget
+        old = self.level
+        if load > DEGRADE_AT and self.level < len(self.levels) - 1:
+            self.level += 1
+        elif load < RECOVER_AT and self.level > 0:
+            self.level -= 1
+        else:
+            return None
+
+        self.window.clear()
+        self.changes += 1
+        return old, self.level
+
+    def to_dict(self):
+        return {
+            'level': self.level,
+            'p90Ms': round(self.percentile() * 1000, 3),
+            'budgetMs': round(self.tick_budget * 1000, 3),
+            'changes': self.changes
+        }
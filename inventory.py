@@ -0,0 +1,138 @@
+from typing import Dict, List, Optional
+
+INVENTORY_CAPACITY = 12
+EQUIP_SLOTS = ('E', 'R', 'W')  # E = Skill 2, R = Skill 3, W = passive
+
+
+class Item:
+    __slots__ = ('uid', 'id', 'name', 'icon', 'color', 'is_weapon', 'level',
+                 'type', 'count')
+
+    def __init__(self,
+                 uid,
+                 item_id,
+                 name,
+                 icon,
+                 color,
+                 is_weapon=False,
+                 level=1,
+                 weapon_type=None,
+                 count=1):
+        self.uid = uid
+        self.id = item_id
+        self.name = name
+        self.icon = icon
+        self.color = color
+        self.is_weapon = is_weapon
+        self.level = level
+        self.type = weapon_type
+        self.count = count
+
+    @classmethod
+    def from_dict(cls, uid, data):
+        return cls(uid, data['id'], data['name'], data.get('icon'),
+                   data.get('color'), data.get('isWeapon', False),
+                   data.get('level', 1), data.get('type'),
+                   data.get('count', 1))
+
+    def to_dict(self):
+        data = {
+            'uid': self.uid,
+            'id': self.id,
+            'name': self.name,
+            'icon': self.icon,
+            'color': self.color,
+            'isWeapon': self.is_weapon,
+            'count': self.count
+        }
+        if self.is_weapon:
+            data['level'] = self.level
+            data['type'] = self.type
+        return data
+
+
+class Inventory:
+    # 背包與裝備：裝備欄只存物品 uid，任何變動都會遞增 version
+
+    __slots__ = ('items', 'equipment', 'version', 'next_uid')
+
+    def __init__(self):
+        self.items: List[Item] = []
+        self.equipment: Dict[str, Optional[int]] = {
+            slot: None
+            for slot in EQUIP_SLOTS
+        }
+        self.version = 0
+        self.next_uid = 1
+
+    def touch(self):
+        self.version += 1
+
+    def get(self, index, uid=None) -> Optional[Item]:
+        # 客戶端有帶 uid 時一併核對，避免背包變動後操作到別的物品
+        if not isinstance(index, int) or not 0 <= index < len(self.items):
+            return None
+        item = self.items[index]
+        if uid is not None and item.uid != uid:
+            return None
+        return item
+
+    def add(self, data) -> bool:
+        if len(self.items) >= INVENTORY_CAPACITY:
+            return False
+        if not data.get('isWeapon'):
+            for existing in self.items:
+                if existing.id == data.get('id'):
+                    existing.count += data.get('count', 1)
+                    self.touch()
+                    return True
+        self.items.append(Item.from_dict(self.next_uid, data))
+        self.next_uid += 1
+        self.touch()
+        return True
+
+    def remove(self, item):
+        self.items.remove(item)
+        if item.is_weapon and self.equipment.get(item.type) == item.uid:
+            self.equipment[item.type] = None
+        self.touch()
+
+    def equip(self, item):
+        if item.is_weapon and item.type in self.equipment:
+            self.equipment[item.type] = item.uid
+            self.touch()
+
+    def unequip(self, slot):
+        if self.equipment.get(slot) is not None:
+            self.equipment[slot] = None
+            self.touch()
+
+    def equipped(self, slot) -> Optional[Item]:
+        uid = self.equipment.get(slot)
+        if uid is None:
+            return None
+        for item in self.items:
+            if item.uid == uid:
+                return item
+        return None
+
+    def to_image(self):
+        items = tuple((item.uid, item.id, item.name, item.icon, item.color,
+                       item.is_weapon, item.level, item.type, item.count)
+                      for item in self.items)
+        equipment = tuple(self.equipment.get(slot) for slot in EQUIP_SLOTS)
+        return items, equipment, self.version, self.next_uid
+
+    def load_image(self, image):
+        items, equipment, version, next_uid = image
+        self.items = [Item(*fields) for fields in items]
+        self.equipment = dict(zip(EQUIP_SLOTS, equipment))
+        # 還原後版本 +1，讓客戶端一定會收到一次完整背包
+        self.version = version + 1
+        self.next_uid = next_uid
+
+    def to_dict(self):
+        return {
+            'items': [item.to_dict() for item in self.items],
+            'equipment': dict(self.equipment)
+        }
@@ -0,0 +1,575 @@
+import asyncio
+import multiprocessing
+import os
+import struct
+from collections import deque
+from multiprocessing import shared_memory
+from typing import Dict, List, Optional
+
+import aiohttp
+from aiohttp import web
+
+from net_guard import MAX_MESSAGE_SIZE, ConnectionGuard
+from net_guard import stats as guard_stats
+from replication import encode
+from static_assets import BUNDLE_CACHE_CONTROL, STATIC_DIR, StaticAssets
+from ws_compress import TunedWebSocketResponse
+from ws_compress import stats_dict as compression_stats
+
+RING_SLOTS = 4  # 每個 worker 的環狀緩衝格數；格子都還沒釋放時，放不下的訊息丟掉並要求重新同步
+SLOT_SIZE = 8 * 1024 * 1024  # 每格的大小；一個 tick 的訊息放不下就接著寫下一格
+SOCKET_BACKLOG = 8  # 每條連線排隊待送的訊息上限；送不出去堆到這麼多就斷線
+# 轉給模擬行程管理 port 的回應標頭
+PROXY_HEADERS = ('Content-Type', 'ETag', 'Cache-Control')
+
+_RING_HEADER = struct.Struct('<QQ')  # 模擬行程已寫入的序號, worker 已送完的序號
+_SLOT_HEADER = struct.Struct('<II')  # 訊息數, 已用 bytes
+_FRAME_HEADER = struct.Struct('<II')  # 連線 id, 長度
+# 單則訊息放得進一整格的上限；更大的改走管線
+MAX_FRAME = SLOT_SIZE - _SLOT_HEADER.size - _FRAME_HEADER.size
+
+
+class FrameRing:
+    # 模擬行程寫、單一 worker 讀的共享記憶體環狀緩衝。worker 把一格的訊息複製出來
+    # 才把序號寫回表頭，模擬行程不會覆寫還沒讀完的格子
+
+    def __init__(self):
+        self.shm = shared_memory.SharedMemory(
+            create=True, size=_RING_HEADER.size + RING_SLOTS * SLOT_SIZE)
+        self.buf = self.shm.buf
+        _RING_HEADER.pack_into(self.buf, 0, 0, 0)
+
+    def _base(self, seq):
+        return _RING_HEADER.size + (seq % RING_SLOTS) * SLOT_SIZE
+
+    def publish(self, frames):
+        # 依序寫進還沒被佔用的格子，一格滿了接著下一格（每則訊息不超過 MAX_FRAME）。
+        # 回傳 (寫入的序號, 環滿了沒寫進去的訊息)
+        written, released = _RING_HEADER.unpack_from(self.buf, 0)
+        buf = self.buf
+        seqs = []
+        index = 0
+        while index < len(frames) and written - released < RING_SLOTS:
+            seq = written + 1
+            base = self._base(seq)
+            end = base + SLOT_SIZE
+            offset = base + _SLOT_HEADER.size
+            count = 0
+            for conn_id, payload in frames[index:]:
+                size = len(payload)
+                if offset + _FRAME_HEADER.size + size > end:
+                    break
+                _FRAME_HEADER.pack_into(buf, offset, conn_id, size)
+                offset += _FRAME_HEADER.size
+                buf[offset:offset + size] = payload
+                offset += size
+                count += 1
+            _SLOT_HEADER.pack_into(buf, base, count, offset - base)
+            struct.pack_into('<Q', buf, 0, seq)
+            written = seq
+            seqs.append(seq)
+            index += count
+        return seqs, frames[index:]
+
+    def frames(self, seq):
+        buf = self.buf
+        base = self._base(seq)
+        count, _ = _SLOT_HEADER.unpack_from(buf, base)
+        offset = base + _SLOT_HEADER.size
+        for _ in range(count):
+            conn_id, size = _FRAME_HEADER.unpack_from(buf, offset)
+            offset += _FRAME_HEADER.size
+            yield conn_id, buf[offset:offset + size]
+            offset += size
+
+    def release(self, seq):
+        struct.pack_into('<Q', self.buf, 8, seq)
+
+    def unlink(self):
+        try:
+            self.shm.unlink()
+        except FileNotFoundError:
+            pass
+
+
+class RemoteSocket:
+    # 模擬行程裡代表 worker 上的一條玩家連線，提供遊戲邏輯用到的 WebSocketResponse
+    # 介面；送出的訊息排進該 worker 這個 tick 的批次，tick 結束時一起寫進環狀緩衝
+
+    def __init__(self, link, conn_id):
+        self.link = link
+        self.conn_id = conn_id
+        self.player_id: Optional[str] = None
+        self.closed = False
+
+    async def send_str(self, data, compress=None):
+        self.link.queue(self.conn_id, data.encode())
+
+    async def send_bytes(self, data, compress=None):
+        self.link.queue(self.conn_id, bytes(data))
+
+    async def send_json(self, data, compress=None):
+        self.link.queue(self.conn_id, encode(data).encode())
+
+    async def send_frame(self, message, opcode, compress=None):
+        self.link.queue(self.conn_id, bytes(message))
+
+    async def send_shared(self, frame):
+        self.link.queue(self.conn_id, frame.payload)
+
+    async def close(self, *, code=1000, message=b''):
+        if not self.closed:
+            self.closed = True
+            self.link.send(('close', self.conn_id))
+
+
+class WorkerLink:
+    # 模擬行程這端的一個 worker：控制管線、環狀緩衝與這個 tick 待送的訊息
+
+    def __init__(self, index, process, conn, ring: FrameRing):
+        self.index = index
+        self.process = process
+        self.conn = conn
+        self.ring = ring
+        self.sockets: Dict[int, RemoteSocket] = {}
+        self.pending: List[tuple] = []
+        self.alive = True
+        self.published = 0
+        self.dropped_frames = 0
+        self.piped = 0
+        self.inputs = 0
+
+    def queue(self, conn_id, payload):
+        self.pending.append((conn_id, payload))
+
+    def send(self, message):
+        if not self.alive:
+            return
+        try:
+            self.conn.send(message)
+        except (BrokenPipeError, OSError):
+            self.alive = False
+
+    def _publish(self, frames):
+        if not frames:
+            return []
+        seqs, unsent = self.ring.publish(frames)
+        for seq in seqs:
+            self.published += 1
+            # 管線只送序號當門鈴，資料留在共享記憶體
+            self.send(('frames', seq))
+        self.dropped_frames += len(unsent)
+        return [conn_id for conn_id, _ in unsent]
+
+    def flush(self):
+        # 回傳這次有訊息沒送出去的連線 id，模擬行程要讓它們重新同步
+        pending = self.pending
+        self.pending = []
+        if not self.alive:
+            self.dropped_frames += len(pending)
+            return [conn_id for conn_id, _ in pending]
+        unsent = []
+        batch = []
+        for conn_id, payload in pending:
+            if len(payload) > MAX_FRAME:
+                # 超過一格的訊息走管線；先送出前面的批次以維持順序
+                unsent += self._publish(batch)
+                batch = []
+                self.piped += 1
+                self.send(('send', conn_id, payload))
+            else:
+                batch.append((conn_id, payload))
+        unsent += self._publish(batch)
+        return unsent
+
+    def to_dict(self):
+        return {
+            'alive': self.alive and self.process.is_alive(),
+            'connections': len(self.sockets),
+            'published': self.published,
+            'droppedFrames': self.dropped_frames,
+            'piped': self.piped,
+            'inputs': self.inputs
+        }
+
+
+class IOTier:
+    # 模擬行程端：fork 出 N 個 I/O worker 共用同一個 port（SO_REUSEPORT），
+    # worker 負責連線、解析與驗證輸入，模擬行程只處理遊戲邏輯並把訊息寫進共享記憶體。
+    # on_join(ws, resume_token, since_tick) 回傳歡迎訊息；on_message(ws, data)；
+    # on_leave(ws, abusive)；on_error(exc) 記錄處理事件時的例外。
+    # 排行榜與觀戰由 worker 轉給本機的 admin_port
+
+    def __init__(self, workers, port, on_join, on_message, on_leave,
+                 admin_port=None, on_error=None):
+        self.workers = workers
+        self.port = port
+        self.admin_port = admin_port
+        self.on_join = on_join
+        self.on_message = on_message
+        self.on_leave = on_leave
+        self.on_error = on_error
+        self.errors = 0
+        self.links: List[WorkerLink] = []
+        self.inbox = deque()
+        self.ready: Optional[asyncio.Event] = None
+
+    def start(self):
+        # 必須在事件迴圈啟動前呼叫：worker 用 fork 建立
+        ctx = multiprocessing.get_context('fork')
+        for index in range(self.workers):
+            ring = FrameRing()
+            conn, child_conn = ctx.Pipe()
+            process = ctx.Process(target=run_worker,
+                                  args=(index, child_conn, ring, self.port,
+                                        self.admin_port),
+                                  daemon=True)
+            process.start()
+            child_conn.close()
+            self.links.append(WorkerLink(index, process, conn, ring))
+        print(f"Started {self.workers} I/O workers on port {self.port}")
+
+    def attach(self):
+        loop = asyncio.get_running_loop()
+        self.ready = asyncio.Event()
+        for link in self.links:
+            loop.add_reader(link.conn.fileno(), self._receive, link)
+
+    def _receive(self, link):
+        try:
+            while link.conn.poll():
+                self.inbox.append((link, link.conn.recv()))
+        except (EOFError, OSError):
+            asyncio.get_running_loop().remove_reader(link.conn.fileno())
+            link.alive = False
+            print(f"I/O worker {link.index} exited")
+            # worker 掛掉：它的連線全部視為斷線
+            for conn_id in list(link.sockets):
+                self.inbox.append((link, ('leave', conn_id, False)))
+        self.ready.set()
+
+    async def serve(self):
+        while True:
+            await self.ready.wait()
+            self.ready.clear()
+            while self.inbox:
+                link, message = self.inbox.popleft()
+                try:
+                    await self._dispatch(link, message)
+                except Exception as e:
+                    self.errors += 1
+                    if self.on_error is not None:
+                        self.on_error(e)
+
+    async def _dispatch(self, link, message):
+        kind = message[0]
+        if kind == 'in':
+            for conn_id, data in message[1]:
+                ws = link.sockets.get(conn_id)
+                if ws is not None:
+                    link.inputs += 1
+                    await self.on_message(ws, data)
+        elif kind == 'join':
+            _, conn_id, resume_token, since_tick = message
+            ws = RemoteSocket(link, conn_id)
+            link.sockets[conn_id] = ws
+            hello = await self.on_join(ws, resume_token, since_tick)
+            # 歡迎訊息走管線，保證比之後環狀緩衝裡的狀態先到
+            link.send(('send', conn_id, encode(hello).encode()))
+        elif kind == 'leave':
+            _, conn_id, abusive = message
+            ws = link.sockets.pop(conn_id, None)
+            if ws is not None:
+                ws.closed = True
+                self.on_leave(ws, abusive)
+
+    def flush(self):
+        # 回傳這個 tick 有訊息被丟掉的 RemoteSocket
+        dropped = []
+        for link in self.links:
+            for conn_id in set(link.flush()):
+                ws = link.sockets.get(conn_id)
+                if ws is not None:
+                    dropped.append(ws)
+        return dropped
+
+    def shutdown(self):
+        for link in self.links:
+            link.ring.unlink()
+
+    def to_dict(self):
+        return {
+            'workers': [link.to_dict() for link in self.links],
+            'errors': self.errors
+        }
+
+
+class Outlet:
+    # 每條連線一個送出佇列與送出 task：慢的連線只卡住自己，不會拖住其他連線或環狀緩衝
+
+    def __init__(self, ws, transport):
+        self.ws = ws
+        self.transport = transport
+        self.queue: asyncio.Queue = asyncio.Queue(SOCKET_BACKLOG)
+        self.task = asyncio.create_task(self.run())
+
+    def push(self, payload) -> bool:
+        # payload 為 None 表示送完前面的訊息後關閉連線
+        try:
+            self.queue.put_nowait(payload)
+            return True
+        except asyncio.QueueFull:
+            return False
+
+    async def run(self):
+        ws = self.ws
+        while True:
+            payload = await self.queue.get()
+            if payload is None or ws.closed:
+                break
+            try:
+                await ws.send_frame(payload, web.WSMsgType.TEXT)
+            except Exception:
+                break
+        if not ws.closed:
+            await ws.close()
+
+    def abort(self):
+        # 直接切斷 TCP，不等卡住的送出；handler 的讀取迴圈會跟著結束
+        self.task.cancel()
+        if self.transport is not None:
+            self.transport.abort()
+
+
+class IOWorker:
+    # worker 行程：接受連線、解析並驗證輸入後轉給模擬行程，
+    # 再把環狀緩衝裡的訊息直接從共享記憶體送給各連線。
+    # 排行榜與觀戰的資料在模擬行程，轉給它在本機的管理 port
+
+    def __init__(self, index, conn, ring: FrameRing, admin_port=None):
+        self.index = index
+        self.conn = conn
+        self.ring = ring
+        self.admin_url = (f'http://127.0.0.1:{admin_port}'
+                          if admin_port else None)
+        self.session: Optional[aiohttp.ClientSession] = None
+        self.sockets: Dict[int, Outlet] = {}
+        self.conn_seq = 0
+        self.inputs: List[tuple] = []
+        self.outbox: asyncio.Queue = asyncio.Queue()
+        root = os.path.dirname(os.path.abspath(__file__))
+        self.assets = StaticAssets(root)
+        self.bundles = StaticAssets(os.path.join(root, STATIC_DIR))
+        self.frames_sent = 0
+        self.inputs_sent = 0
+        self.slow_closed = 0
+
+    def send(self, message):
+        try:
+            self.conn.send(message)
+        except (BrokenPipeError, OSError):
+            pass
+
+    def queue_input(self, conn_id, data):
+        # 同一輪事件迴圈收到的輸入合併成一則管線訊息
+        if not self.inputs:
+            asyncio.get_running_loop().call_soon(self.flush_inputs)
+        self.inputs.append((conn_id, data))
+
+    def flush_inputs(self):
+        if self.inputs:
+            self.inputs_sent += len(self.inputs)
+            self.send(('in', self.inputs))
+            self.inputs = []
+
+    def _receive(self):
+        try:
+            while self.conn.poll():
+                self.outbox.put_nowait(self.conn.recv())
+        except (EOFError, OSError):
+            # 模擬行程結束，worker 跟著結束
+            os._exit(0)
+
+    def push(self, conn_id, payload):
+        outlet = self.sockets.get(conn_id)
+        if outlet is None:
+            return
+        if outlet.push(payload):
+            if payload is not None:
+                self.frames_sent += 1
+            return
+        # 佇列滿了：這條連線跟不上，斷線
+        self.slow_closed += 1
+        del self.sockets[conn_id]
+        outlet.abort()
+
+    async def deliver(self):
+        # 只把訊息分到各連線的佇列，不等任何連線送出
+        while True:
+            message = await self.outbox.get()
+            kind = message[0]
+            if kind == 'frames':
+                seq = message[1]
+                # 複製出共享記憶體：格子馬上釋放，慢的連線只會占住自己的佇列，不會占住環
+                for conn_id, payload in self.ring.frames(seq):
+                    self.push(conn_id, bytes(payload))
+                self.ring.release(seq)
+            elif kind == 'send':
+                self.push(message[1], message[2])
+            elif kind == 'close':
+                self.push(message[1], None)
+
+    async def websocket_handler(self, request):
+        ws = TunedWebSocketResponse('player',
+                                    max_msg_size=MAX_MESSAGE_SIZE * 4)
+        await ws.prepare(request)
+        guard = ConnectionGuard()
+        self.conn_seq += 1
+        conn_id = self.conn_seq
+        self.sockets[conn_id] = Outlet(ws, request.transport)
+        try:
+            since_tick = int(request.query.get('tick', 0))
+        except ValueError:
+            since_tick = 0
+        self.send(('join', conn_id, request.query.get('resume', ''),
+                   since_tick))
+
+        abusive = False
+        try:
+            async for msg in ws:
+                if msg.type == web.WSMsgType.TEXT:
+                    try:
+                        data = guard.check(msg.data)
+                        if data is None:
+                            if guard.abusive:
+                                guard_stats.disconnected += 1
+                                abusive = True
+                                break
+                            continue
+                        self.queue_input(conn_id, data)
+                    except Exception:
+                        # 單一訊息出錯只丟掉該訊息，不影響連線
+                        guard_stats.reject('error')
+                elif msg.type == web.WSMsgType.ERROR:
+                    break
+        finally:
+            outlet = self.sockets.pop(conn_id, None)
+            if outlet is not None:
+                outlet.task.cancel()
+            self.flush_inputs()
+            self.send(('leave', conn_id, abusive))
+            if not ws.closed:
+                try:
+                    await ws.close()
+                except Exception:
+                    pass
+        return ws
+
+    async def index_handler(self, request):
+        return await self.assets.serve(request, 'index.html')
+
+    async def static_handler(self, request):
+        return await self.bundles.serve(request, request.match_info['path'],
+                                        BUNDLE_CACHE_CONTROL)
+
+    def _admin(self):
+        if self.admin_url is None:
+            raise web.HTTPNotFound()
+        if self.session is None:
+            self.session = aiohttp.ClientSession()
+        return self.session
+
+    async def leaderboard_handler(self, request):
+        # If-None-Match 原樣轉送，304 也原樣回傳
+        session = self._admin()
+        headers = {}
+        if_none_match = request.headers.get('If-None-Match')
+        if if_none_match is not None:
+            headers['If-None-Match'] = if_none_match
+        try:
+            async with session.get(self.admin_url + '/leaderboard',
+                                   params=request.query,
+                                   headers=headers) as resp:
+                body = await resp.read()
+                return web.Response(
+                    status=resp.status,
+                    body=body if resp.status != 304 else None,
+                    headers={
+                        name: resp.headers[name]
+                        for name in PROXY_HEADERS if name in resp.headers
+                    })
+        except aiohttp.ClientError:
+            raise web.HTTPBadGateway()
+
+    async def spectate_handler(self, request):
+        # 觀眾這端由 worker 負責連線與壓縮，鏡頭訂閱與訊息內容由模擬行程決定
+        session = self._admin()
+        try:
+            upstream = await session.ws_connect(self.admin_url + '/spectate',
+                                                params=request.query,
+                                                compress=0)
+        except aiohttp.ClientError:
+            raise web.HTTPServiceUnavailable()
+        ws = TunedWebSocketResponse('spectator',
+                                    max_msg_size=MAX_MESSAGE_SIZE * 4)
+        try:
+            await ws.prepare(request)
+            forward = asyncio.create_task(self._forward_camera(ws, upstream))
+            try:
+                async for msg in upstream:
+                    if msg.type != web.WSMsgType.TEXT or ws.closed:
+                        break
+                    await ws.send_str(msg.data)
+            finally:
+                forward.cancel()
+        finally:
+            await upstream.close()
+            if not ws.closed:
+                await ws.close()
+        return ws
+
+    async def _forward_camera(self, ws, upstream):
+        # 鏡頭切換訊息轉給模擬行程，由那邊的 guard 驗證
+        async for msg in ws:
+            if msg.type != web.WSMsgType.TEXT:
+                break
+            await upstream.send_str(msg.data)
+        await upstream.close()
+
+    async def stats_handler(self, request):
+        return web.json_response({
+            'worker': self.index,
+            'connections': len(self.sockets),
+            'framesSent': self.frames_sent,
+            'slowClosed': self.slow_closed,
+            'inputs': self.inputs_sent,
+            'compression': compression_stats(),
+            'guard': guard_stats.to_dict()
+        })
+
+    def make_app(self):
+        app = web.Application()
+        app.router.add_get('/', self.index_handler)
+        app.router.add_get('/index.html', self.index_handler)
+        app.router.add_get('/static/{path:.+}', self.static_handler)
+        app.router.add_get('/ws', self.websocket_handler)
+        app.router.add_get('/leaderboard', self.leaderboard_handler)
+        app.router.add_get('/spectate', self.spectate_handler)
+        app.router.add_get('/stats', self.stats_handler)
+        self.assets.preload('index.html')
+        return app
+
+    async def serve(self, port):
+        asyncio.get_running_loop().add_reader(self.conn.fileno(),
+                                              self._receive)
+        asyncio.create_task(self.deliver())
+
+        runner = web.AppRunner(self.make_app())
+        await runner.setup()
+        site = web.TCPSite(runner, '0.0.0.0', port, reuse_port=True)
+        await site.start()
+        await asyncio.Event().wait()
+
+
+def run_worker(index, conn, ring, port, admin_port):
+    asyncio.run(IOWorker(index, conn, ring, admin_port).serve(port))
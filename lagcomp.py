@@ -0,0 +1,93 @@
+import math
+from array import array
+from typing import Dict, Optional, Tuple
+
+MAX_REWIND = 0.35  # 最多倒帶幾秒：涵蓋插值延遲加上一般延遲，再久就不補償
+
+
+class PositionHistory:
+    # 最近幾個 tick 的實體位置。時間放在一個環狀陣列，每個實體一條
+    # array('f') 環狀緩衝 [x0, y0, x1, y1, ...]，記錄時只寫入數值，不複製 dict。
+    # 死亡的實體不記錄，軌跡被丟掉，復活傳送後不會倒帶回死前的位置
+
+    def __init__(self, tick_rate, max_rewind=MAX_REWIND):
+        self.max_rewind = max_rewind
+        self.size = int(math.ceil(max_rewind * tick_rate)) + 2
+        self.times = array('d', bytes(8 * self.size))
+        self.seq = 0  # 已記錄的 tick 數，第 s 筆在 s % size
+        # id -> [位置緩衝, 第一筆的 seq, 最後一筆的 seq]
+        self.tracks: Dict[str, list] = {}
+        self.rewinds = 0
+        self.clamped = 0
+
+    @property
+    def latest(self):
+        return self.times[(self.seq - 1) % self.size] if self.seq else 0.0
+
+    def record(self, now, players, monsters):
+        seq = self.seq
+        slot = seq % self.size
+        self.times[slot] = now
+        tracks = self.tracks
+        i = slot * 2
+        recorded = 0
+        for entities, by_spawn_id in ((players, False), (monsters, True)):
+            for entity in entities:
+                if not entity.alive:
+                    continue
+                key = entity.spawn_id if by_spawn_id else entity.id
+                track = tracks.get(key)
+                if track is None:
+                    track = [array('f', bytes(8 * self.size)), seq, seq]
+                    tracks[key] = track
+                hist = track[0]
+                hist[i] = entity.x
+                hist[i + 1] = entity.y
+                track[2] = seq
+                recorded += 1
+        self.seq = seq + 1
+        if len(tracks) > recorded:
+            for key in [k for k, t in tracks.items() if t[2] != seq]:
+                del tracks[key]
+
+    def view_time(self, now, client_time) -> Optional[float]:
+        # 客戶端回報的畫面時間，限制在補償窗內；沒回報則不倒帶
+        if client_time is None:
+            return None
+        if client_time < now - self.max_rewind:
+            self.clamped += 1
+            return now - self.max_rewind
+        return min(now, client_time)
+
+    def position(self, key, t, x, y, now) -> Tuple[float, float]:
+        # 實體在時間 t 的位置；(x, y) 為 now 時的目前位置，當作最新一筆
+        track = self.tracks.get(key)
+        if track is None or t >= now:
+            return x, y
+        self.rewinds += 1
+        hist, since, last = track
+        times = self.times
+        size = self.size
+        oldest = max(since, last - size + 1)
+        s = last
+        while s > oldest and times[s % size] > t:
+            s -= 1
+        i = (s % size) * 2
+        t0 = times[s % size]
+        if t0 > t:
+            return hist[i], hist[i + 1]
+        if s == last:
+            x1, y1, t1 = x, y, now
+        else:
+            n = ((s + 1) % size) * 2
+            x1, y1, t1 = hist[n], hist[n + 1], times[(s + 1) % size]
+        f = (t - t0) / (t1 - t0) if t1 > t0 else 1.0
+        return hist[i] + (x1 - hist[i]) * f, hist[i + 1] + (y1 - hist[i + 1]) * f
+
+    def to_dict(self):
+        return {
+            'tracks': len(self.tracks),
+            'windowMs': round(self.max_rewind * 1000),
+            'rewinds': self.rewinds,
+            'clamped': self.clamped
+        }
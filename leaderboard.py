@@ -0,0 +1,179 @@
+import bisect
+from typing import Dict, List, Optional, Tuple
+
+from replication import encode
+
+# 各榜的分數，由高到低排；tuple 依序比較（等級榜同等級再比經驗）
+SCORES = {
+    'level': lambda p: (p.level, p.exp),
+    'gold': lambda p: (p.gold, ),
+    'pvp': lambda p: (p.pvp_kills, ),
+    'boss': lambda p: (p.boss_kills, ),
+}
+
+MAX_TOP = 50  # /leaderboard 一次最多回傳幾名
+CACHE_TTL = 1.0  # 查詢結果快取秒數
+CACHE_MAX = 1024  # 快取筆數上限，超過就整個清掉
+
+
+class RankIndex:
+    # 一個排行榜：排好序的 (-分數..., 玩家 id)。分數變動時用 bisect 移除再插入，
+    # 查詢不必重新排序。dirty 範圍記錄上次推送後名次可能變動的區段
+
+    def __init__(self):
+        self.keys: List[tuple] = []
+        self.entries: Dict[str, tuple] = {}  # 玩家 id -> 目前的 key
+        self.version = 0
+        self.dirty_lo: Optional[int] = None
+        self.dirty_hi = -1
+
+    def __len__(self):
+        return len(self.keys)
+
+    def _touch(self, lo, hi):
+        self.version += 1
+        if self.dirty_lo is None or lo < self.dirty_lo:
+            self.dirty_lo = lo
+        if hi > self.dirty_hi:
+            self.dirty_hi = hi
+
+    def update(self, player_id, score):
+        key = tuple(-s for s in score) + (player_id, )
+        old = self.entries.get(player_id)
+        if old == key:
+            return
+        keys = self.keys
+        if old is not None:
+            i = bisect.bisect_left(keys, old)
+            del keys[i]
+        j = bisect.bisect_left(keys, key)
+        keys.insert(j, key)
+        self.entries[player_id] = key
+        if old is None:
+            # 新加入：插入點之後的名次全部往後一名
+            self._touch(j, len(keys) - 1)
+        else:
+            self._touch(min(i, j), max(i, j))
+
+    def remove(self, player_id):
+        key = self.entries.pop(player_id, None)
+        if key is None:
+            return
+        i = bisect.bisect_left(self.keys, key)
+        del self.keys[i]
+        self._touch(i, len(self.keys) - 1)
+
+    def rank(self, player_id) -> Optional[int]:
+        key = self.entries.get(player_id)
+        if key is None:
+            return None
+        return bisect.bisect_left(self.keys, key) + 1
+
+    @staticmethod
+    def score(key):
+        return -key[0]
+
+    def top(self, limit) -> List[tuple]:
+        return self.keys[:limit]
+
+    def take_dirty(self) -> List[Tuple[str, int]]:
+        # 回傳名次可能改變的 (玩家 id, 名次)，並清掉 dirty 範圍
+        if self.dirty_lo is None:
+            return []
+        lo = self.dirty_lo
+        hi = min(self.dirty_hi, len(self.keys) - 1)
+        self.dirty_lo = None
+        self.dirty_hi = -1
+        keys = self.keys
+        return [(keys[i][-1], i + 1) for i in range(lo, hi + 1)]
+
+
+class Leaderboards:
+    # 只記錄在線（含斷線保留中）的玩家。分數在經驗、金幣、擊殺發生的地方增量更新；
+    # 名次變動只推給名次真的改變的玩家
+
+    def __init__(self):
+        self.boards = {name: RankIndex() for name in SCORES}
+        self.names: Dict[str, str] = {}
+        self.sent: Dict[str, Dict[str, int]] = {}  # 玩家 id -> 榜 -> 上次推送的名次
+        self.cache: Dict[tuple, tuple] = {}
+        self.pushes = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    def add(self, player):
+        self.names[player.id] = player.name
+        self.update(player)
+
+    def remove(self, player_id):
+        if self.names.pop(player_id, None) is None:
+            return
+        self.sent.pop(player_id, None)
+        for board in self.boards.values():
+            board.remove(player_id)
+
+    def update(self, player, *boards):
+        # 沒有指定榜就全部更新；未加入的玩家不記錄
+        if player.id not in self.names:
+            return
+        for name in boards or SCORES:
+            self.boards[name].update(player.id, SCORES[name](player))
+
+    def ranks(self, player_id) -> Dict[str, int]:
+        # 目前各榜名次，並記為已推送（連線、重連時隨歡迎訊息送出）
+        ranks = {}
+        for name, board in self.boards.items():
+            rank = board.rank(player_id)
+            if rank is not None:
+                ranks[name] = rank
+        self.sent[player_id] = dict(ranks)
+        return ranks
+
+    def rank_changes(self) -> Dict[str, Dict[str, int]]:
+        changes: Dict[str, Dict[str, int]] = {}
+        for name, board in self.boards.items():
+            for player_id, rank in board.take_dirty():
+                sent = self.sent.setdefault(player_id, {})
+                if sent.get(name) != rank:
+                    sent[name] = rank
+                    changes.setdefault(player_id, {})[name] = rank
+        self.pushes += len(changes)
+        return changes
+
+    def query(self, name, limit, player_id, now) -> Tuple[bytes, str]:
+        # 回傳 (JSON body, ETag)；同一查詢在 CACHE_TTL 內直接用快取
+        key = (name, limit, player_id)
+        cached = self.cache.get(key)
+        if cached is not None and now - cached[0] < CACHE_TTL:
+            self.cache_hits += 1
+            return cached[1], cached[2]
+        self.cache_misses += 1
+
+        board = self.boards[name]
+        data = {
+            'board': name,
+            'total': len(board),
+            'top': [[rank, k[-1], self.names.get(k[-1]), board.score(k)]
+                    for rank, k in enumerate(board.top(limit), 1)]
+        }
+        if player_id is not None:
+            rank = board.rank(player_id)
+            data['me'] = [rank, board.score(board.entries[player_id])
+                          ] if rank is not None else None
+        body = encode(data).encode()
+        # 回應含查詢者自己的名次，ETag 要跟著玩家與筆數變
+        me = player_id if player_id in board.entries else ''
+        etag = f'"{name}-{board.version}-{limit}-{me}"'
+
+        if len(self.cache) >= CACHE_MAX:
+            self.cache.clear()
+        self.cache[key] = (now, body, etag)
+        return body, etag
+
+    def to_dict(self):
+        return {
+            'players': len(self.names),
+            'pushes': self.pushes,
+            'cacheHits': self.cache_hits,
+            'cacheMisses': self.cache_misses
+        }
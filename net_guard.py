@@ -0,0 +1,186 @@
+import json
+import math
+import re
+import time
+from typing import Dict, Optional
+
+MAX_MESSAGE_SIZE = 512  # 單則訊息上限（bytes），正常輸入都在 100 bytes 以內
+MAX_REJECTS = 300  # 單一連線累積被拒絕次數超過此值就斷線
+# 數值欄位的絕對值上限：擋掉轉 float 會溢位的超長整數（vt 是 epoch 秒，約 1.8e9）
+MAX_NUMBER = 1e12
+
+# 每種訊息的 token bucket：(每秒補充量, 容量)
+RATE_LIMITS = {
+    'move': (60, 60),
+    'attack': (10, 5),
+    'skill': (10, 6),
+    'equip': (5, 10),
+    'unequip': (5, 10),
+    'use_item': (5, 10),
+    'upgrade': (5, 10),
+    'disassemble': (5, 10),
+}
+CONNECTION_RATE_LIMIT = (100, 120)
+
+# 欄位型別：num = 有限實數，int = 整數（兩者都限制在 ±MAX_NUMBER），
+# str = 短字串；結尾 ? 表示可省略
+SCHEMAS = {
+    'move': {'dirX': 'num', 'dirY': 'num', 'seq': 'int?'},
+    # vt：客戶端送出時畫面上顯示的伺服器時間，延遲補償用
+    'attack': {'dirX': 'num?', 'dirY': 'num?', 'vt': 'num?'},
+    'skill': {'skillId': 'int', 'dirX': 'num?', 'dirY': 'num?', 'vt': 'num?'},
+    'equip': {'index': 'int', 'uid': 'int?'},
+    'unequip': {'weaponType': 'str'},
+    'use_item': {'index': 'int', 'uid': 'int?'},
+    'upgrade': {'index': 'int', 'uid': 'int?'},
+    'disassemble': {'index': 'int', 'uid': 'int?'},
+}
+
+# 觀戰連線只能切換鏡頭
+SPECTATOR_RATE_LIMITS = {'camera': (10, 20)}
+SPECTATOR_SCHEMAS = {
+    'camera': {'mode': 'str', 'target': 'str?', 'x': 'num?', 'y': 'num?'},
+}
+
+_TYPE_RE = re.compile(r'"type"\s*:\s*"([a-z_]{1,16})"')
+
+
+def _reject_constant(name):
+    raise ValueError(f'invalid constant {name}')
+
+
+def _check_field(value, kind):
+    # 大整數與 float 比較不會轉型，不會溢位；NaN、inf 也比較不過
+    if kind == 'num':
+        return (isinstance(value, (int, float)) and not isinstance(value, bool)
+                and -MAX_NUMBER <= value <= MAX_NUMBER)
+    if kind == 'int':
+        return (isinstance(value, int) and not isinstance(value, bool)
+                and -MAX_NUMBER <= value <= MAX_NUMBER)
+    if kind == 'str':
+        return isinstance(value, str) and len(value) <= 16
+    return False
+
+
+def normalize_dir(data, unit):
+    # 方向向量：移動長度最多 1，攻擊/技能則單位化；(0, 0) 維持不變
+    if 'dirX' not in data and 'dirY' not in data:
+        return
+    x = float(data.get('dirX', 0))
+    y = float(data.get('dirY', 0))
+    length = math.hypot(x, y)
+    if length > 1 or (unit and length > 0):
+        x /= length
+        y /= length
+    data['dirX'] = x
+    data['dirY'] = y
+
+
+class TokenBucket:
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.last = time.monotonic()
+
+    def take(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+        self.last = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+
+class GuardStats:
+    # 全伺服器的拒絕統計，由 /stats 提供
+
+    def __init__(self):
+        self.accepted = 0
+        self.rejected: Dict[str, int] = {}
+        self.rejected_by_type: Dict[str, int] = {}
+        self.disconnected = 0
+
+    def reject(self, reason, msg_type=None):
+        self.rejected[reason] = self.rejected.get(reason, 0) + 1
+        if msg_type:
+            self.rejected_by_type[msg_type] = self.rejected_by_type.get(
+                msg_type, 0) + 1
+
+    def to_dict(self):
+        return {
+            'accepted': self.accepted,
+            'rejected': dict(self.rejected),
+            'rejectedByType': dict(self.rejected_by_type),
+            'disconnected': self.disconnected
+        }
+
+
+stats = GuardStats()
+
+
+class ConnectionGuard:
+    # 每條連線一個：在完整解析 JSON 之前先擋掉過大、過快或型別不明的訊息
+
+    def __init__(self, schemas=SCHEMAS, rate_limits=RATE_LIMITS):
+        self.schemas = schemas
+        self.bucket = TokenBucket(*CONNECTION_RATE_LIMIT)
+        self.buckets = {
+            msg_type: TokenBucket(rate, burst)
+            for msg_type, (rate, burst) in rate_limits.items()
+        }
+        self.rejects = 0
+
+    @property
+    def abusive(self):
+        return self.rejects > MAX_REJECTS
+
+    def _reject(self, reason, msg_type=None):
+        self.rejects += 1
+        stats.reject(reason, msg_type)
+        return None
+
+    def check(self, raw: str) -> Optional[dict]:
+        if len(raw) > MAX_MESSAGE_SIZE:
+            return self._reject('size')
+
+        now = time.monotonic()
+        if not self.bucket.take(now):
+            return self._reject('rate')
+
+        match = _TYPE_RE.search(raw)
+        msg_type = match.group(1) if match else None
+        schema = self.schemas.get(msg_type)
+        if schema is None:
+            return self._reject('type')
+        if not self.buckets[msg_type].take(now):
+            return self._reject('rate', msg_type)
+
+        try:
+            data = json.loads(raw, parse_constant=_reject_constant)
+        except ValueError:
+            return self._reject('json', msg_type)
+        if not isinstance(data, dict) or data.get('type') != msg_type:
+            return self._reject('schema', msg_type)
+
+        for field, kind in schema.items():
+            optional = kind.endswith('?')
+            kind = kind.rstrip('?')
+            if field not in data:
+                if optional:
+                    continue
+                return self._reject('schema', msg_type)
+            if not _check_field(data[field], kind):
+                return self._reject('schema', msg_type)
+
+        try:
+            if msg_type == 'move':
+                normalize_dir(data, unit=False)
+            elif msg_type in ('attack', 'skill'):
+                normalize_dir(data, unit=True)
+        except (ArithmeticError, ValueError):
+            return self._reject('schema', msg_type)
+
+        stats.accepted += 1
+        return data
@@ -0,0 +1,110 @@
+import json
+import math
+from typing import Dict, List
+
+ENTITY_BYTE_BUDGET = 4096  # 每則狀態訊息中實體資料的位元組上限（每位客戶端）
+
+VIEW_RANGE = 1200  # 距離加權的範圍，超出只靠時間累積
+DIST_WEIGHT = 4.0  # 貼身實體每次廣播額外累積的優先度
+DRIFT_SCALE = 40.0  # 距離上次送出位置每移動這麼多 px 加 1（速度 × 經過時間）
+CHANGE_BONUS = 6.0  # 血量或生死狀態改變
+TARGET_BONUS = 8.0  # 正在追打這位玩家的怪物
+ATTACKED_BONUS = 3.0  # 這位玩家打過的怪物
+BOSS_BONUS = 4.0
+NEW_PRIORITY = 1000.0  # 客戶端還沒看過的實體優先送
+
+_SEPARATORS = (',', ':')
+
+
+def encode(data):
+    return json.dumps(data, separators=_SEPARATORS)
+
+
+class Snapshot:
+    # 一次廣播共用：每個實體只編碼一次，所有客戶端挑選後直接拼接
+
+    def __init__(self, players, monsters):
+        self.entities = []
+        for player in players:
+            self.entities.append(('p' + player.id, player, False,
+                                  encode(player.to_public_dict())))
+        for monster in monsters:
+            self.entities.append(('m' + monster.spawn_id, monster, True,
+                                  encode(monster.to_dict())))
+
+
+class ViewScheduler:
+    # 每位客戶端一個：每個實體依距離、移動量、相關性累積優先度，
+    # 每次廣播從最高的開始填，直到位元組預算用完；送出後歸零
+
+    def __init__(self):
+        # key -> [累積優先度, 送出時 x, 送出時 y, 送出時 hp, 送出時 alive]
+        self.tracked: Dict[str, list] = {}
+        self.sent_bytes = 0
+        self.deferred = 0
+        # 客戶端手上的實體清單不可信（重新連線或訊息沒送到），下一則狀態要它整個重建
+        self.resync = False
+
+    def reset(self):
+        self.tracked.clear()
+        self.resync = True
+
+    def _priority(self, viewer, entity, is_monster, sent):
+        dist = math.hypot(entity.x - viewer.x, entity.y - viewer.y)
+        priority = 1.0 + DIST_WEIGHT * max(0.0, 1 - dist / VIEW_RANGE)
+        priority += math.hypot(entity.x - sent[1], entity.y - sent[2]) / DRIFT_SCALE
+        if entity.hp != sent[3] or entity.alive != sent[4]:
+            priority += CHANGE_BONUS
+        if is_monster:
+            if entity.target_player == viewer.id:
+                priority += TARGET_BONUS
+            elif viewer.id in entity.ledger.totals:
+                priority += ATTACKED_BONUS
+            if entity.is_boss:
+                priority += BOSS_BONUS
+        return priority
+
+    def select(self, viewer, snapshot: Snapshot, view_radius=None):
+        # 回傳 (玩家 json 片段, 怪物 json 片段, 已消失的 key)；
+        # 有 view_radius 時，範圍外的實體也當作消失
+        candidates = []
+        present = set()
+        r2 = view_radius * view_radius if view_radius is not None else None
+        for key, entity, is_monster, payload in snapshot.entities:
+            if entity is viewer:
+                continue
+            if r2 is not None and ((entity.x - viewer.x)**2 +
+                                   (entity.y - viewer.y)**2 > r2):
+                continue
+            present.add(key)
+            sent = self.tracked.get(key)
+            if sent is None:
+                sent = [NEW_PRIORITY, entity.x, entity.y, entity.hp,
+                        entity.alive]
+                self.tracked[key] = sent
+            else:
+                sent[0] += self._priority(viewer, entity, is_monster, sent)
+            candidates.append((sent[0], key, entity, is_monster, payload))
+
+        gone = [key for key in self.tracked if key not in present]
+        for key in gone:
+            del self.tracked[key]
+
+        candidates.sort(key=lambda c: c[0], reverse=True)
+        players: List[str] = []
+        monsters: List[str] = []
+        budget = ENTITY_BYTE_BUDGET
+        deferred = 0
+        for _, key, entity, is_monster, payload in candidates:
+            size = len(payload) + 1
+            if size > budget:
+                deferred += 1
+                continue
+            budget -= size
+            (monsters if is_monster else players).append(payload)
+            self.tracked[key] = [0.0, entity.x, entity.y, entity.hp,
+                                 entity.alive]
+
+        self.sent_bytes += ENTITY_BYTE_BUDGET - budget
+        self.deferred = deferred
+        return players, monsters, gone
@@ -0,0 +1,376 @@
+import argparse
+import asyncio
+import csv
+import itertools
+import json
+import math
+import os
+import random
+import statistics
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional
+
+import game_server as gs
+from telemetry import Telemetry
+
+# 離線平衡模擬：用固定步長推進 update_game，由腳本機器人透過 handle_message 操作，
+# 不開 socket、不等真實時間。每個場景用自己的亂數種子，結果可重現
+
+# 模擬時鐘起點；從 0 開始會讓「距上次命中 > 0.5 秒」的判定第一下失效
+START_TIME = 1000.0
+DEFAULT_MAX_TIME = 300.0  # 場景最長模擬秒數，超過算沒打倒
+DODGE_RADIUS = 110  # 隕石落點半徑 100，多留一點
+# 各武器類型的站位距離（到目標中心）
+STANDOFF = {
+    'E': 300,  # 投射物
+    'R': 140,  # 技能 3 範圍 180
+    'W': 80,  # 環繞球距離
+    None: 300,  # 沒有武器：普攻投射物
+}
+POTION_HP = 0.3  # 血量低於此比例時喝藥水
+HEAL_HP = 0.6  # 沒有 E 武器時，技能 2 是治療
+
+
+class Scenario:
+
+    def __init__(self, weapon, weapon_level=1, level=1, party=1,
+                 target='boss', dodge=True):
+        self.weapon = weapon  # WEAPON_DEFINITIONS 的 id，None 表示空手
+        self.weapon_level = weapon_level
+        self.level = level
+        self.party = party
+        self.target = target  # 'boss' 或 MONSTER_TYPES 的 key
+        self.dodge = dodge
+
+    def key(self):
+        return (self.target, self.weapon or 'none', self.weapon_level,
+                self.level, self.party)
+
+
+class Bot:
+
+    def __init__(self, player, weapon_type):
+        self.player = player
+        self.standoff = STANDOFF[weapon_type]
+        self.has_e = weapon_type == 'E'
+
+    async def act(self, target, meteor_zones, dodge):
+        player = self.player
+        if not player.alive:
+            return
+        pid = player.id
+        dx = target.x - player.x
+        dy = target.y - player.y
+        dist = math.hypot(dx, dy) or 1.0
+        fx, fy = dx / dist, dy / dist
+
+        mx = my = 0.0
+        danger = None
+        if dodge:
+            for zx, zy in meteor_zones:
+                if math.hypot(player.x - zx, player.y - zy) < DODGE_RADIUS:
+                    danger = (zx, zy)
+                    break
+        if danger is not None:
+            ax, ay = player.x - danger[0], player.y - danger[1]
+            d = math.hypot(ax, ay) or 1.0
+            mx, my = ax / d, ay / d
+        elif dist > self.standoff + 15:
+            mx, my = fx, fy
+        elif dist < self.standoff - 15:
+            mx, my = -fx, -fy
+        await gs.handle_message(pid, {'type': 'move', 'dirX': mx,
+                                      'dirY': my})
+        await gs.handle_message(pid, {'type': 'attack', 'dirX': fx,
+                                      'dirY': fy})
+        await gs.handle_message(pid, {'type': 'skill', 'skillId': 1,
+                                      'dirX': fx, 'dirY': fy})
+        if self.has_e or player.hp < player.maxHp * HEAL_HP:
+            await gs.handle_message(pid, {'type': 'skill', 'skillId': 2,
+                                          'dirX': fx, 'dirY': fy})
+        if dist < 180:
+            await gs.handle_message(pid, {'type': 'skill', 'skillId': 3,
+                                          'dirX': fx, 'dirY': fy})
+        if player.hp < player.maxHp * POTION_HP:
+            for index, item in enumerate(player.inventory.items):
+                if item.id == 'healing_potion':
+                    await gs.handle_message(pid, {'type': 'use_item',
+                                                  'index': index})
+                    break
+
+
+class Simulation:
+    # 一個場景一個全新的 GameState；遊戲邏輯都透過 game_server 的模組全域讀取，
+    # 換掉 gs.game 就等於換了世界
+
+    def __init__(self, scenario: Scenario, seed, max_time=DEFAULT_MAX_TIME):
+        self.scenario = scenario
+        self.max_time = max_time
+        self.now = START_TIME
+        random.seed(seed)
+        self.game = gs.GameState()
+        self.game.clock = self.clock
+        self.game.last_update = self.now
+        gs.game = self.game
+        self.bots: List[Bot] = []
+        self.upgrade_gold = 0
+
+    def clock(self):
+        return self.now
+
+    def spawn_target(self):
+        game = self.game
+        if self.scenario.target == 'boss':
+            return game.monsters[0]
+        monster = gs.Monster('sim_target', gs.BOSS_SPAWN['x'],
+                             gs.BOSS_SPAWN['y'], self.scenario.target)
+        game.monsters = [monster]
+        return monster
+
+    async def add_bot(self, index, target):
+        scenario = self.scenario
+        player = gs.Player(self.game.new_player_id(), f'bot{index + 1}')
+        self.game.add_player(player)
+        while player.level < scenario.level:
+            player.add_exp(player.expToNextLevel - player.exp)
+
+        weapon_type = None
+        if scenario.weapon:
+            weapon_def = gs.WEAPON_DEFINITIONS[scenario.weapon]
+            weapon_type = weapon_def['type']
+            player.add_to_inventory({
+                'id': scenario.weapon,
+                'name': weapon_def['name'],
+                'icon': weapon_type,
+                'color': '#666',
+                'isWeapon': True,
+                'level': 1,
+                'type': weapon_type,
+                'count': 1
+            })
+            index_in_bag = len(player.inventory.items) - 1
+            player.inventory.equip(player.inventory.items[index_in_bag])
+            # 升級走正常的訊息處理，花費就是目前的升級成本曲線
+            player.gold = gold = 10**9
+            for _ in range(scenario.weapon_level - 1):
+                await gs.handle_message(player.id, {'type': 'upgrade',
+                                                    'index': index_in_bag})
+            self.upgrade_gold = gold - player.gold
+            player.gold = 0
+
+        # 隊伍在目標前方排成一列
+        angle = random.random() * math.pi * 2
+        spread = (index - (scenario.party - 1) / 2) * 60
+        distance = STANDOFF[weapon_type] + 100
+        cos, sin = math.cos(angle), math.sin(angle)
+        player.x = target.x + cos * distance - sin * spread
+        player.y = target.y + sin * distance + cos * spread
+        player.x = max(player.r, min(gs.MAP_W - player.r, player.x))
+        player.y = max(player.r, min(gs.MAP_H - player.r, player.y))
+        self.bots.append(Bot(player, weapon_type))
+
+    def meteor_zones(self, target):
+        zones = [(m['targetX'], m['targetY']) for m in self.game.meteors]
+        if (target.is_boss and target.skill_prepare_time > 0
+                and target.skill_type == 'meteor'):
+            zones.append((target.skill_target_x, target.skill_target_y))
+        return zones
+
+    async def run(self) -> Dict:
+        game = self.game
+        scenario = self.scenario
+        target = self.spawn_target()
+        for i in range(scenario.party):
+            await self.add_bot(i, target)
+
+        dt = 1 / gs.TICK_RATE
+        ticks = int(self.max_time * gs.TICK_RATE)
+        deaths = 0
+        friendly = 0
+        killed_at: Optional[float] = None
+        for _ in range(ticks):
+            zones = self.meteor_zones(target) if scenario.dodge else ()
+            for bot in self.bots:
+                await bot.act(target, zones, scenario.dodge)
+            self.now += dt
+            game.last_update = self.now
+            await gs.update_game(dt)
+            game.tick += 1
+            for code, _, _, src, dst, _ in game.combat.events.drain():
+                if code == gs.EV_KILL and dst in game.players:
+                    deaths += 1
+                    if src in game.players:
+                        friendly += 1
+            if not target.alive:
+                killed_at = self.now - START_TIME
+                break
+
+        elapsed = killed_at if killed_at is not None else self.max_time
+        damage = target.maxHp - max(0.0, target.hp) if target.alive else \
+            target.maxHp
+        return {
+            'target': scenario.target,
+            'weapon': scenario.weapon or 'none',
+            'weaponLevel': scenario.weapon_level,
+            'level': scenario.level,
+            'party': scenario.party,
+            'killed': killed_at is not None,
+            'ttk': round(killed_at, 3) if killed_at is not None else None,
+            'dps': round(damage / elapsed, 2),
+            'deaths': deaths,
+            'friendlyKills': friendly,
+            'upgradeGold': self.upgrade_gold,
+            'ticks': game.tick
+        }
+
+
+def _init_worker(overrides):
+    # 每個 worker 行程一次：關掉事件記錄、套用平衡參數覆寫
+    gs.telemetry = Telemetry(None)
+    apply_overrides(overrides)
+
+
+def apply_overrides(overrides):
+    # 'BOSS_TYPE.hp=3000'、'WEAPON_DEFINITIONS.R_WEAPON_BASIC.baseDmg=60'
+    for override in overrides:
+        path, _, raw = override.partition('=')
+        names = path.split('.')
+        node = getattr(gs, names[0])
+        for name in names[1:-1]:
+            node = node[name]
+        try:
+            value = json.loads(raw)
+        except ValueError:
+            value = raw
+        node[names[-1]] = value
+        if names[0] == 'BOSS_TYPE' and names[-1] == 'hp':
+            node['maxHp'] = value
+
+
+def run_scenario(job):
+    scenario, seed, max_time = job
+    started = time.perf_counter()
+    result = asyncio.run(Simulation(scenario, seed, max_time).run())
+    result['seed'] = seed
+    result['cpuMs'] = round((time.perf_counter() - started) * 1000, 1)
+    return result
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def summarize(results) -> List[Dict]:
+    groups: Dict[tuple, List[Dict]] = {}
+    for r in results:
+        key = (r['target'], r['weapon'], r['weaponLevel'], r['level'],
+               r['party'])
+        groups.setdefault(key, []).append(r)
+    rows = []
+    for key, runs in sorted(groups.items()):
+        ttks = [r['ttk'] for r in runs if r['killed']]
+        rows.append({
+            'target': key[0],
+            'weapon': key[1],
+            'wLv': key[2],
+            'lv': key[3],
+            'party': key[4],
+            'runs': len(runs),
+            'kill%': round(100 * len(ttks) / len(runs)),
+            'ttkMed': round(statistics.median(ttks), 1) if ttks else None,
+            'ttkP90': round(percentile(ttks, 0.9), 1) if ttks else None,
+            'dps': round(statistics.mean(r['dps'] for r in runs), 1),
+            'deaths': round(statistics.mean(r['deaths'] for r in runs), 2),
+            'upgGold': runs[0]['upgradeGold']
+        })
+    return rows
+
+
+def format_table(rows) -> str:
+    if not rows:
+        return '(no results)'
+    columns = list(rows[0])
+    cells = [[('-' if row[c] is None else str(row[c])) for c in columns]
+             for row in rows]
+    widths = [
+        max(len(c), *(len(line[i]) for line in cells))
+        for i, c in enumerate(columns)
+    ]
+    lines = ['  '.join(c.rjust(w) for c, w in zip(columns, widths))]
+    lines.append('  '.join('-' * w for w in widths))
+    lines.extend('  '.join(v.rjust(w) for v, w in zip(line, widths))
+                 for line in cells)
+    return '\n'.join(lines)
+
+
+def build_jobs(args) -> List[tuple]:
+    weapons = [None if w == 'none' else w for w in args.weapons.split(',')]
+    for weapon in weapons:
+        if weapon is not None and weapon not in gs.WEAPON_DEFINITIONS:
+            raise SystemExit(f'Unknown weapon: {weapon}')
+    if args.target != 'boss' and args.target not in gs.MONSTER_TYPES:
+        raise SystemExit(f'Unknown target: {args.target}')
+    jobs = []
+    grid = itertools.product(weapons, _ints(args.weapon_levels),
+                             _ints(args.levels), _ints(args.party))
+    for weapon, weapon_level, level, party in grid:
+        scenario = Scenario(weapon, weapon_level, level, party, args.target,
+                            not args.no_dodge)
+        for run in range(args.runs):
+            seed = f'{args.seed}:{":".join(map(str, scenario.key()))}:{run}'
+            jobs.append((scenario, seed, args.max_time))
+    return jobs
+
+
+def _ints(text):
+    return [int(v) for v in text.split(',')]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Headless balance simulator: runs scripted fights over '
+        'a process pool and prints summary tables.')
+    parser.add_argument('--target', default='boss',
+                        help="'boss' or a MONSTER_TYPES key")
+    parser.add_argument('--weapons', default=','.join(gs.WEAPON_DEFINITIONS),
+                        help="comma-separated weapon ids, 'none' for unarmed")
+    parser.add_argument('--weapon-levels', default='1')
+    parser.add_argument('--levels', default='1')
+    parser.add_argument('--party', default='1')
+    parser.add_argument('--runs', type=int, default=20)
+    parser.add_argument('--seed', default='0')
+    parser.add_argument('--max-time', type=float, default=DEFAULT_MAX_TIME)
+    parser.add_argument('--no-dodge', action='store_true')
+    parser.add_argument('--set', action='append', default=[],
+                        metavar='NAME.key=value',
+                        help='override a balance constant, '
+                        'e.g. BOSS_TYPE.hp=3000')
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--csv', help='write every run to this CSV file')
+    args = parser.parse_args()
+
+    jobs = build_jobs(args)
+    started = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=args.workers,
+                             initializer=_init_worker,
+                             initargs=(args.set, )) as pool:
+        results = list(
+            pool.map(run_scenario, jobs,
+                     chunksize=max(1, len(jobs) // (args.workers * 4))))
+    wall = time.perf_counter() - started
+
+    print(format_table(summarize(results)))
+    simulated = sum(r['ticks'] for r in results) / gs.TICK_RATE
+    print(f'\n{len(results)} runs, {simulated:.0f} simulated seconds in '
+          f'{wall:.1f} s ({simulated / wall:.0f}x real time)')
+    if args.csv:
+        with open(args.csv, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=list(results[0]))
+            writer.writeheader()
+            writer.writerows(results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,186 @@
+import math
+import random
+from typing import Dict, List, Optional, Tuple
+
+SPAWN_INTERVAL = 0.5  # 生怪檢查間隔（秒）
+MAX_SPAWNS_PER_PASS = 4  # 每次檢查最多生幾隻，避免一次湧出
+MAX_MONSTERS = 300  # 不論量測結果，一般怪物的絕對上限
+
+ACTIVATION_MARGIN = 600  # 玩家在區域外這個距離內也算在附近
+PER_PLAYER = 2.5  # 附近每多一位玩家，區域目標數量增加多少
+IDLE_DESPAWN = 15.0  # 區域沒有玩家超過此秒數後，收掉沒在追人的怪
+
+TICK_BUDGET_SHARE = 0.5  # 模擬最多只用掉 tick 時間的這個比例
+COST_SMOOTHING = 0.1  # tick 耗時指數移動平均的權重
+
+# 附近玩家越多，較強的怪物權重越高：weight * (1 + bias * 附近玩家數)
+DENSITY_TYPE_BIAS = {'BASIC': 0.0, 'FAST': 0.15, 'TANK': 0.25}
+
+
+class SpawnRegion:
+
+    def __init__(self, index, x, y, w, h, weight, types, cap):
+        self.index = index
+        self.x = x
+        self.y = y
+        self.w = w
+        self.h = h
+        self.weight = weight
+        self.types = types
+        self.cap = cap
+        self.nearby = 0
+        self.empty_since: Optional[float] = None
+
+    @classmethod
+    def from_dict(cls, index, data):
+        return cls(index, data['x'], data['y'], data['w'], data['h'],
+                   data.get('weight', 1.0), data['types'], data.get('cap', 12))
+
+    def near(self, x, y, margin=ACTIVATION_MARGIN):
+        return (self.x - margin <= x <= self.x + self.w + margin
+                and self.y - margin <= y <= self.y + self.h + margin)
+
+    def target(self):
+        if not self.nearby:
+            return 0
+        return min(self.cap, math.ceil(1 + PER_PLAYER * self.nearby))
+
+    def pick_type(self):
+        types = list(self.types)
+        weights = [
+            self.types[t] * (1 + DENSITY_TYPE_BIAS.get(t, 0) * self.nearby)
+            for t in types
+        ]
+        return random.choices(types, weights)[0]
+
+    def pick_point(self, margin):
+        return (self.x + margin + random.random() * max(0, self.w - 2 * margin),
+                self.y + margin + random.random() * max(0, self.h - 2 * margin))
+
+
+class Spawner:
+    # 依附近玩家密度決定每個區域要維持多少怪物與種類比例，
+    # 總數受量測到的 tick 耗時限制，不會把遊戲迴圈推過 tick 預算
+
+    def __init__(self, regions, tick_rate):
+        self.regions = [
+            SpawnRegion.from_dict(i, data) for i, data in enumerate(regions)
+        ]
+        self.tick_budget = 1 / tick_rate
+        self.tick_cost = 0.0
+        self.entity_cost = 0.0
+        self.budget = MAX_MONSTERS
+        self.next_pass = 0.0
+        self.seq = 0
+        self.spawned = 0
+        self.despawned = 0
+
+    def record_tick(self, elapsed, entities):
+        # 用指數移動平均估計每個實體每 tick 的模擬成本
+        self.tick_cost += (elapsed - self.tick_cost) * COST_SMOOTHING
+        if entities:
+            per_entity = elapsed / entities
+            self.entity_cost += (per_entity - self.entity_cost) * COST_SMOOTHING
+
+    def update_budget(self, monsters, others):
+        # others = 玩家與投射物等不受生怪控制的實體
+        if self.entity_cost <= 0:
+            self.budget = MAX_MONSTERS
+            return
+        allowed = int(self.tick_budget * TICK_BUDGET_SHARE / self.entity_cost)
+        budget = max(0, min(MAX_MONSTERS, allowed - others))
+        if self.tick_cost > self.tick_budget * TICK_BUDGET_SHARE:
+            # 已經超過預算：不再生怪，並讓上限降到現有數量以下
+            budget = min(budget, max(0, monsters - MAX_SPAWNS_PER_PASS))
+        self.budget = budget
+
+    def new_id(self):
+        self.seq += 1
+        return f'monster_{self.seq}'
+
+    def plan(self, now, players, monsters,
+             others) -> Tuple[List[Tuple[int, str, float, float]], List]:
+        # 回傳 (要生成的 [(區域, 種類, x, y)], 要移除的怪物)
+        counts: Dict[int, List] = {region.index: [] for region in self.regions}
+        # 追的玩家已經不在（離線被移除）的怪物也算閒置
+        present = {p.id for p in players}
+        for monster in monsters:
+            if monster.region is not None and monster.region in counts:
+                counts[monster.region].append(monster)
+
+        for region in self.regions:
+            region.nearby = sum(1 for p in players
+                                if p.alive and region.near(p.x, p.y))
+            if region.nearby:
+                region.empty_since = None
+            elif region.empty_since is None:
+                region.empty_since = now
+
+        self.update_budget(len(monsters), others)
+
+        despawns = []
+        over = len(monsters) - self.budget
+        for region in self.regions:
+            members = counts[region.index]
+            idle_region = (region.empty_since is not None
+                           and now - region.empty_since >= IDLE_DESPAWN)
+            if idle_region:
+                limit = len(members)
+            else:
+                # 超出預算時，只收掉比目標數量多出來的部分
+                limit = min(over, len(members) - region.target())
+            for monster in members:
+                if limit <= 0:
+                    break
+                if monster.alive and monster.target_player not in present:
+                    despawns.append(monster)
+                    over -= 1
+                    limit -= 1
+
+        if over > 0:
+            # 仍超出硬上限：從任何區域收掉沒在追人的怪
+            removed = {id(m) for m in despawns}
+            for monster in monsters:
+                if over <= 0:
+                    break
+                if (id(monster) not in removed and monster.alive
+                        and monster.target_player not in present):
+                    despawns.append(monster)
+                    over -= 1
+
+        spawns = []
+        room = min(MAX_SPAWNS_PER_PASS,
+                   self.budget - len(monsters) + len(despawns))
+        deficits = {
+            region.index: region.target() - len(counts[region.index])
+            for region in self.regions
+        }
+        while room > 0:
+            candidates = [r for r in self.regions if deficits[r.index] > 0]
+            if not candidates:
+                break
+            region = random.choices(
+                candidates,
+                [r.weight * deficits[r.index] for r in candidates])[0]
+            monster_type = region.pick_type()
+            x, y = region.pick_point(30)
+            spawns.append((region.index, monster_type, x, y))
+            deficits[region.index] -= 1
+            room -= 1
+
+        self.spawned += len(spawns)
+        self.despawned += len(despawns)
+        return spawns, despawns
+
+    def to_dict(self):
+        return {
+            'budget': self.budget,
+            'tickCostMs': round(self.tick_cost * 1000, 3),
+            'entityCostUs': round(self.entity_cost * 1e6, 2),
+            'spawned': self.spawned,
+            'despawned': self.despawned,
+            'regions': [{
+                'nearby': r.nearby,
+                'target': r.target()
+            } for r in self.regions]
+        }
@@ -0,0 +1,219 @@
+import asyncio
+from typing import Dict, Optional, Set
+
+from aiohttp import web
+
+from combat import events_for
+from replication import Snapshot, encode
+from ws_compress import SharedFrame
+
+MAX_SPECTATORS = 5000
+MAX_CAMERAS = 256  # 不同鏡頭的上限（每個鏡頭每次廣播編碼一次）；Boss 鏡頭不受限
+CAMERA_RADIUS = 1100  # 鏡頭範圍：涵蓋 1280x720 畫面與自由鏡頭格子的偏移
+FREE_CAMERA_CELL = 400  # 自由鏡頭以此大小的格子共用，同一格的觀眾拿同一份資料
+CAMERA_MODES = ('free', 'player', 'boss')
+VIEWER_BACKLOG = 8  # 每位觀眾排隊待送的訊息上限；送不出去堆到這麼多就斷線
+
+
+class Camera:
+
+    def __init__(self, key, mode, target=None, x=0.0, y=0.0):
+        self.key = key
+        self.mode = mode
+        self.target = target
+        self.x = x
+        self.y = y
+        self.viewers: Set[web.WebSocketResponse] = set()
+
+    def follow(self, players, monsters):
+        # 跟隨目標時更新鏡頭位置；目標不在了就停在最後的位置
+        if self.mode == 'player':
+            player = players.get(self.target)
+            if player is not None:
+                self.x = player.x
+                self.y = player.y
+        elif self.mode == 'boss':
+            for monster in monsters:
+                if monster.is_boss:
+                    self.x = monster.x
+                    self.y = monster.y
+                    break
+
+    def encode_state(self, tick, server_time, snapshot: Snapshot, projectiles,
+                     lasers, meteors, events) -> bytes:
+        r2 = CAMERA_RADIUS * CAMERA_RADIUS
+        players = []
+        monsters = []
+        for _, entity, is_monster, payload in snapshot.entities:
+            if (entity.x - self.x)**2 + (entity.y - self.y)**2 <= r2:
+                (monsters if is_monster else players).append(payload)
+        state = encode({
+            'type': 'spectate',
+            'tick': tick,
+            'st': server_time,
+            'cam': {
+                'mode': self.mode,
+                'target': self.target,
+                'x': round(self.x, 1),
+                'y': round(self.y, 1)
+            },
+            'projectiles': [
+                p for p in projectiles
+                if (p['x'] - self.x)**2 + (p['y'] - self.y)**2 <= r2
+            ],
+            'lasers': lasers,
+            'meteors': meteors,
+            'ev': events_for(events, None, self.x, self.y, CAMERA_RADIUS)
+        })
+        return (f'{state[:-1]},"players":[{",".join(players)}],'
+                f'"monsters":[{",".join(monsters)}]}}').encode()
+
+
+class Viewer:
+    # 每位觀眾一個送出佇列與送出 task：遊戲迴圈只把訊息放進佇列，慢的觀眾只卡住自己
+
+    def __init__(self, ws, transport=None):
+        self.ws = ws
+        self.transport = transport
+        self.queue: asyncio.Queue = asyncio.Queue(VIEWER_BACKLOG)
+        self.task: Optional[asyncio.Task] = None
+
+    def push(self, frame: SharedFrame) -> bool:
+        if self.task is None:
+            self.task = asyncio.create_task(self.run())
+        try:
+            self.queue.put_nowait(frame)
+            return True
+        except asyncio.QueueFull:
+            return False
+
+    async def run(self):
+        ws = self.ws
+        while not ws.closed:
+            frame = await self.queue.get()
+            try:
+                await ws.send_shared(frame)
+            except Exception:
+                break
+
+    def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+
+    def abort(self):
+        # 直接切斷 TCP，不等卡住的送出；handler 的讀取迴圈會跟著結束
+        self.stop()
+        if self.transport is not None:
+            self.transport.abort()
+
+
+class SpectatorHub:
+    # 觀戰連線不建立 Player：每個鏡頭每次廣播只編碼、壓縮一次，再把同一份 bytes 送給所有觀眾
+
+    def __init__(self):
+        self.cameras: Dict[tuple, Camera] = {}
+        self.viewers: Dict[web.WebSocketResponse, tuple] = {}
+        self.outlets: Dict[web.WebSocketResponse, Viewer] = {}
+        self.encoded = 0
+        self.sent = 0
+        self.lagging = 0
+
+    def __len__(self):
+        return len(self.viewers)
+
+    @staticmethod
+    def camera_key(mode, target=None, x=0.0, y=0.0):
+        if mode == 'player':
+            return ('player', target)
+        if mode == 'boss':
+            return ('boss', )
+        return ('free', int(x // FREE_CAMERA_CELL), int(y // FREE_CAMERA_CELL))
+
+    def connect(self, ws, transport=None):
+        self.outlets[ws] = Viewer(ws, transport)
+
+    def disconnect(self, ws):
+        self.unsubscribe(ws)
+        viewer = self.outlets.pop(ws, None)
+        if viewer is not None:
+            viewer.stop()
+        return viewer
+
+    def subscribe(self, ws, mode, target=None, x=0.0, y=0.0) -> Optional[Camera]:
+        if mode not in CAMERA_MODES or (mode == 'player' and not target):
+            return None
+        self.unsubscribe(ws)
+        key = self.camera_key(mode, target, x, y)
+        camera = self.cameras.get(key)
+        if camera is None:
+            if len(self.cameras) >= MAX_CAMERAS and mode != 'boss':
+                return None
+            if mode == 'free':
+                # 自由鏡頭固定在格子中心
+                x = (key[1] + 0.5) * FREE_CAMERA_CELL
+                y = (key[2] + 0.5) * FREE_CAMERA_CELL
+            camera = Camera(key, mode, target, x, y)
+            self.cameras[key] = camera
+        camera.viewers.add(ws)
+        self.viewers[ws] = key
+        return camera
+
+    def unsubscribe(self, ws):
+        key = self.viewers.pop(ws, None)
+        camera = self.cameras.get(key) if key else None
+        if camera is not None:
+            camera.viewers.discard(ws)
+            if not camera.viewers:
+                del self.cameras[key]
+
+    def fan_out(self, viewers, payload: bytes):
+        # 同一份 bytes 只壓縮一次；這裡只排進各觀眾的佇列，不等任何連線送出
+        frame = SharedFrame(payload)
+        for ws in list(viewers):
+            if ws.closed:
+                self.disconnect(ws)
+                continue
+            viewer = self.outlets.get(ws)
+            if viewer is None:
+                continue
+            if viewer.push(frame):
+                self.sent += 1
+            else:
+                # 佇列滿了：這位觀眾跟不上，斷線
+                self.lagging += 1
+                self.disconnect(ws)
+                viewer.abort()
+
+    def broadcast(self, tick, server_time, players, monsters,
+                        snapshot: Snapshot, projectiles, lasers, meteors,
+                        events):
+        for camera in list(self.cameras.values()):
+            camera.follow(players, monsters)
+            payload = camera.encode_state(tick, server_time, snapshot,
+                                          projectiles, lasers, meteors,
+                                          events)
+            self.encoded += 1
+            self.fan_out(camera.viewers, payload)
+
+    @staticmethod
+    def encode_roster(players, monsters) -> bytes:
+        # 可跟隨的玩家清單與 Boss 狀態
+        boss = next((m for m in monsters if m.is_boss), None)
+        return encode({
+            'type': 'roster',
+            'players': [[p.id, p.name, p.level] for p in players.values()],
+            'boss': bool(boss and boss.alive)
+        }).encode()
+
+    def broadcast_roster(self, players, monsters):
+        if self.viewers:
+            self.fan_out(self.viewers, self.encode_roster(players, monsters))
+
+    def to_dict(self):
+        return {
+            'viewers': len(self.viewers),
+            'cameras': len(self.cameras),
+            'encoded': self.encoded,
+            'sent': self.sent,
+            'lagging': self.lagging
+        }
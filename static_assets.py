@@ -0,0 +1,181 @@
+import asyncio
+import gzip
+import hashlib
+import mimetypes
+import os
+import time
+from email.utils import formatdate
+from typing import Dict, Optional
+
+from aiohttp import web
+
+try:
+    import brotli
+except ImportError:  # brotli 為選用套件，沒有安裝時只提供 gzip
+    brotli = None
+
+COMPRESS_MIN_SIZE = 512  # 小於此大小的檔案不壓縮
+CHANGE_CHECK_INTERVAL = 1.0  # 檢查檔案是否變更的最短間隔（秒）
+
+HTML_CACHE_CONTROL = 'no-cache'  # 入口頁每次都要重新驗證，確保部署後拿到新版本
+BUNDLE_CACHE_CONTROL = 'public, max-age=86400'
+
+STATIC_DIR = 'static'  # 拆分出來的 JS/CSS；/static/ 的請求只能讀到這個目錄
+
+TEXT_TYPES = ('text/', 'application/javascript', 'application/json',
+              'image/svg+xml')
+
+
+def etag_matches(if_none_match, etag):
+    # If-None-Match 逐一比對完整的 entity tag（弱比較：忽略 W/ 前綴）
+    for tag in if_none_match.split(','):
+        tag = tag.strip()
+        if tag == '*':
+            return True
+        if tag.startswith('W/'):
+            tag = tag[2:]
+        if tag == etag:
+            return True
+    return False
+
+
+def parse_accept_encoding(header) -> Dict[str, float]:
+    # Accept-Encoding 的 coding -> q 值；q=0 表示拒絕，格式錯誤的 q 當作拒絕
+    accepted = {}
+    for item in header.split(','):
+        coding, _, params = item.partition(';')
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        q = 1.0
+        for param in params.split(';'):
+            name, _, value = param.partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        accepted[coding] = q
+    return accepted
+
+
+class StaticAsset:
+
+    def __init__(self, path, body: bytes, mtime, cache_control):
+        self.path = path
+        self.body = body
+        self.mtime = mtime
+        self.cache_control = cache_control
+        self.checked_at = time.monotonic()
+
+        content_type = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+        if content_type.startswith(TEXT_TYPES):
+            content_type += '; charset=utf-8'
+        self.content_type = content_type
+
+        self.hash = hashlib.sha1(body).hexdigest()[:20]
+        self.last_modified = formatdate(mtime, usegmt=True)
+
+        self.gzip: Optional[bytes] = None
+        self.br: Optional[bytes] = None
+        if len(body) >= COMPRESS_MIN_SIZE and content_type.startswith(
+                TEXT_TYPES):
+            self.gzip = gzip.compress(body, 9)
+            if brotli is not None:
+                self.br = brotli.compress(body, quality=11)
+
+    def negotiate(self, accept_encoding):
+        # 依 Accept-Encoding 選出回應的編碼版本：(Content-Encoding, 內容, ETag)
+        # 各版本的 ETag 共用同一個雜湊，加上編碼後綴區分
+        accepted = parse_accept_encoding(accept_encoding)
+        best = None
+        for coding, body, suffix in (('br', self.br, '-br'),
+                                     ('gzip', self.gzip, '-gz')):
+            if body is None:
+                continue
+            q = accepted.get(coding, accepted.get('*', 0.0))
+            if q > 0 and (best is None or q > best[0]):
+                best = (q, coding, body, suffix)
+        if best is None:
+            return None, self.body, f'"{self.hash}"'
+        _, coding, body, suffix = best
+        return coding, body, f'"{self.hash}{suffix}"'
+
+
+class StaticAssets:
+    # 記憶體內的靜態檔案快取：載入一次、檔案變更時重新載入，預先算好壓縮版本
+
+    def __init__(self, root):
+        self.root = os.path.realpath(root)
+        self.assets: Dict[str, StaticAsset] = {}
+
+    def _resolve(self, rel_path):
+        # rel_path 是已解碼的網址路徑：有 .. 或是絕對路徑直接拒絕，
+        # 解開符號連結後還要確認仍在根目錄底下
+        parts = rel_path.replace('\\', '/').split('/')
+        if '..' in parts or os.path.isabs(rel_path) or '\0' in rel_path:
+            return None
+        full = os.path.realpath(os.path.join(self.root, rel_path))
+        if (os.path.commonpath([full, self.root]) != self.root
+                or full == self.root or not os.path.isfile(full)):
+            return None
+        return full
+
+    def _load(self, full, cache_control):
+        with open(full, 'rb') as f:
+            body = f.read()
+        return StaticAsset(full, body, os.path.getmtime(full), cache_control)
+
+    def preload(self, rel_path, cache_control=HTML_CACHE_CONTROL):
+        full = self._resolve(rel_path)
+        if full:
+            self.assets[rel_path] = self._load(full, cache_control)
+
+    async def get(self, rel_path, cache_control):
+        asset = self.assets.get(rel_path)
+        now = time.monotonic()
+        if asset and now - asset.checked_at < CHANGE_CHECK_INTERVAL:
+            return asset
+
+        full = self._resolve(rel_path)
+        if not full:
+            self.assets.pop(rel_path, None)
+            return None
+        if asset and os.path.getmtime(full) == asset.mtime:
+            asset.checked_at = now
+            return asset
+
+        # 壓縮比較耗時，丟到執行緒避免卡住遊戲迴圈
+        asset = await asyncio.to_thread(self._load, full, cache_control)
+        self.assets[rel_path] = asset
+        return asset
+
+    async def serve(self, request, rel_path, cache_control=HTML_CACHE_CONTROL):
+        asset = await self.get(rel_path, cache_control)
+        if asset is None:
+            raise web.HTTPNotFound()
+
+        headers = {
+            'Cache-Control': asset.cache_control,
+            'Last-Modified': asset.last_modified,
+            'Vary': 'Accept-Encoding'
+        }
+
+        coding, body, etag = asset.negotiate(
+            request.headers.get('Accept-Encoding', ''))
+        headers['ETag'] = etag
+
+        if_none_match = request.headers.get('If-None-Match')
+        if if_none_match is not None:
+            not_modified = etag_matches(if_none_match, etag)
+        else:
+            since = request.if_modified_since
+            not_modified = since is not None and int(
+                asset.mtime) <= since.timestamp()
+        if not_modified:
+            return web.Response(status=304, headers=headers)
+
+        if coding is not None:
+            headers['Content-Encoding'] = coding
+        headers['Content-Type'] = asset.content_type
+        return web.Response(body=body, headers=headers)
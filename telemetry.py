@@ -0,0 +1,172 @@
+import asyncio
+import gzip
+import json
+import os
+import random
+import time
+from collections import deque
+from typing import Dict, Optional
+
+# 每種事件的固定欄位；emit 時依序傳值，寫檔時才組成 dict
+SCHEMAS = {
+    'session': ('player', 'action'),  # connect / resume / leave / abusive / expire
+    'kill': ('monster', 'boss', 'killer', 'exp'),
+    'pvp_kill': ('killer', 'victim'),
+    'drop': ('player', 'item', 'rarity', 'monster'),
+    'gold': ('player', 'delta', 'reason', 'balance'),
+    'upgrade': ('player', 'item', 'level', 'cost'),
+    'disassemble': ('player', 'item', 'count', 'level', 'gold'),
+    'skill': ('player', 'skill'),
+    'load_level': ('previous', 'level', 'p90_ms'),
+    'error': ('where', 'message'),
+}
+
+# 抽樣比例，沒列出的全記；抽樣的事件寫檔時帶 sr 欄位，分析時乘回去
+SAMPLE_RATES = {
+    'skill': 0.1,
+}
+
+BUFFER_MAX = 50000  # 尚未寫出的事件上限，滿了直接丟棄並計數
+# 每種事件每秒的上限：客戶端能觸發的錯誤洗版時不會擠掉經濟事件
+MAX_EVENTS_PER_SECOND = 2000
+KIND_LIMITS = {
+    'error': 20,
+}
+FLUSH_INTERVAL = 2.0  # 寫檔間隔（秒）
+ROTATE_BYTES = 16 * 1024 * 1024  # 單一檔案壓縮後的大小上限
+ROTATE_SECONDS = 3600.0  # 單一檔案最長涵蓋時間
+COMPRESS_LEVEL = 6
+
+
+class Telemetry:
+    # 遊戲迴圈只把 (時間, 種類, 值 tuple) 放進 deque，不做編碼、不碰檔案；
+    # deque 兩端的 append / popleft 是原子操作，寫檔執行緒直接從另一端取出，不用加鎖。
+    # 每批寫成一個獨立的 gzip member 接在檔尾，zcat 可以直接讀整個檔案，
+    # 寫到一半當機只會壞掉最後一批
+
+    def __init__(self, directory: Optional[str], sample_rates=SAMPLE_RATES):
+        self.directory = directory  # None 表示停用
+        self.sample_rates = sample_rates
+        self.buffer: deque = deque()
+        self.busy = False
+        self.next_flush = 0.0
+        self.window = 0  # 目前計數的秒
+        self.window_counts: Dict[str, int] = {}
+
+        self.file = None
+        self.file_path: Optional[str] = None
+        self.file_opened = 0.0
+        self.file_bytes = 0
+
+        self.emitted = 0
+        self.sampled_out = 0
+        self.dropped = 0
+        self.malformed = 0
+        self.written = 0
+        self.bytes_written = 0
+        self.files = 0
+        self.last_duration = 0.0
+
+    def emit(self, kind, *values):
+        if self.directory is None:
+            return
+        rate = self.sample_rates.get(kind)
+        if rate is not None and random.random() >= rate:
+            self.sampled_out += 1
+            return
+        now = time.time()
+        second = int(now)
+        if second != self.window:
+            self.window = second
+            self.window_counts.clear()
+        count = self.window_counts.get(kind, 0)
+        if (count >= KIND_LIMITS.get(kind, MAX_EVENTS_PER_SECOND)
+                or len(self.buffer) >= BUFFER_MAX):
+            self.dropped += 1
+            return
+        self.window_counts[kind] = count + 1
+        self.emitted += 1
+        self.buffer.append((now, kind, values))
+
+    def due(self, now):
+        return bool(self.buffer) and now >= self.next_flush and not self.busy
+
+    async def flush(self):
+        self.busy = True
+        try:
+            await asyncio.to_thread(self._write)
+        except Exception as e:
+            print(f"Telemetry write failed: {e}")
+        finally:
+            self.busy = False
+
+    def _encode(self, count) -> bytes:
+        buffer = self.buffer
+        lines = []
+        for _ in range(count):
+            t, kind, values = buffer.popleft()
+            fields = SCHEMAS.get(kind)
+            if fields is None or len(fields) != len(values):
+                self.malformed += 1
+                continue
+            record = {'t': round(t, 3), 'k': kind}
+            record.update(zip(fields, values))
+            rate = self.sample_rates.get(kind)
+            if rate is not None:
+                record['sr'] = rate
+            lines.append(
+                json.dumps(record, ensure_ascii=False, separators=(',', ':')))
+        if not lines:
+            return b''
+        lines.append('')
+        return '\n'.join(lines).encode()
+
+    def _rotate(self, now):
+        if (self.file is not None and self.file_bytes < ROTATE_BYTES
+                and now - self.file_opened < ROTATE_SECONDS):
+            return
+        self.close()
+        os.makedirs(self.directory, exist_ok=True)
+        self.files += 1
+        name = (f"events-{time.strftime('%Y%m%d-%H%M%S', time.localtime(now))}"
+                f"-{os.getpid()}-{self.files}.ndjson.gz")
+        self.file_path = os.path.join(self.directory, name)
+        self.file = open(self.file_path, 'ab')
+        self.file_opened = now
+        self.file_bytes = 0
+
+    def _write(self):
+        # 只取開始時已在 buffer 裡的事件，之後進來的留給下一批
+        started = time.perf_counter()
+        count = len(self.buffer)
+        malformed = self.malformed
+        data = self._encode(count)
+        if data:
+            data = gzip.compress(data, COMPRESS_LEVEL)
+            self._rotate(time.time())
+            self.file.write(data)
+            self.file.flush()
+            self.file_bytes += len(data)
+            self.bytes_written += len(data)
+        self.written += count - (self.malformed - malformed)
+        self.last_duration = time.perf_counter() - started
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def to_dict(self):
+        return {
+            'enabled': self.directory is not None,
+            'buffered': len(self.buffer),
+            'emitted': self.emitted,
+            'sampledOut': self.sampled_out,
+            'dropped': self.dropped,
+            'malformed': self.malformed,
+            'written': self.written,
+            'bytes': self.bytes_written,
+            'files': self.files,
+            'file': self.file_path,
+            'lastWriteMs': round(self.last_duration * 1000, 3)
+        }
@@ -0,0 +1,146 @@
+import os
+
+import pytest
+
+import checkpoint
+from checkpoint import SLOT_HEADER, CheckpointFile
+
+
+def _image(tick, players, monsters=()):
+    return {
+        'tick': tick,
+        'players': [(pid, 'name', x) for pid, x in players],
+        'monsters': [(mid, hp) for mid, hp in monsters],
+        'projectiles': [{'x': tick}]
+    }
+
+
+def _open(path, **kwargs):
+    return CheckpointFile(str(path), keyed_sections=('players', 'monsters'),
+                          **kwargs)
+
+
+def test_deltas_restore_to_latest_image(tmp_path):
+    path = tmp_path / 'world.ckpt'
+    ckpt = _open(path)
+    ckpt.write(_image(1, [('a', 1), ('b', 2)], [('m1', 10)]))
+    ckpt.write(_image(2, [('a', 1), ('b', 5)], [('m1', 10)]))
+    ckpt.write(_image(3, [('b', 5), ('c', 7)], [('m1', 4), ('m2', 9)]))
+    assert ckpt.deltas == 2
+    ckpt.close()
+
+    restored = _open(path).load_latest()
+    assert restored == _image(3, [('b', 5), ('c', 7)], [('m1', 4),
+                                                        ('m2', 9)])
+
+
+def test_torn_delta_falls_back_to_previous_entry(tmp_path):
+    path = tmp_path / 'world.ckpt'
+    ckpt = _open(path)
+    ckpt.write(_image(1, [('a', 1)]))
+    ckpt.write(_image(2, [('a', 2)]))
+    tail = ckpt.tail
+    ckpt.write(_image(3, [('a', 3)]))
+    # 最後一筆的資料被寫壞：crc 對不上
+    ckpt.mm[tail + SLOT_HEADER.size] ^= 0xff
+    ckpt.close()
+
+    assert _open(path).load_latest() == _image(2, [('a', 2)])
+
+
+def test_full_snapshot_every_n_deltas(tmp_path, monkeypatch):
+    monkeypatch.setattr(checkpoint, 'FULL_EVERY', 2)
+    ckpt = _open(tmp_path / 'world.ckpt')
+    slots = []
+    for tick in range(6):
+        ckpt.write(_image(tick, [('a', tick)]))
+        slots.append((ckpt.active, ckpt.deltas))
+    assert slots == [(0, 0), (0, 1), (0, 2), (1, 0), (1, 1), (1, 2)]
+
+
+def test_growing_keeps_the_previous_checkpoint(tmp_path, monkeypatch):
+    path = tmp_path / 'world.ckpt'
+    ckpt = _open(path, slot_size=4096)
+    small = _image(1, [('a', 1)])
+    ckpt.write(small)
+    big = _image(2, [(f'p{i}', os.urandom(64)) for i in range(200)])
+
+    # 換檔前當機：原檔不動，仍可還原上一份
+    def crash(*args):
+        raise OSError('crash')
+
+    with monkeypatch.context() as m:
+        m.setattr(os, 'replace', crash)
+        try:
+            ckpt.write(big)
+        except OSError:
+            pass
+    assert _open(path).load_latest() == small
+
+    ckpt = _open(path)
+    ckpt.load_latest()
+    ckpt.write(big)
+    ckpt.close()
+    assert _open(path).load_latest() == big
+    assert not os.path.exists(str(path) + '.tmp')
+
+
+def test_bad_image_leaves_the_world_untouched(tmp_path, monkeypatch):
+    import game_server
+
+    source = game_server.GameState()
+    source.add_player(game_server.Player('p1', 'one'))
+    image = source.to_image()
+    # 第二隻怪物的記錄少一個欄位：還原到一半會失敗
+    image['monsters'].append(image['monsters'][0][:-1])
+
+    ckpt = CheckpointFile(str(tmp_path / 'world.ckpt'),
+                          keyed_sections=('players', 'monsters'))
+    ckpt.write(image)
+    ckpt.close()
+
+    current = game_server.GameState()
+    monkeypatch.setattr(game_server, 'game', current)
+    monkeypatch.setattr(game_server, 'checkpoints',
+                        CheckpointFile(str(tmp_path / 'world.ckpt'),
+                                       keyed_sections=('players',
+                                                       'monsters')))
+    game_server.restore_checkpoint()
+    assert game_server.game is current
+    assert current.players == {}
+    assert [m.spawn_id for m in current.monsters] == ['boss_0']
+
+
+def test_good_image_replaces_the_world(tmp_path, monkeypatch):
+    import game_server
+
+    source = game_server.GameState()
+    source.add_player(game_server.Player('p1', 'one'))
+    source.tick = 42
+    path = str(tmp_path / 'world.ckpt')
+    ckpt = CheckpointFile(path, keyed_sections=('players', 'monsters'))
+    ckpt.write(source.to_image())
+    ckpt.close()
+
+    current = game_server.GameState()
+    monkeypatch.setattr(game_server, 'game', current)
+    monkeypatch.setattr(
+        game_server, 'checkpoints',
+        CheckpointFile(path, keyed_sections=('players', 'monsters')))
+    game_server.restore_checkpoint()
+    assert game_server.game is not current
+    assert game_server.game.tick == 42
+    assert game_server.game.players['p1'].detached_at is not None
+
+
+def test_player_image_must_have_every_field():
+    import game_server
+
+    player = game_server.Player('p1', 'one')
+    player.pvp_kills = 3
+    player.boss_kills = 1
+    restored = game_server.Player.from_image(player.to_image())
+    assert (restored.pvp_kills, restored.boss_kills) == (3, 1)
+
+    with pytest.raises(ValueError):
+        game_server.Player.from_image(player.to_image()[:-2])
@@ -0,0 +1,93 @@
+import asyncio
+import json
+
+import game_server
+from combat import (EV_DROP, EV_HIT, EV_KILL, EVENT_RADIUS, CombatPipeline,
+                    DamageLedger, events_for)
+
+
+def test_ledger_tracks_the_top_contributor_incrementally():
+    ledger = DamageLedger()
+    ledger.add('a', 30)
+    ledger.add('b', 20)
+    ledger.add('b', 15)
+    assert (ledger.top_id, ledger.top_damage) == ('b', 35)
+    assert ledger.ranking() == [('b', 35), ('a', 30)]
+    assert ledger.ranking(1) == [('b', 35)]
+    ledger.clear()
+    assert ledger.top_id is None and ledger.ranking() == []
+
+
+def test_monster_death_is_queued_once():
+    pipeline = CombatPipeline()
+    monster = game_server.Monster('m1', 100, 100, 'BASIC')
+    pipeline.hit_monster(monster, 'a', monster.hp)
+    pipeline.hit_monster(monster, 'b', 10)
+    assert pipeline.drain_monster_deaths() == [monster]
+    assert pipeline.drain_monster_deaths() == []
+    assert [ev[0] for ev in pipeline.events.drain()] == [EV_HIT, EV_HIT]
+
+
+def test_boss_loot_goes_to_the_top_contributor(monkeypatch):
+    game = game_server.GameState()
+    monkeypatch.setattr(game_server, 'game', game)
+    top, helper = game_server.Player('top', 'top'), game_server.Player(
+        'helper', 'helper')
+    game.add_player(top)
+    game.add_player(helper)
+    boss = game.monsters[0]
+    assert boss.is_boss
+
+    game.combat.hit_monster(boss, 'helper', 100)
+    game.combat.hit_monster(boss, 'top', boss.hp)
+    game_server.resolve_monster_deaths()
+
+    assert not boss.alive
+    assert top.boss_kills == 1 and helper.boss_kills == 0
+    assert any(item.id == 'boss_item' for item in top.inventory.items)
+    assert not any(item.id == 'boss_item' for item in helper.inventory.items)
+    assert boss.ledger.totals == {}
+    events = game.combat.events.drain()
+    kill = next(ev for ev in events if ev[0] == EV_KILL)
+    assert kill[3] == 'top'
+    assert all(ev[4] == 'top' for ev in events if ev[0] == EV_DROP)
+
+
+def test_events_for_keeps_own_events_and_nearby_ones():
+    near = [EV_HIT, 100, 100, 'x', 'y', 5]
+    far = [EV_HIT, 100 + EVENT_RADIUS + 1, 100, 'x', 'y', 5]
+    mine = [EV_KILL, 5000, 5000, 'me', 'm1', None]
+    hit_me = [EV_HIT, 5000, 5000, 'm1', 'me', 3]
+    events = [near, far, mine, hit_me]
+    assert events_for(events, 'me', 100, 100) == [near, mine, hit_me]
+    # 觀戰鏡頭只看距離
+    assert events_for(events, None, 100, 100) == [near]
+
+
+class Recorder:
+    closed = False
+
+    def __init__(self):
+        self.sent = []
+
+    async def send_str(self, data, compress=None):
+        self.sent.append(json.loads(data))
+
+
+def test_broadcast_streams_each_event_once(monkeypatch):
+    game = game_server.GameState()
+    monkeypatch.setattr(game_server, 'game', game)
+    player = game_server.Player('p1', 'one')
+    game.add_player(player)
+    player.ws = Recorder()
+    monster = game_server.Monster('m1', player.x + 50, player.y, 'BASIC')
+    game.monsters.append(monster)
+
+    game.combat.hit_monster(monster, 'p1', 7)
+    asyncio.run(game_server.broadcast_state())
+    asyncio.run(game_server.broadcast_state())
+    first, second = player.ws.sent
+    assert first['ev'] == [[EV_HIT, round(monster.x), round(monster.y), 'p1',
+                            'm1', 7]]
+    assert second['ev'] == []
+    assert game.missed_events('p1', game.tick - 1) == first['ev']
@@ -0,0 +1,91 @@
+from types import SimpleNamespace
+
+from flowfield import UNREACHABLE, FlowField, FlowFields, Grid
+
+CELL = 100
+
+
+def _center(c, r):
+    return c * CELL + CELL / 2, r * CELL + CELL / 2
+
+
+def _walk(field, grid, start, limit=100):
+    # 沿著流場方向一格一格走，回傳經過的格子
+    path = [start]
+    idx = start
+    for _ in range(limit):
+        if field.dist[idx] == 0:
+            break
+        r, c = divmod(idx, grid.cols)
+        dx, dy = field.direction(*_center(c, r), detour=True)
+        idx = (r + round(dy)) * grid.cols + (c + round(dx))
+        assert not grid.blocked[idx]
+        path.append(idx)
+    return path
+
+
+def test_block_rect_marks_covered_cells():
+    grid = Grid(1000, 1000, obstacles=[(200, 300, 200, 100)])
+    assert grid.has_obstacles
+    assert grid.is_blocked(250, 350) and grid.is_blocked(399, 399)
+    assert not grid.is_blocked(450, 350)
+    assert grid.links[grid.index(250, 350)] == ()
+
+
+def test_diagonal_moves_do_not_cut_corners():
+    grid = Grid(300, 300, obstacles=[(100, 0, 100, 100), (0, 100, 100, 100)])
+    corner = grid.index(*_center(0, 0))
+    assert grid.links[corner] == ()
+
+
+def test_field_routes_through_the_gap_in_a_wall():
+    # x=500 的牆，只在最下面一格留缺口
+    grid = Grid(1000, 1000, obstacles=[(500, 0, 100, 900)])
+    goal = grid.index(*_center(8, 2))
+    start = grid.index(*_center(2, 2))
+    field = FlowField(grid, frozenset([goal]))
+
+    assert not field.clear[start]
+    path = _walk(field, grid, start)
+    assert path[-1] == goal
+    assert grid.index(*_center(5, 9)) in path
+
+
+def test_open_cells_steer_straight_at_the_target():
+    grid = Grid(1000, 1000, obstacles=[(500, 0, 100, 900)])
+    goal = grid.index(*_center(8, 2))
+    field = FlowField(grid, frozenset([goal]))
+    # 牆的同一側，直線過去不會被擋
+    assert field.clear[grid.index(*_center(7, 4))]
+    assert field.direction(*_center(7, 4)) is None
+
+
+def test_unreachable_target_falls_back_to_direct_steering():
+    # 目標被完全圍住
+    walls = [(300, 300, 300, 100), (300, 500, 300, 100), (300, 400, 100, 100),
+             (500, 400, 100, 100)]
+    grid = Grid(1000, 1000, obstacles=walls)
+    goal = grid.index(*_center(4, 4))
+    field = FlowField(grid, frozenset([goal]))
+    start = grid.index(*_center(1, 1))
+    assert field.dist[start] == UNREACHABLE
+    assert field.direction(*_center(1, 1), detour=True) is None
+
+    flows = FlowFields(grid)
+    flows.update([SimpleNamespace(alive=True, x=450, y=450)])
+    assert flows.rebuilds == 1
+    dx, dy = flows.steer(150, 150, 450, 450, 300 * 2**0.5)
+    assert abs(dx - 2**-0.5) < 1e-9 and abs(dy - 2**-0.5) < 1e-9
+    assert flows.detour(150, 150, 450, 450) is None
+
+
+def test_goal_inside_an_obstacle_is_unreachable():
+    grid = Grid(500, 500, obstacles=[(200, 200, 100, 100)])
+    field = FlowField(grid, frozenset([grid.index(250, 250)]))
+    assert all(d == UNREACHABLE for d in field.dist)
+
+
+def test_no_fields_without_obstacles():
+    flows = FlowFields(Grid(1000, 1000))
+    flows.update([SimpleNamespace(alive=True, x=100, y=100)])
+    assert flows.fields == {}
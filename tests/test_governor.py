@@ -0,0 +1,75 @@
+import asyncio
+
+import game_server
+from governor import (DEGRADATION_LEVELS, DEGRADE_AT, RECOVER_AT,
+                      WINDOW_TICKS, TickGovernor)
+
+BUDGET = 1 / 30
+
+
+def _run(governor, load, ticks=WINDOW_TICKS):
+    changes = []
+    for _ in range(ticks):
+        change = governor.record(BUDGET * load)
+        if change:
+            changes.append(change)
+    return changes
+
+
+def test_degrades_one_level_per_full_window():
+    governor = TickGovernor(30)
+    assert _run(governor, DEGRADE_AT + 0.1, WINDOW_TICKS - 1) == []
+    assert _run(governor, DEGRADE_AT + 0.1, 1) == [(0, 1)]
+    # 換級後要重新累積一整個觀察窗
+    assert _run(governor, DEGRADE_AT + 0.1, WINDOW_TICKS - 1) == []
+    assert _run(governor, DEGRADE_AT + 0.1, 1) == [(1, 2)]
+
+
+def test_stops_at_the_last_level_and_recovers_step_by_step():
+    governor = TickGovernor(30)
+    last = len(DEGRADATION_LEVELS) - 1
+    _run(governor, 2.0, WINDOW_TICKS * (last + 3))
+    assert governor.level == last
+    assert governor.settings == DEGRADATION_LEVELS[last]
+
+    assert _run(governor, RECOVER_AT - 0.1) == [(last, last - 1)]
+    assert _run(governor, (RECOVER_AT + DEGRADE_AT) / 2) == []
+    assert governor.level == last - 1
+
+
+def test_p90_ignores_short_spikes():
+    governor = TickGovernor(30)
+    changes = []
+    for i in range(WINDOW_TICKS):
+        spike = i % 20 == 0
+        change = governor.record(BUDGET * (3.0 if spike else 0.6))
+        if change:
+            changes.append(change)
+    assert changes == []
+
+
+class Recorder:
+    closed = False
+
+    def __init__(self):
+        self.frames = []
+
+    async def send_shared(self, frame):
+        self.frames.append(frame.payload)
+
+
+def test_level_is_in_hello_and_broadcast(monkeypatch):
+    game = game_server.GameState()
+    monkeypatch.setattr(game_server, 'game', game)
+    game.governor.level = 2
+    player, hello = asyncio.run(game_server.join_player(Recorder(), '', 0))
+    assert hello['load'] == {
+        'level': 2,
+        'interval': DEGRADATION_LEVELS[2]['broadcast_every'] / 30
+    }
+
+    game.governor.level = 3
+    asyncio.run(game_server.broadcast_load_level(2, 3))
+    frame = player.ws.frames[0]
+    assert b'"type":"load_level"' in frame
+    assert b'"previous":2' in frame and b'"level":3' in frame
@@ -0,0 +1,108 @@
+import pytest
+
+import io_tier
+from io_tier import FrameRing, IOTier, RemoteSocket, WorkerLink
+
+
+class FakePipe:
+
+    def __init__(self):
+        self.sent = []
+
+    def send(self, message):
+        self.sent.append(message)
+
+
+@pytest.fixture
+def small_ring(monkeypatch):
+    monkeypatch.setattr(io_tier, 'RING_SLOTS', 2)
+    monkeypatch.setattr(io_tier, 'SLOT_SIZE', 64)
+    monkeypatch.setattr(io_tier, 'MAX_FRAME', 64 - 16)
+    ring = FrameRing()
+    yield ring
+    ring.shm.close()
+    ring.unlink()
+
+
+def _read(ring, seq):
+    return [(conn_id, bytes(payload)) for conn_id, payload in ring.frames(seq)]
+
+
+def test_frames_spill_into_the_next_slot(small_ring):
+    frames = [(1, b'a' * 20), (2, b'b' * 20), (3, b'c' * 20)]
+    seqs, unsent = small_ring.publish(frames)
+    assert seqs == [1, 2]
+    assert unsent == []
+    assert _read(small_ring, 1) + _read(small_ring, 2) == frames
+
+
+def test_full_ring_reports_unsent_frames(small_ring):
+    small_ring.publish([(1, b'x' * 40), (1, b'y' * 40)])
+    seqs, unsent = small_ring.publish([(2, b'z')])
+    assert seqs == []
+    assert unsent == [(2, b'z')]
+
+    small_ring.release(1)
+    assert small_ring.publish([(2, b'z')]) == ([3], [])
+
+
+def test_link_returns_connections_to_resync(small_ring):
+    pipe = FakePipe()
+    link = WorkerLink(0, None, pipe, small_ring)
+    small_ring.publish([(9, b'x' * 40), (9, b'y' * 40)])
+    link.queue(1, b'state')
+    link.queue(2, b'state')
+    assert sorted(link.flush()) == [1, 2]
+    assert link.dropped_frames == 2
+    assert pipe.sent == []
+
+
+def test_oversized_frame_goes_through_the_pipe(small_ring):
+    pipe = FakePipe()
+    link = WorkerLink(0, None, pipe, small_ring)
+    big = b'b' * 100
+    link.queue(1, b'before')
+    link.queue(2, big)
+    link.queue(1, b'after')
+    assert link.flush() == []
+    assert pipe.sent == [('frames', 1), ('send', 2, big), ('frames', 2)]
+    assert _read(small_ring, 1) == [(1, b'before')]
+    assert _read(small_ring, 2) == [(1, b'after')]
+
+
+def test_tier_flush_maps_dropped_frames_to_sockets(small_ring):
+    tier = IOTier(1, 0, None, None, None)
+    link = WorkerLink(0, None, FakePipe(), small_ring)
+    tier.links.append(link)
+    ws = RemoteSocket(link, 5)
+    link.sockets[5] = ws
+    link.alive = False
+    link.queue(5, b'state')
+    link.queue(5, b'rank')
+    link.queue(6, b'left already')
+    assert tier.flush() == [ws]
+
+
+def test_dropped_connection_gets_a_full_resync(small_ring):
+    import game_server
+    from replication import Snapshot
+
+    link = WorkerLink(0, None, FakePipe(), small_ring)
+    ws = RemoteSocket(link, 1)
+    player = game_server.Player('p-resync', 'resync')
+    ws.player_id = player.id
+    player.ws = ws
+    game_server.game.players[player.id] = player
+    try:
+        other = game_server.Player('p-other', 'other')
+        snapshot = Snapshot([player, other], [])
+        game_server.game.get_state_for_player(player.id, snapshot)
+        assert player.sent_inventory_version == player.inventory.version
+
+        game_server.resync_dropped([ws])
+        state = game_server.game.get_state_for_player(player.id, snapshot)
+        assert '"resync":true' in state
+        assert '"inventory":' in state
+        assert '"id":"p-other"' in state
+    finally:
+        del game_server.game.players[player.id]
@@ -0,0 +1,82 @@
+import game_server
+from lagcomp import MAX_REWIND, PositionHistory
+
+TICK = 1 / 30
+
+
+def _walk(history, monster, start, ticks, speed):
+    # 怪物每 tick 往 +x 走 speed，回傳最後一筆的時間
+    now = start
+    for _ in range(ticks):
+        history.record(now, [], [monster])
+        now += TICK
+        monster.x += speed
+    return now
+
+
+def _setup(monkeypatch):
+    game = game_server.GameState()
+    monkeypatch.setattr(game_server, 'game', game)
+    monster = game_server.Monster('m1', 100, 100, 'BASIC')
+    now = _walk(game.history, monster, 1000.0, 10, 10)
+    return game, monster, now
+
+
+def test_rewound_position_is_interpolated():
+    history = PositionHistory(30)
+    monster = game_server.Monster('m1', 100, 100, 'BASIC')
+    now = _walk(history, monster, 1000.0, 10, 10)
+
+    assert history.position('m1', now, monster.x, monster.y, now) == (200, 100)
+    x, y = history.position('m1', 1000.0 + 2.5 * TICK, monster.x, monster.y,
+                            now)
+    assert abs(x - 125) < 1e-3 and y == 100
+    assert history.rewinds == 1
+
+
+def test_view_time_is_clamped_to_window():
+    history = PositionHistory(30)
+    assert history.view_time(1000.0, None) is None
+    assert history.view_time(1000.0, 1000.5) == 1000.0
+    assert history.view_time(1000.0, 990.0) == 1000.0 - MAX_REWIND
+    assert history.clamped == 1
+
+
+def test_hit_against_rewound_position(monkeypatch):
+    game, monster, now = _setup(monkeypatch)
+    view_time = now - 8 * TICK  # 客戶端看到的怪物在 x=120
+
+    # 現在位置 x=200 打不到，倒帶後的 x=120 打得到
+    assert not game_server.lag_hit(120, 100, 15, monster, 'm1', None, now, 300)
+    assert game_server.lag_hit(120, 100, 15, monster, 'm1', view_time, now,
+                               300)
+    # 倒帶後離攻擊點太遠則不算命中
+    assert not game_server.lag_hit(200, 100, 15, monster, 'm1', view_time,
+                                   now, 300)
+
+
+def test_rewind_to_records_player_view_lag(monkeypatch):
+    game, monster, now = _setup(monkeypatch)
+    game.last_update = now
+    player = game_server.Player('p1', 'p1')
+
+    assert game_server.rewind_to(player, now - 0.1) == now - 0.1
+    assert abs(player.view_lag - 0.1) < 1e-9
+    assert game_server.rewind_to(player, None) is None
+    assert player.view_lag == 0.0
+
+
+def test_dead_entities_drop_their_track():
+    history = PositionHistory(30)
+    monster = game_server.Monster('m1', 100, 100, 'BASIC')
+    now = _walk(history, monster, 1000.0, 5, 10)
+    monster.alive = False
+    history.record(now, [], [monster])
+    assert 'm1' not in history.tracks
+
+    # 復活傳送後不會倒帶回死前的位置
+    monster.alive = True
+    monster.x = 900
+    history.record(now + TICK, [], [monster])
+    assert history.position('m1', now - 3 * TICK, 900, 100,
+                            now + TICK) == (900, 100)
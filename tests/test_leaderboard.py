@@ -0,0 +1,112 @@
+import asyncio
+
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
+
+import game_server
+from io_tier import IOWorker
+from leaderboard import Leaderboards
+
+
+def _player(player_id, level, exp=0, gold=0):
+    player = game_server.Player(player_id, player_id)
+    player.level = level
+    player.exp = exp
+    player.gold = gold
+    return player
+
+
+def test_ranks_follow_score_updates():
+    boards = Leaderboards()
+    a, b, c = _player('a', 3), _player('b', 5), _player('c', 3, exp=50)
+    for player in (a, b, c):
+        boards.add(player)
+    assert [boards.boards['level'].rank(p) for p in 'abc'] == [3, 1, 2]
+
+    boards.rank_changes()
+    a.level = 9
+    boards.update(a, 'level')
+    assert boards.rank_changes() == {
+        'a': {'level': 1},
+        'b': {'level': 2},
+        'c': {'level': 3}
+    }
+
+    boards.remove('b')
+    assert boards.boards['level'].rank('c') == 2
+
+
+def test_etag_depends_on_the_viewer():
+    boards = Leaderboards()
+    for player in (_player('a', 3), _player('b', 5)):
+        boards.add(player)
+    _, etag_a = boards.query('level', 5, 'a', 0.0)
+    _, etag_b = boards.query('level', 5, 'b', 0.0)
+    _, etag_none = boards.query('level', 5, None, 0.0)
+    _, etag_unknown = boards.query('level', 5, 'nobody', 0.0)
+    assert len({etag_a, etag_b, etag_none}) == 3
+    assert etag_unknown == etag_none
+
+
+def _leaderboard_requests(app):
+
+    async def run():
+        async with TestClient(TestServer(app)) as client:
+            resp = await client.get('/leaderboard?board=level&player=p1')
+            body = await resp.json()
+            etag = resp.headers['ETag']
+            cache_control = resp.headers['Cache-Control']
+            statuses = []
+            for if_none_match in (etag, f'"x", W/{etag}', etag[:-2] + '"',
+                                  f'"{etag}-stale"'):
+                again = await client.get(
+                    '/leaderboard?board=level&player=p1',
+                    headers={'If-None-Match': if_none_match})
+                statuses.append(again.status)
+            return body, cache_control, statuses
+
+    return asyncio.run(run())
+
+
+def _with_players(monkeypatch):
+    boards = Leaderboards()
+    for player in (_player('p1', 2), _player('p2', 7)):
+        boards.add(player)
+    monkeypatch.setattr(game_server.game, 'leaderboards', boards)
+
+
+def test_leaderboard_handler_is_private_and_matches_exact_tags(monkeypatch):
+    _with_players(monkeypatch)
+    app = web.Application()
+    app.router.add_get('/leaderboard', game_server.leaderboard_handler)
+    body, cache_control, statuses = _leaderboard_requests(app)
+    assert body['me'] == [2, 2]
+    assert cache_control.startswith('private')
+    assert statuses == [304, 304, 200, 200]
+
+
+def test_io_workers_serve_leaderboard_and_spectate(monkeypatch):
+    _with_players(monkeypatch)
+
+    async def run():
+        admin = web.Application()
+        admin.router.add_get('/leaderboard', game_server.leaderboard_handler)
+        admin.router.add_get('/spectate', game_server.spectate_handler)
+        async with TestServer(admin) as admin_server:
+            worker = IOWorker(0, None, None, admin_server.port)
+            async with TestClient(TestServer(worker.make_app())) as client:
+                resp = await client.get('/leaderboard?board=level&player=p1')
+                body = await resp.json()
+                etag = resp.headers['ETag']
+                again = await client.get('/leaderboard?board=level&player=p1',
+                                         headers={'If-None-Match': etag})
+                ws = await client.ws_connect('/spectate?cam=boss')
+                roster = await ws.receive_json(timeout=5)
+                await ws.close()
+            await worker.session.close()
+        return body, again.status, roster
+
+    body, status, roster = asyncio.run(run())
+    assert body['me'] == [2, 2]
+    assert status == 304
+    assert roster['type'] == 'roster'
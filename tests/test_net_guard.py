@@ -0,0 +1,23 @@
+from net_guard import ConnectionGuard, stats
+
+
+def test_huge_integer_is_a_schema_reject():
+    guard = ConnectionGuard()
+    before = stats.rejected.get('schema', 0)
+    raw = '{"type":"move","dirX":%s,"dirY":0}' % ('9' * 400)
+    assert len(raw) <= 512
+    assert guard.check(raw) is None
+    assert stats.rejected.get('schema', 0) == before + 1
+
+
+def test_out_of_range_numbers_are_rejected():
+    guard = ConnectionGuard()
+    assert guard.check('{"type":"move","dirX":1e999,"dirY":0}') is None
+    assert guard.check('{"type":"skill","skillId":%s}' % ('9' * 40)) is None
+
+
+def test_normal_input_still_passes():
+    guard = ConnectionGuard()
+    data = guard.check('{"type":"attack","dirX":3,"dirY":4,"vt":1792416494.7}')
+    assert data == {'type': 'attack', 'dirX': 0.6, 'dirY': 0.8,
+                    'vt': 1792416494.7}
@@ -0,0 +1,90 @@
+import json
+
+import game_server
+from replication import ENTITY_BYTE_BUDGET, Snapshot, ViewScheduler
+
+
+def _viewer():
+    viewer = game_server.Player('viewer', 'viewer')
+    viewer.x, viewer.y = 1000, 1000
+    return viewer
+
+
+def _monsters(count, x=1000, spread=10):
+    return [
+        game_server.Monster(f'm{i}', x + i * spread, 1000, 'BASIC')
+        for i in range(count)
+    ]
+
+
+def _ids(fragments):
+    return [json.loads(f)['spawn_id'] for f in fragments]
+
+
+def test_budget_defers_entities_and_sends_them_later():
+    viewer = _viewer()
+    monsters = _monsters(60)
+    snapshot = Snapshot([viewer], monsters)
+    view = ViewScheduler()
+
+    _, first, gone = view.select(viewer, snapshot)
+    size = sum(len(f) + 1 for f in first)
+    assert gone == [] and 0 < size <= ENTITY_BYTE_BUDGET
+    assert view.deferred == 60 - len(first)
+
+    seen = set(_ids(first))
+    for _ in range(5):
+        seen.update(_ids(view.select(viewer, snapshot)[1]))
+    assert seen == {m.spawn_id for m in monsters}
+
+
+def test_near_and_targeting_entities_are_sent_more_often():
+    viewer = _viewer()
+    near = _monsters(30, x=1000, spread=1)
+    far = _monsters(30, x=100000, spread=1)
+    for i, monster in enumerate(far):
+        monster.spawn_id = f'far{i}'
+    chaser = far[0]
+    chaser.target_player = viewer.id
+    snapshot = Snapshot([viewer], near + far)
+    view = ViewScheduler()
+    view.select(viewer, snapshot)
+
+    counts = {}
+    for _ in range(30):
+        for spawn_id in _ids(view.select(viewer, snapshot)[1]):
+            counts[spawn_id] = counts.get(spawn_id, 0) + 1
+    near_sends = sum(counts.get(m.spawn_id, 0) for m in near) / len(near)
+    far_sends = sum(counts.get(m.spawn_id, 0) for m in far[1:]) / (len(far) - 1)
+    assert near_sends > far_sends
+    assert counts['far0'] > far_sends
+
+
+def test_removed_and_out_of_range_entities_are_reported_gone_once():
+    viewer = _viewer()
+    a, b, c = _monsters(3, spread=100)
+    view = ViewScheduler()
+    view.select(viewer, Snapshot([viewer], [a, b, c]))
+
+    _, _, gone = view.select(viewer, Snapshot([viewer], [a, c]))
+    assert gone == ['mm1']
+    _, _, gone = view.select(viewer, Snapshot([viewer], [a, c]))
+    assert gone == []
+
+    c.x = viewer.x + 5000
+    _, _, gone = view.select(viewer, Snapshot([viewer], [a, c]), 1200)
+    assert gone == ['mm2']
+
+
+def test_reset_resends_everything_and_flags_a_resync():
+    viewer = _viewer()
+    monsters = _monsters(3)
+    snapshot = Snapshot([viewer], monsters)
+    view = ViewScheduler()
+    view.select(viewer, snapshot)
+    assert not view.resync
+
+    view.reset()
+    assert view.resync
+    _, sent, gone = view.select(viewer, snapshot)
+    assert sorted(_ids(sent)) == ['m0', 'm1', 'm2'] and gone == []
@@ -0,0 +1,80 @@
+import asyncio
+
+import game_server
+from combat import EV_HIT
+
+
+class Socket:
+
+    def __init__(self):
+        self.closed = False
+
+    async def close(self, **kwargs):
+        self.closed = True
+
+
+def _join(token='', since_tick=0):
+    return asyncio.run(game_server.join_player(Socket(), token, since_tick))
+
+
+def test_resume_token_reattaches_the_same_player(monkeypatch):
+    game = game_server.GameState()
+    monkeypatch.setattr(game_server, 'game', game)
+    player, hello = _join()
+    assert hello['type'] == 'connected'
+    old_ws = player.ws
+    player.gold = 1234
+    player.input_seq = 9
+    game.detach_player(player)
+
+    again, hello = _join(hello['resumeToken'])
+    assert again is player
+    assert hello['type'] == 'resumed' and hello['playerId'] == player.id
+    assert player.ws is not old_ws and player.detached_at is None
+    assert player.gold == 1234
+    assert player.input_seq == 0
+    assert player.sent_inventory_version == -1 and player.view.resync
+
+
+def test_resume_replaces_a_still_open_socket(monkeypatch):
+    monkeypatch.setattr(game_server, 'game', game_server.GameState())
+    player, hello = _join()
+    old_ws = player.ws
+    _join(hello['resumeToken'])
+    assert old_ws.closed
+
+
+def test_resume_replays_missed_events(monkeypatch):
+    game = game_server.GameState()
+    monkeypatch.setattr(game_server, 'game', game)
+    player, hello = _join()
+    game.detach_player(player)
+    mine = [EV_HIT, 0, 0, 'm1', player.id, 4]
+    other = [EV_HIT, 0, 0, 'm1', 'someone', 4]
+    game.event_history.append((5, [mine, other]))
+    game.event_history.append((6, [list(mine)]))
+
+    _, hello = _join(hello['resumeToken'], since_tick=5)
+    assert hello['missed'] == [mine]
+
+
+def test_unknown_token_creates_a_new_player(monkeypatch):
+    game = game_server.GameState()
+    monkeypatch.setattr(game_server, 'game', game)
+    first, _ = _join()
+    second, hello = _join('not-a-token')
+    assert hello['type'] == 'connected'
+    assert second is not first
+    assert len(game.players) == 2
+
+
+def test_detached_player_expires_after_the_grace_period(monkeypatch):
+    game = game_server.GameState()
+    monkeypatch.setattr(game_server, 'game', game)
+    player, hello = _join()
+    game.detach_player(player)
+    game.prune_detached(player.detached_at + game_server.RESUME_GRACE - 1)
+    assert player.id in game.players
+    game.prune_detached(player.detached_at + game_server.RESUME_GRACE + 1)
+    assert player.id not in game.players
+    assert hello['resumeToken'] not in game.sessions
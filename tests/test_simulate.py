@@ -0,0 +1,56 @@
+import csv
+import subprocess
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def _simulate(*args):
+    result = subprocess.run(
+        [sys.executable, 'simulate.py', '--runs', '1', '--workers', '1',
+         '--max-time', '60', *args],
+        cwd=ROOT, capture_output=True, text=True, timeout=120)
+    assert result.returncode == 0, result.stderr
+    return result.stdout
+
+
+def _rows(path):
+    with open(path, newline='') as f:
+        return list(csv.DictReader(f))
+
+
+def test_single_run_prints_table_and_csv(tmp_path):
+    out = tmp_path / 'runs.csv'
+    stdout = _simulate('--weapons', 'E_WEAPON_BASIC,none', '--csv', str(out))
+
+    lines = stdout.splitlines()
+    assert lines[0].split()[:2] == ['target', 'weapon']
+    assert any('E_WEAPON_BASIC' in line for line in lines[2:])
+    assert '2 runs,' in stdout
+
+    rows = _rows(out)
+    assert sorted(r['weapon'] for r in rows) == ['E_WEAPON_BASIC', 'none']
+    assert all(int(r['ticks']) > 0 for r in rows)
+
+
+def test_same_seed_is_reproducible(tmp_path):
+    first, second = tmp_path / 'a.csv', tmp_path / 'b.csv'
+    _simulate('--weapons', 'R_WEAPON_BASIC', '--seed', '7', '--csv',
+              str(first))
+    _simulate('--weapons', 'R_WEAPON_BASIC', '--seed', '7', '--csv',
+              str(second))
+
+    def strip(rows):
+        # cpuMs 是實際耗時，不在可重現範圍內
+        return [{k: v for k, v in r.items() if k != 'cpuMs'} for r in rows]
+
+    assert strip(_rows(first)) == strip(_rows(second))
+
+
+def test_unknown_weapon_is_rejected():
+    result = subprocess.run(
+        [sys.executable, 'simulate.py', '--runs', '1', '--weapons', 'NOPE'],
+        cwd=ROOT, capture_output=True, text=True, timeout=60)
+    assert result.returncode != 0
+    assert 'Unknown weapon: NOPE' in result.stderr
@@ -0,0 +1,90 @@
+from types import SimpleNamespace
+
+import spawner
+from spawner import IDLE_DESPAWN, MAX_SPAWNS_PER_PASS, Spawner
+
+REGIONS = [{
+    'x': 0,
+    'y': 0,
+    'w': 500,
+    'h': 500,
+    'types': {'BASIC': 1},
+    'cap': 6
+}, {
+    'x': 3000,
+    'y': 3000,
+    'w': 500,
+    'h': 500,
+    'types': {'BASIC': 1}
+}]
+
+
+def _player(player_id, x=250, y=250):
+    return SimpleNamespace(id=player_id, x=x, y=y, alive=True)
+
+
+def _monster(region, target=None):
+    return SimpleNamespace(region=region, alive=True, target_player=target)
+
+
+def _fill(spawn, now, players, monsters, passes=10):
+    # 反覆執行生怪，直到不再生成
+    for i in range(passes):
+        spawns, despawns = spawn.plan(now + i, players, monsters, len(players))
+        for region, _, x, y in spawns:
+            monsters.append(_monster(region))
+        removed = {id(m) for m in despawns}
+        monsters[:] = [m for m in monsters if id(m) not in removed]
+    return monsters
+
+
+def test_density_sets_the_region_target_up_to_its_cap():
+    spawn = Spawner(REGIONS, 30)
+    monsters = _fill(spawn, 0.0, [_player('a')], [])
+    assert [m.region for m in monsters] == [0] * 4  # ceil(1 + 2.5)
+
+    players = [_player(str(i)) for i in range(10)]
+    monsters = _fill(spawn, 100.0, players, monsters)
+    assert len(monsters) == REGIONS[0]['cap']
+    assert spawn.regions[1].target() == 0
+
+
+def test_spawns_per_pass_are_limited_and_inside_the_region():
+    spawn = Spawner(REGIONS, 30)
+    spawns, _ = spawn.plan(0.0, [_player(str(i)) for i in range(10)], [], 10)
+    assert len(spawns) == MAX_SPAWNS_PER_PASS
+    for region, monster_type, x, y in spawns:
+        assert region == 0 and monster_type == 'BASIC'
+        assert 30 <= x <= 470 and 30 <= y <= 470
+
+
+def test_over_tick_budget_stops_spawning_and_sheds_idle_monsters():
+    spawn = Spawner(REGIONS, 30)
+    monsters = _fill(spawn, 0.0, [_player('a')], [])
+    # 模擬每 tick 已經用掉整個預算
+    for _ in range(200):
+        spawn.record_tick(1 / 30, len(monsters) + 1)
+    spawns, despawns = spawn.plan(20.0, [_player('a')], monsters, 1)
+    assert spawns == []
+    assert spawn.budget < len(monsters)
+    assert len(despawns) == len(monsters) - spawn.budget
+
+
+def test_hard_cap_applies_even_when_cheap(monkeypatch):
+    monkeypatch.setattr(spawner, 'MAX_MONSTERS', 3)
+    spawn = Spawner(REGIONS, 30)
+    monsters = _fill(spawn, 0.0, [_player(str(i)) for i in range(10)], [])
+    assert len(monsters) == 3
+
+
+def test_idle_region_despawns_all_but_chasers():
+    spawn = Spawner(REGIONS, 30)
+    present = _player('a', x=3250, y=3250)
+    chaser = _monster(0, target='a')
+    idle = [_monster(0) for _ in range(3)]
+    monsters = idle + [chaser]
+    spawn.plan(0.0, [present], monsters, 1)
+    _, despawns = spawn.plan(IDLE_DESPAWN - 1, [present], monsters, 1)
+    assert despawns == []
+    _, despawns = spawn.plan(IDLE_DESPAWN + 1, [present], monsters, 1)
+    assert despawns == idle
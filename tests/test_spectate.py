@@ -0,0 +1,68 @@
+import asyncio
+
+import game_server
+from spectate import MAX_CAMERAS, VIEWER_BACKLOG, SpectatorHub
+
+
+def test_unknown_player_targets_share_the_boss_camera(monkeypatch):
+    hub = SpectatorHub()
+    monkeypatch.setattr(game_server, 'spectators', hub)
+    for i in range(50):
+        game_server.subscribe_spectator(object(), 'player', f'made-up-{i}')
+    assert list(hub.cameras) == [('boss', )]
+    assert len(hub) == 50
+
+
+def test_camera_count_is_capped():
+    hub = SpectatorHub()
+    for i in range(MAX_CAMERAS + 10):
+        hub.subscribe(object(), 'player', f'p{i}')
+    assert len(hub.cameras) == MAX_CAMERAS
+    assert hub.subscribe(object(), 'boss') is not None
+
+
+class StuckSocket:
+    closed = False
+
+    def __init__(self):
+        self.sent = 0
+
+    async def send_shared(self, frame):
+        self.sent += 1
+        await asyncio.Event().wait()
+
+
+class FastSocket(StuckSocket):
+
+    async def send_shared(self, frame):
+        self.sent += 1
+
+
+class Transport:
+    aborted = False
+
+    def abort(self):
+        self.aborted = True
+
+
+def test_lagging_viewer_is_dropped_without_stalling_the_others():
+
+    async def run():
+        hub = SpectatorHub()
+        stuck, fast, transport = StuckSocket(), FastSocket(), Transport()
+        hub.connect(stuck, transport)
+        hub.connect(fast)
+        hub.subscribe(stuck, 'boss')
+        hub.subscribe(fast, 'boss')
+        for _ in range(VIEWER_BACKLOG + 5):
+            # fan_out 不能等任何一條連線
+            hub.fan_out(list(hub.viewers), b'{"type":"roster"}')
+            await asyncio.sleep(0)
+        await asyncio.sleep(0)
+        return hub, stuck, fast, transport
+
+    hub, stuck, fast, transport = asyncio.run(run())
+    assert fast.sent == VIEWER_BACKLOG + 5
+    assert transport.aborted
+    assert hub.lagging == 1
+    assert list(hub.viewers) == [fast]
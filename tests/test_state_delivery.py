@@ -0,0 +1,39 @@
+import asyncio
+import json
+
+import game_server
+
+
+class FlakySocket:
+    closed = False
+
+    def __init__(self, failures):
+        self.failures = failures
+        self.sent = []
+
+    async def send_str(self, data, compress=None):
+        if self.failures:
+            self.failures -= 1
+            raise ConnectionResetError()
+        self.sent.append(json.loads(data))
+
+
+def test_failed_send_resends_the_inventory(monkeypatch):
+    game = game_server.GameState()
+    monkeypatch.setattr(game_server, 'game', game)
+    player = game_server.Player('p1', 'one')
+    game.add_player(player)
+    player.ws = FlakySocket(failures=1)
+
+    asyncio.run(game_server.broadcast_state())
+    assert player.ws.sent == []
+    assert player.sent_inventory_version == -1
+
+    asyncio.run(game_server.broadcast_state())
+    first = player.ws.sent[-1]
+    assert first['resync'] is True
+    assert first['you']['inventory'][0]['id'] == 'healing_potion'
+
+    asyncio.run(game_server.broadcast_state())
+    assert 'inventory' not in player.ws.sent[-1]['you']
+    assert 'resync' not in player.ws.sent[-1]
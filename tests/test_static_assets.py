@@ -0,0 +1,116 @@
+import asyncio
+
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
+from yarl import URL
+
+import game_server
+from static_assets import StaticAsset, StaticAssets, parse_accept_encoding
+
+TRAVERSALS = [
+    '/static/..%2Fgame_server.py',
+    '/static/%2E%2E%2Fgame_server.py',
+    '/static/%2E%2E/game_server.py',
+    '/static/..%5Cgame_server.py',
+    '/static/%2Fetc%2Fpasswd',
+    '/static/..%2Fworld.ckpt',
+]
+
+
+def _get_all(app, paths):
+
+    async def run():
+        async with TestClient(TestServer(app)) as client:
+            statuses = []
+            for path in paths:
+                resp = await client.get(URL(path, encoded=True))
+                statuses.append(resp.status)
+            return statuses
+
+    return asyncio.run(run())
+
+
+def test_encoded_traversal_is_rejected():
+    app = web.Application()
+    app.router.add_get('/static/{path:.+}', game_server.static_handler)
+    assert _get_all(app, TRAVERSALS) == [404] * len(TRAVERSALS)
+
+
+def test_bundle_root_serves_only_its_own_files(tmp_path):
+    bundle_dir = tmp_path / 'static'
+    bundle_dir.mkdir()
+    (bundle_dir / 'app.js').write_text('console.log(1);')
+    (tmp_path / 'secret.txt').write_text('secret')
+    bundles = StaticAssets(str(bundle_dir))
+
+    async def handler(request):
+        return await bundles.serve(request, request.match_info['path'])
+
+    app = web.Application()
+    app.router.add_get('/static/{path:.+}', handler)
+    assert _get_all(app, [
+        '/static/app.js', '/static/..%2Fsecret.txt',
+        '/static/%2E%2E%2Fsecret.txt', '/static/sub%2F..%2F..%2Fsecret.txt'
+    ]) == [200, 404, 404, 404]
+
+
+def _text_asset():
+    asset = StaticAsset('app.js', b'console.log(1);\n' * 100, 0,
+                        'no-cache')
+    asset.br = b'br-body'  # brotli 為選用套件，測試時直接給壓縮結果
+    return asset
+
+
+def test_accept_encoding_q_values():
+    assert parse_accept_encoding('gzip, br;q=0, *;q=0.5') == {
+        'gzip': 1.0,
+        'br': 0.0,
+        '*': 0.5
+    }
+    assert parse_accept_encoding('GZIP ; Q=0.3, br;q=oops') == {
+        'gzip': 0.3,
+        'br': 0.0
+    }
+
+
+def test_negotiation_respects_refused_codings():
+    asset = _text_asset()
+    tag = asset.hash
+    assert asset.negotiate('gzip, br')[::2] == ('br', f'"{tag}-br"')
+    assert asset.negotiate('gzip, br;q=0')[::2] == ('gzip', f'"{tag}-gz"')
+    assert asset.negotiate('br;q=0.5, gzip')[0] == 'gzip'
+    assert asset.negotiate('deflate, brotli')[0] is None
+    assert asset.negotiate('*;q=0.1, br;q=0')[0] == 'gzip'
+    assert asset.negotiate('br;q=0, gzip;q=0') == (None, asset.body,
+                                                   f'"{tag}"')
+
+
+def test_not_modified_keeps_encoding_etag(tmp_path):
+    (tmp_path / 'app.js').write_text('console.log(1);\n' * 100)
+    assets = StaticAssets(str(tmp_path))
+
+    async def handler(request):
+        return await assets.serve(request, 'app.js')
+
+    app = web.Application()
+    app.router.add_get('/app.js', handler)
+
+    async def run():
+        async with TestClient(TestServer(app)) as client:
+            gz = {'Accept-Encoding': 'gzip, br;q=0'}
+            first = await client.get('/app.js', headers=gz)
+            etag = first.headers['ETag']
+            again = await client.get('/app.js',
+                                     headers={**gz, 'If-None-Match': etag})
+            plain = await client.get('/app.js',
+                                     headers={
+                                         'Accept-Encoding': 'identity',
+                                         'If-None-Match': etag
+                                     })
+            return first, etag, again, plain
+
+    first, etag, again, plain = asyncio.run(run())
+    assert first.status == 200 and etag.endswith('-gz"')
+    assert again.status == 304 and again.headers['ETag'] == etag
+    # 不同編碼是不同的表示，舊的 ETag 不能讓它回 304
+    assert plain.status == 200 and plain.headers['ETag'] == etag[:-4] + '"'
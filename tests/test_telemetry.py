@@ -0,0 +1,67 @@
+import gzip
+import json
+import os
+
+import game_server
+import telemetry as telemetry_module
+from telemetry import Telemetry
+
+
+def _lines(directory):
+    lines = []
+    for name in sorted(os.listdir(directory)):
+        with gzip.open(os.path.join(directory, name), 'rt') as f:
+            lines.extend(json.loads(line) for line in f)
+    return lines
+
+
+def test_batches_append_as_ndjson_and_rotate_by_size(tmp_path, monkeypatch):
+    monkeypatch.setattr(telemetry_module, 'ROTATE_BYTES', 1)
+    telemetry = Telemetry(str(tmp_path), sample_rates={})
+    telemetry.emit('gold', 'p1', 10, 'kill', 510)
+    telemetry._write()
+    telemetry.emit('upgrade', 'p1', 'R_WEAPON_BASIC', 2, 100)
+    telemetry.emit('bogus', 1)
+    telemetry._write()
+    telemetry.close()
+
+    assert telemetry.files == 2
+    assert len(os.listdir(tmp_path)) == 2
+    lines = _lines(tmp_path)
+    assert [line['k'] for line in lines] == ['gold', 'upgrade']
+    assert lines[0]['reason'] == 'kill' and lines[0]['balance'] == 510
+    assert telemetry.malformed == 1
+
+
+def test_batches_share_a_file_until_it_is_full(tmp_path):
+    telemetry = Telemetry(str(tmp_path), sample_rates={})
+    for amount in range(3):
+        telemetry.emit('gold', 'p1', amount, 'kill', amount)
+        telemetry._write()
+    telemetry.close()
+    assert len(os.listdir(tmp_path)) == 1
+    assert [line['delta'] for line in _lines(tmp_path)] == [0, 1, 2]
+
+
+def test_per_kind_limit_keeps_other_events(tmp_path):
+    telemetry = Telemetry(str(tmp_path), sample_rates={})
+    for _ in range(100):
+        telemetry.emit('error', 'message', 'boom')
+    telemetry.emit('gold', 'p1', 1, 'kill', 1)
+    kinds = [kind for _, kind, _ in telemetry.buffer]
+    assert kinds.count('error') == telemetry_module.KIND_LIMITS['error']
+    assert kinds[-1] == 'gold'
+
+
+def test_expired_sessions_are_recorded_not_printed(monkeypatch, capsys):
+    recorder = Telemetry('unused', sample_rates={})
+    monkeypatch.setattr(game_server, 'telemetry', recorder)
+    game = game_server.GameState()
+    player = game_server.Player('p1', 'one')
+    game.add_player(player)
+    game.detach_player(player)
+    game.prune_detached(player.detached_at + game_server.RESUME_GRACE + 1)
+    assert 'p1' not in game.players
+    assert [(kind, values) for _, kind, values in recorder.buffer
+            ] == [('session', ('p1', 'expire'))]
+    assert capsys.readouterr().out == ''
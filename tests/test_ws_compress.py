@@ -0,0 +1,71 @@
+import asyncio
+
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
+
+import ws_compress
+from ws_compress import SharedFrame, TunedWebSocketResponse
+
+PAYLOAD = '{"type":"state","players":[' + ','.join(['{"x":1,"y":2}'] * 50) + ']}'
+
+
+def _round_trip():
+
+    async def handler(request):
+        ws = TunedWebSocketResponse('spectator')
+        await ws.prepare(request)
+        await ws.send_str(PAYLOAD)
+        await ws.send_shared(SharedFrame(PAYLOAD.encode()))
+        await ws.close()
+        return ws
+
+    async def run():
+        app = web.Application()
+        app.router.add_get('/ws', handler)
+        async with TestClient(TestServer(app)) as client:
+            ws = await client.ws_connect('/ws', compress=15)
+            return [await ws.receive_str(), await ws.receive_str()]
+
+    return asyncio.run(run())
+
+
+def test_direct_write():
+    assert _round_trip() == [PAYLOAD, PAYLOAD]
+
+
+def test_falls_back_when_aiohttp_internals_are_missing(monkeypatch):
+    monkeypatch.setattr(ws_compress, 'direct_write_supported',
+                        lambda writer: False)
+    before = ws_compress.stats['spectator'].fallback_frames
+    assert _round_trip() == [PAYLOAD, PAYLOAD]
+    assert ws_compress.stats['spectator'].fallback_frames == before + 2
+
+
+def test_no_direct_write_after_close_frame():
+
+    async def handler(request):
+        ws = TunedWebSocketResponse('spectator')
+        await ws.prepare(request)
+        # 關閉 frame 已送出、還在等對方回應
+        closing = asyncio.create_task(ws.close())
+        await asyncio.sleep(0)
+        try:
+            await ws.send_str(PAYLOAD)
+        except ConnectionResetError:
+            errors.append('reset')
+        await closing
+        return ws
+
+    async def run():
+        app = web.Application()
+        app.router.add_get('/ws', handler)
+        async with TestClient(TestServer(app)) as client:
+            ws = await client.ws_connect('/ws', compress=15)
+            messages = []
+            async for msg in ws:
+                messages.append(msg.type)
+            return messages
+
+    errors = []
+    assert asyncio.run(run()) == []
+    assert errors == ['reset']
@@ -0,0 +1,217 @@
+import time
+import zlib
+from typing import Dict, Optional
+
+from aiohttp import hdrs, web
+
+# permessage-deflate 壓縮後要去掉的結尾（RFC 7692 7.2.1）
+_DEFLATE_TRAILER = b'\x00\x00\xff\xff'
+_RSV1 = 0x40
+
+
+class CompressionProfile:
+
+    def __init__(self,
+                 enabled=True,
+                 window_bits=15,
+                 context_takeover=False,
+                 min_size=256,
+                 level=6):
+        self.enabled = enabled
+        self.window_bits = window_bits  # 9 ~ 15，越小越省記憶體、壓縮率越差
+        # 保留上下文時每條連線各自壓縮（壓縮率較好）；不保留時共用訊息只壓縮一次
+        self.context_takeover = context_takeover
+        self.min_size = min_size  # 小於此大小直接送原文
+        self.level = level
+
+
+# 每種連線一組設定：玩家的狀態訊息每人不同，保留上下文讓重複的欄位名稱幾乎免費；
+# 觀戰是大量觀眾共用同一份資料，不保留上下文才能只壓縮一次
+PROFILES = {
+    'player': CompressionProfile(window_bits=13, context_takeover=True,
+                                 min_size=200, level=6),
+    'spectator': CompressionProfile(window_bits=15, context_takeover=False,
+                                    min_size=200, level=6),
+}
+
+
+class CompressionStats:
+
+    def __init__(self):
+        self.frames = 0
+        self.raw_frames = 0
+        self.fallback_frames = 0
+        self.shared_reuses = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.cpu_time = 0.0
+
+    def to_dict(self):
+        return {
+            'frames': self.frames,
+            'rawFrames': self.raw_frames,
+            'fallbackFrames': self.fallback_frames,
+            'sharedReuses': self.shared_reuses,
+            'bytesIn': self.bytes_in,
+            'bytesOut': self.bytes_out,
+            'ratio': round(self.bytes_out / self.bytes_in, 4)
+            if self.bytes_in else None,
+            'cpuMs': round(self.cpu_time * 1000, 3)
+        }
+
+
+stats: Dict[str, CompressionStats] = {
+    name: CompressionStats()
+    for name in PROFILES
+}
+
+
+def _deflate(compressor, data: bytes, flush_mode) -> bytes:
+    out = compressor.compress(data) + compressor.flush(flush_mode)
+    if out.endswith(_DEFLATE_TRAILER):
+        out = out[:-4]
+    return out
+
+
+# 直接寫 frame 需要的 aiohttp 內部成員；任何一個不存在就退回 aiohttp 自己的壓縮。
+# 在 aiohttp 3.13.2 與 3.14.5 上確認過，pyproject.toml 的版本範圍跟著這裡
+_WRITER_INTERNALS = ('_write_websocket_frame', '_output_size', '_limit',
+                     '_closing')
+_PROTOCOL_INTERNALS = ('_paused', '_drain_helper')
+
+
+def direct_write_supported(writer) -> bool:
+    protocol = getattr(writer, 'protocol', None)
+    return (all(hasattr(writer, name) for name in _WRITER_INTERNALS)
+            and all(hasattr(protocol, name) for name in _PROTOCOL_INTERNALS))
+
+
+class SharedFrame:
+    # 要送給很多連線的同一份訊息：每種 (window bits, 壓縮等級) 只壓縮一次
+
+    __slots__ = ('payload', 'deflated')
+
+    def __init__(self, payload: bytes):
+        self.payload = payload
+        self.deflated: Dict[tuple, bytes] = {}
+
+    def compressed(self, window_bits, level, class_stats: CompressionStats):
+        key = (window_bits, level)
+        data = self.deflated.get(key)
+        if data is not None:
+            class_stats.shared_reuses += 1
+            return data
+        started = time.thread_time()
+        data = _deflate(zlib.compressobj(level, zlib.DEFLATED, -window_bits),
+                        self.payload, zlib.Z_SYNC_FLUSH)
+        class_stats.cpu_time += time.thread_time() - started
+        self.deflated[key] = data
+        return data
+
+
+class TunedWebSocketResponse(web.WebSocketResponse):
+    # 依連線種類協商 permessage-deflate，並由這裡自行壓縮，不用 aiohttp 內建的
+    # 固定參數壓縮。寫入 frame 需要 aiohttp 3.13 起的 WebSocketWriter 內部方法；
+    # 新版 aiohttp 沒有這些成員時改用 send_frame，由 aiohttp 依協商結果壓縮
+
+    def __init__(self, connection_class, **kwargs):
+        self.connection_class = connection_class
+        self.profile = PROFILES[connection_class]
+        self.stats = stats[connection_class]
+        self._deflater = None
+        self._direct: Optional[bool] = None
+        super().__init__(compress=self.profile.enabled, **kwargs)
+
+    def _handshake(self, request):
+        result = super()._handshake(request)
+        if not isinstance(result, tuple) or len(result) != 4:
+            return result
+        headers, protocol, compress, notakeover = result
+        if compress:
+            # 伺服器可以自行縮小視窗、宣告不保留上下文（RFC 7692 7.1.1.1、7.1.2.1）
+            compress = min(compress, self.profile.window_bits)
+            notakeover = notakeover or not self.profile.context_takeover
+            extension = ['permessage-deflate']
+            if compress < 15:
+                extension.append(f'server_max_window_bits={compress}')
+            if notakeover:
+                extension.append('server_no_context_takeover')
+            headers[hdrs.SEC_WEBSOCKET_EXTENSIONS] = '; '.join(extension)
+        return headers, protocol, compress, notakeover
+
+    @property
+    def direct(self):
+        if self._direct is None and self._writer is not None:
+            self._direct = direct_write_supported(self._writer)
+        return bool(self._direct)
+
+    @property
+    def takeover(self):
+        writer = self._writer
+        return writer is not None and not writer.notakeover
+
+    async def _write(self, data: bytes, opcode, rsv):
+        writer = self._writer
+        if writer is None:
+            raise RuntimeError('Call .prepare() first')
+        # 與 aiohttp 的 send_frame 相同：送出關閉 frame 之後不能再寫資料
+        if self._closing or writer._closing:
+            raise ConnectionResetError('Cannot write to closing transport')
+        writer._write_websocket_frame(data, opcode, rsv)
+        if writer._output_size > writer._limit:
+            writer._output_size = 0
+            if writer.protocol._paused:
+                await writer.protocol._drain_helper()
+
+    async def _send(self, message: bytes, opcode, shared: Optional[SharedFrame] = None):
+        class_stats = self.stats
+        class_stats.frames += 1
+        class_stats.bytes_in += len(message)
+        if not self.direct:
+            class_stats.fallback_frames += 1
+            await super().send_frame(message, opcode)
+            return
+        if not self.compress or len(message) < self.profile.min_size:
+            class_stats.raw_frames += 1
+            class_stats.bytes_out += len(message)
+            await self._write(message, opcode, 0)
+            return
+
+        window_bits = self.compress
+        if shared is not None and not self.takeover:
+            data = shared.compressed(window_bits, self.profile.level,
+                                     class_stats)
+        else:
+            started = time.thread_time()
+            if self.takeover:
+                if self._deflater is None:
+                    self._deflater = zlib.compressobj(self.profile.level,
+                                                      zlib.DEFLATED,
+                                                      -window_bits)
+                data = _deflate(self._deflater, message, zlib.Z_SYNC_FLUSH)
+            else:
+                data = _deflate(
+                    zlib.compressobj(self.profile.level, zlib.DEFLATED,
+                                     -window_bits), message, zlib.Z_SYNC_FLUSH)
+            class_stats.cpu_time += time.thread_time() - started
+        class_stats.bytes_out += len(data)
+        await self._write(data, opcode, _RSV1)
+
+    async def send_frame(self, message, opcode, compress=None):
+        if opcode >= 8:
+            await super().send_frame(message, opcode)
+            return
+        await self._send(message, opcode)
+
+    async def send_str(self, data, compress=None):
+        await self._send(data.encode('utf-8'), web.WSMsgType.TEXT)
+
+    async def send_bytes(self, data, compress=None):
+        await self._send(bytes(data), web.WSMsgType.BINARY)
+
+    async def send_shared(self, frame: SharedFrame):
+        await self._send(frame.payload, web.WSMsgType.TEXT, frame)
+
+
+def stats_dict():
+    return {name: s.to_dict() for name, s in stats.items()}